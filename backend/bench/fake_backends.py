@@ -0,0 +1,300 @@
+"""Local stand-ins for Gemini and the Gmail, Calendar and OAuth REST APIs.
+
+Point the app at this server with:
+
+    GEMINI_API_ENDPOINT=http://127.0.0.1:9100
+    GOOGLE_API_ENDPOINT=http://127.0.0.1:9100/
+
+Run standalone with `python -m bench.fake_backends --port 9100`.
+"""
+import argparse
+import asyncio
+import base64
+import datetime
+import json
+import os
+import random
+import re
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+# Tunables, read from the environment so loadtest.py can pass them to a subprocess
+GEMINI_LATENCY_MS = float(os.getenv("FAKE_GEMINI_LATENCY_MS", "800"))
+GEMINI_JITTER_MS = float(os.getenv("FAKE_GEMINI_JITTER_MS", "200"))
+GEMINI_429_RATE = float(os.getenv("FAKE_GEMINI_429_RATE", "0.0"))
+GEMINI_STREAM_CHUNKS = int(os.getenv("FAKE_GEMINI_STREAM_CHUNKS", "8"))
+GEMINI_OUTPUT_WORDS = int(os.getenv("FAKE_GEMINI_OUTPUT_WORDS", "300"))
+GOOGLE_LATENCY_MS = float(os.getenv("FAKE_GOOGLE_LATENCY_MS", "60"))
+UNREAD_COUNT = int(os.getenv("FAKE_UNREAD_COUNT", "5"))
+
+WORDS = (
+    "project timeline review budget meeting deliverable risk milestone team "
+    "quarter roadmap feedback launch customer metric update plan design"
+).split()
+
+
+async def _sleep(latency_ms, jitter_ms=0.0):
+    delay = latency_ms + random.uniform(-jitter_ms, jitter_ms)
+    await asyncio.sleep(max(delay, 0) / 1000)
+
+
+def _lorem(words):
+    return " ".join(random.choice(WORDS) for _ in range(words))
+
+
+def _gemini_chunk(text, prompt_tokens, completion_tokens, final=True):
+    candidate = {"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}
+    if final:
+        candidate["finishReason"] = 1
+    return {
+        "candidates": [candidate],
+        "usageMetadata": {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": completion_tokens,
+            "totalTokenCount": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def _quota_error():
+    return JSONResponse(
+        {"error": {"code": 429, "message": "Resource has been exhausted (e.g. check quota).", "status": "RESOURCE_EXHAUSTED"}},
+        status_code=429
+    )
+
+
+def _prompt_tokens(body):
+    text = json.dumps(body.get("contents", []))
+    return max(1, len(text) // 4)
+
+
+def _reply_text(body):
+    prompt = json.dumps(body.get("contents", []))
+    if "Return a JSON object" in prompt:
+        # Calendar event parsing
+        day = (datetime.date.today() + datetime.timedelta(days=1)).isoformat()
+        return json.dumps({
+            "summary": "Planning sync",
+            "start_date": day,
+            "start_time": "14:00",
+            "end_date": day,
+            "end_time": "15:00",
+            "location": "",
+            "description": "",
+        })
+    return _lorem(GEMINI_OUTPUT_WORDS)
+
+
+def _function_calls(body):
+    """Calls to declared tools named after words in the prompt, until tool results come back."""
+    prompt = json.dumps(body.get("contents", [])).lower()
+    if "functionResponse" in json.dumps(body.get("contents", [])):
+        return []
+    calls = []
+    for tool in body.get("tools", []):
+        for declaration in tool.get("functionDeclarations", []):
+            if any(word in prompt for word in declaration["name"].split("_")[1:]):
+                required = declaration.get("parameters", {}).get("required", [])
+                calls.append({"functionCall": {"name": declaration["name"], "args": {name: "budget" for name in required}}})
+    return calls[:2]
+
+
+async def generate_content(request: Request):
+    body = await request.json()
+    await _sleep(GEMINI_LATENCY_MS, GEMINI_JITTER_MS)
+    if random.random() < GEMINI_429_RATE:
+        return _quota_error()
+    calls = _function_calls(body)
+    if calls:
+        response = _gemini_chunk("", _prompt_tokens(body), 20)
+        response["candidates"][0]["content"]["parts"] = calls
+        return JSONResponse(response)
+    text = _reply_text(body)
+    return JSONResponse(_gemini_chunk(text, _prompt_tokens(body), len(text) // 4))
+
+
+async def stream_generate_content(request: Request):
+    body = await request.json()
+    if random.random() < GEMINI_429_RATE:
+        await _sleep(GEMINI_LATENCY_MS / 4)
+        return _quota_error()
+
+    text = _reply_text(body)
+    prompt_tokens = _prompt_tokens(body)
+    size = max(1, len(text) // GEMINI_STREAM_CHUNKS + 1)
+    pieces = [text[i:i + size] for i in range(0, len(text), size)]
+
+    async def chunks():
+        # REST streaming returns one JSON array, written incrementally
+        yield "["
+        for index, piece in enumerate(pieces):
+            await _sleep(GEMINI_LATENCY_MS / len(pieces), GEMINI_JITTER_MS / len(pieces))
+            final = index == len(pieces) - 1
+            completion_tokens = len(text) // 4 if final else 0
+            yield ("," if index else "") + json.dumps(_gemini_chunk(piece, prompt_tokens, completion_tokens, final))
+        yield "]"
+
+    return StreamingResponse(chunks(), media_type="application/json")
+
+
+async def count_tokens(request: Request):
+    body = await request.json()
+    return JSONResponse({"totalTokens": _prompt_tokens(body)})
+
+
+async def gemini(request: Request):
+    """Dispatch /v1beta/models/{model}:{method}."""
+    method = request.path_params["method"]
+    if method == "generateContent":
+        return await generate_content(request)
+    if method == "streamGenerateContent":
+        return await stream_generate_content(request)
+    if method == "countTokens":
+        return await count_tokens(request)
+    return JSONResponse({"error": {"code": 404, "message": f"Unknown method {method}"}}, status_code=404)
+
+
+def _message(message_id):
+    number = int(re.sub(r"\D", "", message_id) or 0)
+    body = f"Hi,\n\n{_lorem(120)}?\n\nCould you send the numbers by Friday?\n\nThanks,\nSender {number}"
+    return {
+        "id": message_id,
+        "threadId": f"t{number}",
+        "historyId": "1000",
+        "labelIds": ["UNREAD", "INBOX"],
+        "snippet": body[:100],
+        "payload": {
+            "mimeType": "multipart/alternative",
+            "headers": [
+                {"name": "From", "value": f"Sender {number} <sender{number}@example.com>"},
+                {"name": "To", "value": "bench@example.com"},
+                {"name": "Subject", "value": f"Q3 budget follow-up #{number}"},
+                {"name": "Message-ID", "value": f"<{message_id}@example.com>"},
+                {"name": "Date", "value": "Mon, 6 Oct 2026 09:00:00 +0000"},
+            ],
+            "parts": [
+                {
+                    "mimeType": "text/plain",
+                    "body": {"data": base64.urlsafe_b64encode(body.encode("utf-8")).decode("ascii")},
+                }
+            ],
+        },
+    }
+
+
+async def userinfo(request: Request):
+    await _sleep(GOOGLE_LATENCY_MS)
+    return JSONResponse({"id": "1", "email": "bench@example.com", "name": "Bench User", "verified_email": True})
+
+
+# Message-ID -> Gmail id of everything "sent", for rfc822msgid: searches
+_sent = {}
+# Mailbox historyId and calendar modification time; sending mail and creating events move them
+_versions = {"history_id": 1000, "calendar_updated": datetime.datetime(2026, 10, 1)}
+
+
+async def list_messages(request: Request):
+    await _sleep(GOOGLE_LATENCY_MS)
+    query = request.query_params.get("q", "")
+    if query.startswith("rfc822msgid:"):
+        found = _sent.get(query.split(":", 1)[1])
+        messages = [{"id": found, "threadId": "t1"}] if found else []
+        return JSONResponse({"messages": messages, "resultSizeEstimate": len(messages)})
+    messages = [{"id": f"m{i}", "threadId": f"t{i}"} for i in range(1, UNREAD_COUNT + 1)]
+    return JSONResponse({"messages": messages, "resultSizeEstimate": len(messages)})
+
+
+async def get_message(request: Request):
+    await _sleep(GOOGLE_LATENCY_MS)
+    return JSONResponse(_message(request.path_params["message_id"]))
+
+
+async def get_thread(request: Request):
+    await _sleep(GOOGLE_LATENCY_MS)
+    thread_id = request.path_params["thread_id"]
+    number = re.sub(r"\D", "", thread_id) or "0"
+    # The unread message replies to one the user sent earlier and quotes it
+    first = _message(f"m{number}")
+    first["id"] = f"m{number}-0"
+    first["payload"]["headers"][0]["value"] = "Bench User <bench@example.com>"
+    earlier_body = f"Hi,\n\nHere is the draft budget: {_lorem(40)}.\n\nBench"
+    first["payload"]["parts"][0]["body"]["data"] = base64.urlsafe_b64encode(earlier_body.encode("utf-8")).decode("ascii")
+    message = _message(f"m{number}")
+    quote = "\n".join(f"> {line}" for line in earlier_body.splitlines())
+    reply_body = f"{_lorem(60)}\n\nOn Mon, 6 Oct 2026 at 08:00, Bench User <bench@example.com> wrote:\n{quote}"
+    message["payload"]["parts"][0]["body"]["data"] = base64.urlsafe_b64encode(reply_body.encode("utf-8")).decode("ascii")
+    return JSONResponse({"id": thread_id, "historyId": message["historyId"], "messages": [first, message]})
+
+
+async def get_profile(request: Request):
+    await _sleep(GOOGLE_LATENCY_MS)
+    return JSONResponse({"emailAddress": "bench@example.com", "messagesTotal": 100, "historyId": str(_versions["history_id"])})
+
+
+async def send_message(request: Request):
+    await _sleep(GOOGLE_LATENCY_MS)
+    gmail_id = f"sent{random.randint(1, 10**9)}"
+    raw = base64.urlsafe_b64decode((await request.json())["raw"]).decode("utf-8", errors="replace")
+    match = re.search(r"^Message-ID: <([^>]+)>", raw, re.MULTILINE | re.IGNORECASE)
+    if match:
+        _sent[match.group(1)] = gmail_id
+    _versions["history_id"] += 1
+    return JSONResponse({"id": gmail_id, "threadId": "t1", "labelIds": ["SENT"]})
+
+
+async def list_messages_or_send(request: Request):
+    if request.method == "POST":
+        return await send_message(request)
+    return await list_messages(request)
+
+
+async def events(request: Request):
+    await _sleep(GOOGLE_LATENCY_MS)
+    if request.method == "POST":
+        event = await request.json()
+        event.update({"id": f"e{random.randint(1, 10**9)}", "htmlLink": "https://calendar.example.com/event"})
+        _versions["calendar_updated"] += datetime.timedelta(seconds=1)
+        return JSONResponse(event)
+
+    start = datetime.datetime.utcnow().replace(microsecond=0)
+    items = []
+    for i in range(10):
+        begins = start + datetime.timedelta(hours=4 * i)
+        items.append({
+            "id": f"e{i}",
+            "summary": f"Meeting {i}",
+            "updated": "2026-10-01T00:00:00.000Z",
+            "start": {"dateTime": begins.isoformat() + "Z"},
+            "end": {"dateTime": (begins + datetime.timedelta(hours=1)).isoformat() + "Z"},
+        })
+    updated = _versions["calendar_updated"].isoformat() + ".000Z"
+    return JSONResponse({"items": items, "updated": updated, "etag": '"fake-etag"'})
+
+
+routes = [
+    Route("/v1beta/models/{model}:{method}", gemini, methods=["POST"]),
+    Route("/oauth2/v2/userinfo", userinfo),
+    Route("/gmail/v1/users/me/messages", list_messages_or_send, methods=["GET", "POST"]),
+    Route("/gmail/v1/users/me/messages/send", send_message, methods=["POST"]),
+    Route("/gmail/v1/users/me/messages/{message_id}", get_message),
+    Route("/gmail/v1/users/me/threads/{thread_id}", get_thread),
+    Route("/gmail/v1/users/me/profile", get_profile),
+    # googleapiclient drops the service path when api_endpoint is overridden
+    Route("/calendars/primary/events", events, methods=["GET", "POST"]),
+    Route("/calendar/v3/calendars/primary/events", events, methods=["GET", "POST"]),
+]
+
+app = Starlette(routes=routes)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
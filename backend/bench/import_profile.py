@@ -0,0 +1,98 @@
+"""Import-time profile of the app, checked against a budget.
+
+Runs `python -X importtime -c "import main"` several times, summarizes the
+slowest modules and fails if the median cold import exceeds the budget or
+if any module that should be imported lazily shows up.
+
+    cd backend
+    python -m bench.import_profile            # check against the budget
+    python -m bench.import_profile --update   # record the current profile
+"""
+import argparse
+import json
+import pathlib
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = pathlib.Path(__file__).resolve().parent.parent
+BUDGET_PATH = pathlib.Path(__file__).resolve().parent / "baselines" / "import_time.json"
+
+DEFAULT_BUDGET = {
+    "max_total_ms": 1000,
+    # Heavy SDKs must only be imported on first use
+    "forbidden_modules": [
+        "google.generativeai",
+        "googleapiclient",
+        "google_auth_oauthlib",
+        "google.oauth2",
+        "httpx",
+    ],
+}
+
+
+def profile_once(module):
+    """Return {module: cumulative_us} for one cold import."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+    )
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, self_us, cumulative_us, name = (part.strip() for part in line.replace("import time:", "|", 1).split("|"))
+        timings[name] = int(cumulative_us)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time profile of main.py")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--update", action="store_true", help="write the current profile next to the budget")
+    args = parser.parse_args()
+
+    runs = [profile_once(args.module) for _ in range(args.runs)]
+    total_ms = statistics.median(run[args.module] for run in runs) / 1000
+    modules = {}
+    for run in runs:
+        for name, cumulative in run.items():
+            modules.setdefault(name, []).append(cumulative)
+    slowest = sorted(
+        ((statistics.median(values) / 1000, name) for name, values in modules.items() if name != args.module),
+        reverse=True
+    )[:args.top]
+
+    budget = json.loads(BUDGET_PATH.read_text()) if BUDGET_PATH.exists() else dict(DEFAULT_BUDGET)
+
+    print(f"import {args.module}: {total_ms:.1f} ms median of {args.runs} runs (budget {budget['max_total_ms']} ms)")
+    if budget.get("last_total_ms"):
+        print(f"last recorded: {budget['last_total_ms']} ms ({total_ms - budget['last_total_ms']:+.1f} ms)")
+    print(f"{'cumulative ms':>14}  module")
+    for cumulative_ms, name in slowest:
+        print(f"{cumulative_ms:>14.1f}  {name}")
+
+    failures = []
+    if total_ms > budget["max_total_ms"]:
+        failures.append(f"import took {total_ms:.1f} ms, budget is {budget['max_total_ms']} ms")
+    for forbidden in budget["forbidden_modules"]:
+        eager = sorted(name for name in modules if name == forbidden or name.startswith(forbidden + "."))
+        if eager:
+            failures.append(f"{forbidden} is imported eagerly ({len(eager)} modules)")
+
+    if args.update:
+        budget["last_total_ms"] = round(total_ms, 1)
+        budget["last_top_modules"] = [[name, round(cumulative_ms, 1)] for cumulative_ms, name in slowest]
+        BUDGET_PATH.parent.mkdir(exist_ok=True)
+        BUDGET_PATH.write_text(json.dumps(budget, indent=2) + "\n")
+        print(f"Updated {BUDGET_PATH}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""Offline load test for the PA Agent API.
+
+Starts the fake Gemini/Google backends and the FastAPI app from main.py as
+subprocesses, drives a weighted mix of realistic traffic against it and
+reports p50/p95/p99 latency, throughput and error rate per route.
+
+    cd backend
+    python -m bench.loadtest --duration 30 --concurrency 16 --save-baseline default
+    python -m bench.loadtest --duration 30 --concurrency 16 --compare default
+
+Baselines are stored as JSON in bench/baselines/ so regressions show up as
+numeric diffs.
+"""
+import argparse
+import asyncio
+import json
+import os
+import pathlib
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BACKEND_DIR = pathlib.Path(__file__).resolve().parent.parent
+BASELINE_DIR = pathlib.Path(__file__).resolve().parent / "baselines"
+
+SAMPLE_CODE = '''
+def merge_intervals(intervals):
+    intervals.sort()
+    merged = []
+    for start, end in intervals:
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+'''
+
+# (route, weight, method, path, json body)
+SCENARIOS = [
+    ("/api/chat", 25, "POST", "/api/chat", {"messages": [{"role": "user", "content": "Summarise my week in three bullets"}]}),
+    ("/email/unread", 15, "GET", "/email/unread", None),
+    ("/calendar/events", 5, "GET", "/calendar/events", None),
+    ("/calendar/create-event", 10, "POST", "/calendar/create-event", {"description": "Planning sync tomorrow at 2pm for an hour"}),
+    ("/docs/project-plan", 8, "POST", "/docs/project-plan", {"project_title": "Billing revamp", "project_description": "Move invoicing to the new ledger", "timeline_weeks": 8, "team_size": 4}),
+    ("/docs/report-template", 6, "POST", "/docs/report-template", {"report_type": "Quarterly", "report_topic": "Support backlog"}),
+    ("/docs/presentation-outline", 6, "POST", "/docs/presentation-outline", {"presentation_title": "Q3 results", "audience": "leadership", "duration_minutes": 20}),
+    ("/code/review", 10, "POST", "/code/review", {"code": SAMPLE_CODE, "language": "python"}),
+    ("/code/suggest-refactoring", 7, "POST", "/code/suggest-refactoring", {"code": SAMPLE_CODE, "language": "python", "refactoring_goal": "readability"}),
+    ("/code/explain", 8, "POST", "/code/explain", {"code": SAMPLE_CODE, "language": "python"}),
+    ("/code/review?stream=true", 4, "POST", "/code/review?stream=true", {"code": SAMPLE_CODE, "language": "python"}),
+    ("/docs/report-template?stream=true", 3, "POST", "/docs/report-template?stream=true", {"report_type": "Quarterly", "report_topic": "Support backlog"}),
+]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_ready(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready within {timeout}s")
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def start_servers(args, data_dir):
+    """Start the fake backends and the app; return (processes, app_url)."""
+    fake_port, app_port = _free_port(), _free_port()
+    fake_url = f"http://127.0.0.1:{fake_port}"
+    env = dict(os.environ)
+    env.update({
+        "FAKE_GEMINI_LATENCY_MS": str(args.gemini_latency_ms),
+        "FAKE_GEMINI_429_RATE": str(args.gemini_429_rate),
+        "FAKE_GEMINI_STREAM_CHUNKS": str(args.gemini_stream_chunks),
+        "FAKE_GOOGLE_LATENCY_MS": str(args.google_latency_ms),
+    })
+    fake = subprocess.Popen(
+        [sys.executable, "-m", "bench.fake_backends", "--port", str(fake_port)],
+        cwd=BACKEND_DIR, env=env
+    )
+
+    env.update({
+        "GEMINI_API_KEY": "bench",
+        "GEMINI_API_ENDPOINT": fake_url,
+        "GOOGLE_API_ENDPOINT": fake_url + "/",
+        "DATA_DIR": data_dir,
+        "SECRET_KEY": "bench",
+        "LOG_LEVEL": "WARNING",
+        # Every virtual user shares one token; per-user limits would throttle the run
+        "ADMISSION": "false",
+    })
+    env.update(dict(item.split("=", 1) for item in args.app_env))
+    app = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(app_port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env
+    )
+
+    try:
+        _wait_ready(fake_url + "/oauth2/v2/userinfo")
+        _wait_ready(f"http://127.0.0.1:{app_port}/ready")
+    except RuntimeError:
+        stop_servers([fake, app])
+        raise
+    return [fake, app], f"http://127.0.0.1:{app_port}"
+
+
+def stop_servers(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+async def drive(app_url, duration, concurrency, scenarios):
+    """Send weighted random requests for `duration` seconds; return samples."""
+    samples = []
+    weights = [scenario[1] for scenario in scenarios]
+    headers = {"Authorization": "Bearer bench-token"}
+    deadline = time.perf_counter() + duration
+
+    async with httpx.AsyncClient(base_url=app_url, headers=headers, timeout=120) as client:
+        async def worker():
+            while time.perf_counter() < deadline:
+                route, _, method, path, body = random.choices(scenarios, weights=weights)[0]
+                started = time.perf_counter()
+                try:
+                    async with client.stream(method, path, json=body) as response:
+                        content = await response.aread()
+                    ok = response.status_code < 400
+                    if "stream=true" in path:
+                        # Streams answer 200 up front; failures show up as a missing `done` event
+                        ok = ok and b"event: done" in content
+                except httpx.HTTPError:
+                    ok = False
+                samples.append((route, time.perf_counter() - started, ok))
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples
+
+
+def summarize(samples, duration):
+    """Per-route latency percentiles (ms), throughput and error rate."""
+    by_route = {}
+    for route, latency, ok in samples:
+        by_route.setdefault(route, []).append((latency, ok))
+
+    summary = {}
+    for route, results in sorted(by_route.items()):
+        latencies = sorted(latency * 1000 for latency, _ in results)
+        errors = sum(1 for _, ok in results if not ok)
+        summary[route] = {
+            "requests": len(results),
+            "p50_ms": round(_percentile(latencies, 0.50), 1),
+            "p95_ms": round(_percentile(latencies, 0.95), 1),
+            "p99_ms": round(_percentile(latencies, 0.99), 1),
+            "rps": round(len(results) / duration, 2),
+            "error_rate": round(errors / len(results), 4),
+        }
+    total_errors = sum(1 for _, _, ok in samples if not ok)
+    summary["__total__"] = {
+        "requests": len(samples),
+        "rps": round(len(samples) / duration, 2),
+        "error_rate": round(total_errors / len(samples), 4) if samples else 0.0,
+    }
+    return summary
+
+
+def print_report(summary, baseline=None):
+    columns = ("requests", "p50_ms", "p95_ms", "p99_ms", "rps", "error_rate")
+    print(f"{'route':<36}" + "".join(f"{column:>18}" for column in columns))
+    for route, stats in summary.items():
+        row = f"{route:<36}"
+        for column in columns:
+            value = stats.get(column)
+            if value is None:
+                row += f"{'':>18}"
+                continue
+            cell = f"{value}"
+            previous = (baseline or {}).get(route, {}).get(column)
+            if previous:
+                cell += f" ({(value - previous) / previous * 100:+.0f}%)"
+            row += f"{cell:>18}"
+        print(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test against fake Gemini and Google backends")
+    parser.add_argument("--duration", type=float, default=20, help="seconds of traffic to send")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent virtual users")
+    parser.add_argument("--routes", nargs="*", help="only drive these routes")
+    parser.add_argument("--gemini-latency-ms", type=float, default=800)
+    parser.add_argument("--gemini-429-rate", type=float, default=0.0)
+    parser.add_argument("--gemini-stream-chunks", type=int, default=8)
+    parser.add_argument("--google-latency-ms", type=float, default=60)
+    parser.add_argument("--app-env", nargs="*", default=[], metavar="KEY=VALUE", help="extra environment for the app")
+    parser.add_argument("--save-baseline", metavar="NAME", help="save results to bench/baselines/NAME.json")
+    parser.add_argument("--compare", metavar="NAME", help="diff results against bench/baselines/NAME.json")
+    args = parser.parse_args()
+
+    scenarios = [s for s in SCENARIOS if not args.routes or s[0] in args.routes]
+    baseline = None
+    if args.compare:
+        baseline = json.loads((BASELINE_DIR / f"{args.compare}.json").read_text())["summary"]
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        processes, app_url = start_servers(args, data_dir)
+        try:
+            samples = asyncio.run(drive(app_url, args.duration, args.concurrency, scenarios))
+        finally:
+            stop_servers(processes)
+
+    summary = summarize(samples, args.duration)
+    print_report(summary, baseline)
+
+    if args.save_baseline:
+        BASELINE_DIR.mkdir(exist_ok=True)
+        config = {key: value for key, value in vars(args).items() if key not in ("save_baseline", "compare")}
+        path = BASELINE_DIR / f"{args.save_baseline}.json"
+        path.write_text(json.dumps({"config": config, "summary": summary}, indent=2) + "\n")
+        print(f"Saved baseline to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Read/write latency of the shared SQLite state, and a cross-process check.
+
+Times SharedCache get/set/add on a scratch database for small and ~10KB
+values, plain and encrypted, with connections reused per thread (as the app
+does) and opened per call (for comparison), plus sets that evict under a
+size quota and the async wrappers. Then several processes write and claim
+the same keys on a fresh database at once, which must finish without
+"database is locked" errors and with every key claimed exactly once.
+
+    cd backend
+    python -m bench.storage_bench
+    python -m bench.storage_bench --ops 5000 --processes 8
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+
+# Encrypted caches need a stable key; any value will do for a benchmark
+os.environ.setdefault("SECRET_KEY", "storage-bench")
+
+from services import shared_state  # noqa: E402
+from services.shared_state import SharedCache, sweep_expired  # noqa: E402
+
+SMALL_VALUE = {"summary": "Quarterly numbers are in; please review before Friday.", "model": "flash"}
+LARGE_VALUE = {"body": "x" * 10000}
+
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    return {
+        "p50_us": statistics.median(samples) * 1e6,
+        "p99_us": samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1e6,
+    }
+
+
+def _time(operation, ops, fresh_connections=False):
+    samples = []
+    for i in range(ops):
+        if fresh_connections:
+            shared_state._local.connections = {}
+        started = time.perf_counter()
+        operation(i)
+        samples.append(time.perf_counter() - started)
+    return _percentiles(samples)
+
+
+def latency(path, ops):
+    """(name, percentiles) for each operation on the database at `path`."""
+    results = []
+    for encrypt in (False, True):
+        for size, value in (("small", SMALL_VALUE), ("10KB", LARGE_VALUE)):
+            cache = SharedCache(f"bench_{size}_{encrypt}", ttl_seconds=600, encrypt=encrypt, path=path)
+            label = f"{size}{', encrypted' if encrypt else ''}"
+            results.append((f"set ({label})", _time(lambda i: cache.set(f"k{i}", value), ops)))
+            results.append((f"get ({label})", _time(lambda i: cache.get(f"k{i}"), ops)))
+            results.append((f"add ({label})", _time(lambda i: cache.add(f"new{i}", value), ops)))
+
+    cache = SharedCache("bench_small_False", ttl_seconds=600, path=path)
+    results.append(("get, connection per call", _time(lambda i: cache.get(f"k{i}"), ops, fresh_connections=True)))
+    results.append(("set, connection per call", _time(lambda i: cache.set(f"k{i}", SMALL_VALUE), ops, fresh_connections=True)))
+
+    capped = SharedCache("bench_capped", ttl_seconds=600, path=path, max_entries=1000, max_bytes=1024 * 1024)
+    results.append(("set under quota (10KB, 1MB cap)", _time(lambda i: capped.set(f"k{i}", LARGE_VALUE), ops)))
+
+    async def timed_async():
+        samples = []
+        for i in range(ops):
+            started = time.perf_counter()
+            await cache.get_async(f"k{i}")
+            samples.append(time.perf_counter() - started)
+        return _percentiles(samples)
+
+    results.append(("get_async (small)", asyncio.run(timed_async())))
+
+    expired = SharedCache("bench_expired", ttl_seconds=-1, path=path)
+    for i in range(ops):
+        expired.set(f"k{i}", SMALL_VALUE)
+    started = time.perf_counter()
+    removed = sweep_expired(path)
+    results.append((f"sweep ({removed} expired rows)", {"p50_us": (time.perf_counter() - started) * 1e6, "p99_us": None}))
+    return results
+
+
+def _worker(path, worker, ops, claims, errors):
+    cache = SharedCache("bench_shared", ttl_seconds=600, path=path)
+    claimed = failed = 0
+    for i in range(ops):
+        try:
+            cache.set(f"w{worker}:{i}", SMALL_VALUE)
+            cache.get(f"w{(worker + 1)}:{i}")
+            if cache.add(f"claim:{i}", worker):
+                claimed += 1
+        except Exception:
+            failed += 1
+    with claims.get_lock():
+        claims.value += claimed
+    with errors.get_lock():
+        errors.value += failed
+
+
+def concurrency(path, processes, ops):
+    """Run `processes` writers against a fresh database at once; returns (seconds, claims, errors)."""
+    claims = multiprocessing.Value("i", 0)
+    errors = multiprocessing.Value("i", 0)
+    workers = [
+        multiprocessing.Process(target=_worker, args=(path, worker, ops, claims, errors))
+        for worker in range(processes)
+    ]
+    started = time.perf_counter()
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+    return time.perf_counter() - started, claims.value, errors.value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency of the shared SQLite state")
+    parser.add_argument("--ops", type=int, default=2000, help="operations per measurement")
+    parser.add_argument("--processes", type=int, default=4, help="concurrent writer processes")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        print(f"{'operation':<36} {'p50 us':>9} {'p99 us':>9}")
+        for name, timing in latency(os.path.join(scratch, "latency.db"), args.ops):
+            p99 = f"{timing['p99_us']:9.1f}" if timing["p99_us"] is not None else f"{'':>9}"
+            print(f"{name:<36} {timing['p50_us']:9.1f} {p99}")
+
+        seconds, claims, errors = concurrency(os.path.join(scratch, "shared.db"), args.processes, args.ops)
+        operations = args.processes * args.ops * 3
+        print(
+            f"\n{args.processes} processes, {operations} operations in {seconds:.2f}s "
+            f"({operations / seconds:.0f} ops/s); {claims} of {args.ops} keys claimed, {errors} errors"
+        )
+        if errors or claims != args.ops:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
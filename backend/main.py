@@ -1,16 +1,65 @@
 import os
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Depends, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, JSONResponse
 from dotenv import load_dotenv
-import google.generativeai as genai
 
 # Load environment variables
 load_dotenv()
 
-# Configure Gemini API
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+from services.log import configure_logging, shutdown_logging, RequestIdMiddleware
 
-app = FastAPI(title="PA Agent API", description="Backend for PA Agent - Work Buddy")
+configure_logging()
+
+from services import metrics
+from services.metrics import MetricsMiddleware
+from services.admission import AdmissionControlMiddleware
+from services.body_limit import BodySizeLimitMiddleware
+from services.compression import CompressionMiddleware
+from services.tracing import TracingMiddleware, TracedJSONResponse, shutdown_tracing
+from services import warmup
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run background tasks for the lifetime of the server."""
+    from anyio import to_thread
+    from services.google_http import close_client
+    from services.jobs import job_queue
+    from services.outbox import outbox
+    from services.predraft import predrafter
+    from services.sessions import session_store
+    from services.shared_state import run_sweeper
+
+    # Blocking Google and Gemini client calls run on this thread pool
+    to_thread.current_default_thread_limiter().total_tokens = int(os.getenv("THREAD_POOL_SIZE", "40"))
+
+    refresher = asyncio.create_task(session_store.run_refresher())
+    job_workers = asyncio.create_task(job_queue.run())
+    predrafting = asyncio.create_task(predrafter.run())
+    outbox_workers = asyncio.create_task(outbox.run())
+    sweeper = asyncio.create_task(run_sweeper())
+    # Routers are imported below, before the lifespan runs
+    models = [router.gemini_models.default_model() for router in (chat, email, calendar, documentation, code_review)]
+    warming = asyncio.create_task(warmup.run(models))
+    yield
+    warming.cancel()
+    refresher.cancel()
+    job_workers.cancel()
+    predrafting.cancel()
+    outbox_workers.cancel()
+    sweeper.cancel()
+    close_client()
+    shutdown_tracing()
+    shutdown_logging()
+
+app = FastAPI(title="PA Agent API", description="Backend for PA Agent - Work Buddy", lifespan=lifespan, default_response_class=TracedJSONResponse)
+
+# Oversized bodies are rejected inside CORS so browsers can read the 413
+app.add_middleware(BodySizeLimitMiddleware)
+# Load shedding also answers inside CORS, so browsers can read 429/503 and Retry-After
+app.add_middleware(AdmissionControlMiddleware)
 
 # Configure CORS
 allowed_origins = os.getenv("ALLOWED_ORIGINS", "http://localhost:3000,http://127.0.0.1:3000").split(",")
@@ -20,15 +69,32 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID", "Retry-After"],
 )
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(RequestIdMiddleware)
+app.add_middleware(TracingMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 @app.get("/")
 async def root():
     """Health check endpoint."""
     return {"status": "ok", "message": "PA Agent API is running"}
 
+@app.get("/ready")
+async def ready():
+    """Readiness check; 503 until the start-up warm-up has finished."""
+    if not warmup.status["ready"]:
+        return JSONResponse({"status": "warming_up", "steps": warmup.status["steps"]}, status_code=503)
+    return {"status": "ready", "steps": warmup.status["steps"]}
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Prometheus metrics endpoint."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 # Import and include routers
-from routers import auth, email, calendar, documentation, code_review, chat
+from routers import auth, email, calendar, documentation, code_review, chat, jobs
 
 app.include_router(auth.router, prefix="/auth", tags=["Authentication"])
 app.include_router(email.router, prefix="/email", tags=["Email"])
@@ -36,7 +102,14 @@ app.include_router(calendar.router, prefix="/calendar", tags=["Calendar"])
 app.include_router(documentation.router, prefix="/docs", tags=["Documentation"])
 app.include_router(code_review.router, prefix="/code", tags=["Code Review"])
 app.include_router(chat.router, prefix="/api", tags=["Chat"])
+app.include_router(jobs.router, prefix="/jobs", tags=["Jobs"])
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    # Development server; use serve.py in production
+    uvicorn.run(
+        "main:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        reload=os.getenv("DEBUG", "False").lower() == "true"
+    )
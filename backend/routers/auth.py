@@ -1,19 +1,24 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import HTTPBearer
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
+import asyncio
+import hashlib
 import os
 import pathlib
+from services.admission import remember_identity
+from services.google_http import build_service, execute
+from services.log import get_logger
+from services.sessions import session_store, TOKEN_URI
+from services.shared_state import SharedCache
+from services.tracing import span
 
 router = APIRouter()
+logger = get_logger(__name__)
 
 # Path to client secret file
 CLIENT_SECRET_FILE = os.path.join(pathlib.Path(__file__).parent.parent, "client_secret.json")
 
-# Store processed codes to prevent duplicate requests
-processed_codes = set()
-processed_results = {}
+# Processed codes and their results, shared by all workers to prevent duplicate exchanges
+processed_codes = SharedCache("auth_codes", ttl_seconds=600, encrypt=True)
 
 # Google OAuth2 setup
 SCOPES = [
@@ -26,15 +31,19 @@ SCOPES = [
 
 # OAuth2 configuration - using HTTPBearer for token validation
 oauth2_scheme = HTTPBearer()
+optional_oauth2_scheme = HTTPBearer(auto_error=False)
 
 @router.get("/login")
 async def login_url():
     """Generate Google OAuth login URL."""
     try:
-        print(f"Client secret file path: {CLIENT_SECRET_FILE}")
-        print(f"Client secret file exists: {os.path.exists(CLIENT_SECRET_FILE)}")
-        print(f"Redirect URI: {os.getenv('REDIRECT_URI', 'http://localhost:3000/auth/callback')}")
+        logger.debug(
+            "Building login URL",
+            extra={"client_secret_file": CLIENT_SECRET_FILE, "redirect_uri": os.getenv("REDIRECT_URI", "http://localhost:3000/auth/callback")}
+        )
         
+        from google_auth_oauthlib.flow import Flow
+
         flow = Flow.from_client_secrets_file(
             CLIENT_SECRET_FILE,
             scopes=SCOPES,
@@ -47,12 +56,10 @@ async def login_url():
             prompt="consent"
         )
         
-        print(f"Generated auth URL: {auth_url}")
+        logger.debug("Generated auth URL")
         return {"auth_url": auth_url}
     except Exception as e:
-        print(f"Login URL generation error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Login URL generation error")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error generating login URL: {str(e)}"
@@ -62,135 +69,166 @@ async def login_url():
 async def auth_callback(code: str, scope: str = None):
     """Process OAuth callback and exchange code for tokens."""
     try:
-        print(f"OAuth callback received with code: {code[:20]}...")
+        logger.info("OAuth callback received")
         
-        # Check if this code has already been processed
-        if code in processed_codes:
-            print(f"Code already processed, returning cached result")
+        # Claim the code; if another request already did, return its result
+        if not await processed_codes.add_async(code):
+            logger.info("Code already processed, returning cached result")
             # Return the cached successful result instead of an error
-            if code in processed_results:
-                return processed_results[code]
+            result = await processed_codes.get_async(code)
+            if result is not None:
+                return result
             else:
-                # Fallback if we somehow lost the result
+                # The other request is still exchanging the code, or failed
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="Authorization code has already been used and result is not available"
                 )
         
-        # Add code to processed set
-        processed_codes.add(code)
-        
         if scope:
-            print(f"Received scope: {scope}")
+            logger.debug("Received scope", extra={"scope": scope})
         
         # Create flow with the exact same configuration as login
+        from google_auth_oauthlib.flow import Flow
+
         flow = Flow.from_client_secrets_file(
             CLIENT_SECRET_FILE,
             scopes=SCOPES,
             redirect_uri=os.getenv("REDIRECT_URI", "http://localhost:3000/auth/callback")
         )
         
-        print(f"Flow created, fetching token...")
+        logger.debug("Flow created, fetching token")
         
         # Fetch token
         flow.fetch_token(code=code)
         credentials = flow.credentials
         
-        print(f"Token received successfully")
+        logger.debug("Token received successfully")
         
         # Verify the credentials work by making a simple API call
         try:
-            from googleapiclient.discovery import build
-            service = build("oauth2", "v2", credentials=credentials)
-            user_info = service.userinfo().get().execute()
-            print(f"User authenticated: {user_info.get('email', 'Unknown')}")
+            service = build_service("oauth2", "v2", credentials)
+            user_info = await execute(service.userinfo().get())
+            logger.info("User authenticated", extra={"user": user_key({"user_info": user_info, "access_token": credentials.token})})
             
             result = {
                 "status": "success",
+                "session_id": await asyncio.to_thread(session_store.create, credentials, user_info),
                 "access_token": credentials.token,
-                "refresh_token": credentials.refresh_token,
                 "token_uri": credentials.token_uri,
                 "client_id": credentials.client_id,
-                "client_secret": credentials.client_secret,
                 "scopes": credentials.scopes,
                 "user_info": user_info
             }
             
             # Cache the successful result
-            processed_results[code] = result
+            await processed_codes.set_async(code, result)
             return result
         except Exception as verify_error:
-            print(f"Error verifying credentials: {verify_error}")
+            logger.warning("Error verifying credentials: %s", verify_error)
             # Still return tokens even if verification fails
             result = {
                 "status": "success",
+                "session_id": await asyncio.to_thread(session_store.create, credentials),
                 "access_token": credentials.token,
-                "refresh_token": credentials.refresh_token,
                 "token_uri": credentials.token_uri,
                 "client_id": credentials.client_id,
-                "client_secret": credentials.client_secret,
                 "scopes": credentials.scopes,
                 "user_info": None
             }
             
             # Cache the successful result
-            processed_results[code] = result
+            await processed_codes.set_async(code, result)
             return result
             
     except HTTPException:
         # Re-raise HTTP exceptions (like duplicate code)
         raise
     except Exception as e:
-        print(f"OAuth callback error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("OAuth callback error")
         
         # Remove code from processed set if there was an error
-        processed_codes.discard(code)
-        processed_results.pop(code, None)
+        await processed_codes.delete_async(code)
         
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Error processing OAuth callback: {str(e)}"
         )
 
+def google_credentials(user_data):
+    """Build Google API credentials for the authenticated user."""
+    from google.oauth2.credentials import Credentials
+
+    return Credentials(
+        token=user_data["access_token"],
+        refresh_token=None,
+        token_uri=TOKEN_URI,
+        client_id=os.getenv("GOOGLE_CLIENT_ID"),
+        client_secret=os.getenv("GOOGLE_CLIENT_SECRET")
+    )
+
+def user_key(user_data):
+    """Stable, non-identifying key for the user, e.g. to scope caches."""
+    user_info = user_data.get("user_info") or {}
+    identity = str(user_info.get("id") or user_info.get("email") or user_data["access_token"])
+    return hashlib.sha256(identity.encode("utf-8")).hexdigest()[:32]
+
 async def get_current_user(credentials: HTTPBearer = Depends(oauth2_scheme)):
     """Validate token and return user info."""
-    try:
-        # Extract token from credentials
-        token = credentials.credentials
+    with span("auth.verify"):
+        try:
+            # Extract token from credentials
+            token = credentials.credentials
         
-        # Remove "Bearer " prefix if present
-        if token.startswith("Bearer "):
-            token = token[7:]
-            
-        creds = Credentials(
-            token=token,
-            refresh_token=None,
-            token_uri="https://oauth2.googleapis.com/token",
-            client_id=os.getenv("GOOGLE_CLIENT_ID"),
-            client_secret=os.getenv("GOOGLE_CLIENT_SECRET")
-        )
+            # Remove "Bearer " prefix if present
+            if token.startswith("Bearer "):
+                token = token[7:]
         
-        service = build("oauth2", "v2", credentials=creds)
-        user_info = service.userinfo().get().execute()
+            # Opaque session ids resolve to an access token that is kept fresh server-side
+            session = await session_store.resolve(token)
+            if session is not None and session.get("user_info"):
+                user_data = {
+                    "user_info": session["user_info"],
+                    "access_token": session["access_token"],
+                    "session_id": token
+                }
+                remember_identity(token, user_key(user_data))
+                return user_data
+            if session is not None:
+                token_data = {"access_token": session["access_token"], "session_id": token}
+            else:
+                token_data = {"access_token": token}
         
-        # Return both user info and access token for other API calls
-        return {
-            "user_info": user_info,
-            "access_token": token
-        }
+            service = build_service("oauth2", "v2", google_credentials(token_data))
+            user_info = await execute(service.userinfo().get())
         
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail=f"Invalid authentication credentials: {str(e)}",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+            # Return both user info and access token for other API calls
+            user_data = {"user_info": user_info, **token_data}
+            # Admission control limits this token's requests as this user's from now on
+            remember_identity(token, user_key(user_data))
+            return user_data
+        
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail=f"Invalid authentication credentials: {str(e)}",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+
+async def get_optional_user(credentials: HTTPBearer = Depends(optional_oauth2_scheme)):
+    """The current user if valid credentials were sent, otherwise None."""
+    if credentials is None:
+        return None
+    try:
+        return await get_current_user(credentials)
+    except HTTPException:
+        return None
 
 @router.post("/logout")
-async def logout():
-    """Logout endpoint - mainly for frontend to clear session."""
+async def logout(credentials: HTTPBearer = Depends(optional_oauth2_scheme)):
+    """Logout endpoint - drops the server-side session if there is one."""
+    if credentials is not None:
+        await asyncio.to_thread(session_store.delete, credentials.credentials)
     return {
         "status": "success",
         "message": "Logged out successfully"
@@ -1,70 +1,116 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from googleapiclient.discovery import build
-from google.oauth2.credentials import Credentials
-import google.generativeai as genai
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 import datetime
-import os
-from .auth import get_current_user
+import time
+from schemas import CreateEventRequest
+from services.conditional import LONG_POLL_MAX_SECONDS, etag_matches, make_etag, not_modified, set_etag, wait_for_change
+from services.gemini import generate
+from services.google_http import build_service, execute
+from services.log import get_logger
+from services.model_policy import ModelRouter
+from services.shared_state import SharedCache
+from services.tools import chat_tools
+from .auth import get_current_user, google_credentials, user_key
 
 router = APIRouter()
+logger = get_logger(__name__)
 
-# Configure Gemini model
-gemini_model = genai.GenerativeModel(
-    model_name="gemini-2.0-flash",
+# user -> {"version", "valid_until", "etag"} of the last /events response
+calendar_versions = SharedCache("calendar_versions", ttl_seconds=24 * 3600)
+
+# Sampling settings; the tiering policy picks the model and output budget
+gemini_models = ModelRouter(
     generation_config={
         "temperature": 0.2,
         "top_p": 0.95,
         "top_k": 40,
-        "max_output_tokens": 2048,
     }
 )
 
+def _timestamp(when):
+    """Epoch seconds of an event start or end; all-day dates count from midnight UTC."""
+    value = when.get("dateTime") or when.get("date")
+    parsed = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.timestamp()
+
+async def calendar_version(service):
+    """Cheap version of the calendar: its last modification time, which any event change moves."""
+    result = await execute(service.events().list(calendarId="primary", maxResults=1, fields="updated"))
+    return result.get("updated")
+
+async def upcoming_events(service):
+    """The next 10 events, and the calendar version they were read at."""
+    # Get the current time in RFC3339 format
+    now = datetime.datetime.utcnow().isoformat() + "Z"  # 'Z' indicates UTC time
+    
+    # Fetch upcoming events
+    events_result = await execute(service.events().list(
+        calendarId="primary",
+        timeMin=now,
+        maxResults=10,
+        singleEvents=True,
+        orderBy="startTime"
+    ))
+    version = events_result.get("updated")
+    
+    events = events_result.get("items", [])
+    
+    if not events:
+        return {"events": [], "message": "No upcoming events found"}, version, None
+    
+    formatted_events = []
+    
+    for event in events:
+        start = event["start"].get("dateTime", event["start"].get("date"))
+        
+        formatted_events.append({
+            "id": event["id"],
+            "summary": event.get("summary", "No Title"),
+            "start": start,
+            "end": event["end"].get("dateTime", event["end"].get("date")),
+            "location": event.get("location", ""),
+            "description": event.get("description", "")
+        })
+    
+    # The list changes by itself once its earliest event has ended
+    valid_until = min(_timestamp(event["end"]) for event in events)
+    return {"events": formatted_events}, version, valid_until
+
 @router.get("/events")
-async def get_calendar_events(user_data = Depends(get_current_user)):
-    """Fetch upcoming calendar events."""
+async def get_calendar_events(
+    request: Request,
+    response: Response,
+    wait: int = Query(0, ge=0, le=LONG_POLL_MAX_SECONDS),
+    user_data = Depends(get_current_user)
+):
+    """Fetch upcoming calendar events.
+
+    The ETag holds while the calendar is unmodified and no listed event has
+    ended: send it back in If-None-Match for a 304, with `wait=N` to hold
+    the request until the events change.
+    """
     try:
-        credentials = Credentials(
-            token=user_data["access_token"],
-            refresh_token=None,
-            token_uri="https://oauth2.googleapis.com/token",
-            client_id=os.getenv("GOOGLE_CLIENT_ID"),
-            client_secret=os.getenv("GOOGLE_CLIENT_SECRET")
-        )
-        
-        service = build("calendar", "v3", credentials=credentials)
+        service = build_service("calendar", "v3", google_credentials(user_data))
+        user = user_key(user_data)
         
-        # Get the current time in RFC3339 format
-        now = datetime.datetime.utcnow().isoformat() + "Z"  # 'Z' indicates UTC time
+        async def current_etag():
+            state = await calendar_versions.get_async(user)
+            if state is None or (state["valid_until"] is not None and time.time() >= state["valid_until"]):
+                return None
+            return state["etag"] if await calendar_version(service) == state["version"] else None
         
-        # Fetch upcoming events
-        events_result = service.events().list(
-            calendarId="primary",
-            timeMin=now,
-            maxResults=10,
-            singleEvents=True,
-            orderBy="startTime"
-        ).execute()
+        etag = await wait_for_change(request, current_etag, wait)
+        if etag_matches(request, etag):
+            return not_modified(etag)
         
-        events = events_result.get("items", [])
-        
-        if not events:
-            return {"events": [], "message": "No upcoming events found"}
-        
-        formatted_events = []
-        
-        for event in events:
-            start = event["start"].get("dateTime", event["start"].get("date"))
-            
-            formatted_events.append({
-                "id": event["id"],
-                "summary": event.get("summary", "No Title"),
-                "start": start,
-                "end": event["end"].get("dateTime", event["end"].get("date")),
-                "location": event.get("location", ""),
-                "description": event.get("description", "")
-            })
-        
-        return {"events": formatted_events}
+        result, version, valid_until = await upcoming_events(service)
+        etag = make_etag("calendar.events", user, version, result)
+        await calendar_versions.set_async(user, {"version": version, "valid_until": valid_until, "etag": etag})
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        set_etag(response, etag)
+        return result
         
     except Exception as e:
         raise HTTPException(
@@ -74,13 +120,13 @@ async def get_calendar_events(user_data = Depends(get_current_user)):
 
 @router.post("/create-event")
 async def create_calendar_event(
-    request: dict,
+    request: CreateEventRequest,
     user_data = Depends(get_current_user)
 ):
     """Create a calendar event from natural language description."""
     try:
-        natural_language_request = request.get("description", "")
-        print(f"Creating calendar event from: {natural_language_request}")
+        natural_language_request = request.description
+        logger.info("Creating calendar event", extra={"request_length": len(natural_language_request)})
         
         # Enhanced prompt for better parsing
         current_date = datetime.datetime.now().strftime("%Y-%m-%d")
@@ -108,12 +154,13 @@ async def create_calendar_event(
         Return ONLY the JSON object, no other text.
         """
         
+        choice = gemini_models.select("calendar.parse-event", prompt)
         try:
-            response = gemini_model.generate_content(prompt)
+            response = await generate(choice.model, prompt)
             parsed_data = response.text.strip()
-            print(f"Gemini response: {parsed_data}")
+            logger.debug("Gemini response", extra={"response": parsed_data})
         except Exception as gemini_error:
-            print(f"Gemini API error: {str(gemini_error)}")
+            logger.warning("Gemini API error: %s", gemini_error)
             # Fallback to simple parsing
             parsed_data = '''{
                 "summary": "Team Meeting",
@@ -127,17 +174,11 @@ async def create_calendar_event(
         
         # Create credentials with error handling
         try:
-            credentials = Credentials(
-                token=user_data["access_token"],
-                refresh_token=user_data.get("refresh_token"),
-                token_uri="https://oauth2.googleapis.com/token",
-                client_id=os.getenv("GOOGLE_CLIENT_ID"),
-                client_secret=os.getenv("GOOGLE_CLIENT_SECRET")
-            )
+            credentials = google_credentials(user_data)
             
-            service = build("calendar", "v3", credentials=credentials)
+            service = build_service("calendar", "v3", credentials)
         except Exception as auth_error:
-            print(f"Authentication error: {str(auth_error)}")
+            logger.warning("Authentication error: %s", auth_error)
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Authentication failed. Please re-authenticate."
@@ -162,7 +203,7 @@ async def create_calendar_event(
                 json_str = json_match.group(0)
             
             event_data = json.loads(json_str)
-            print(f"Parsed event data: {event_data}")
+            logger.debug("Parsed event data", extra={"event_data": event_data})
             
             # Validate required fields
             required_fields = ['summary', 'start_date', 'start_time', 'end_date', 'end_time']
@@ -196,8 +237,7 @@ async def create_calendar_event(
             }
             
         except (json.JSONDecodeError, KeyError, ValueError) as e:
-            print(f"JSON parsing error: {str(e)}")
-            print(f"Failed to parse: {parsed_data}")
+            logger.warning("JSON parsing error: %s", e, extra={"response": parsed_data})
             
             # Fallback to a default event if parsing fails
             now = datetime.datetime.now()
@@ -224,16 +264,16 @@ async def create_calendar_event(
                 },
             }
         
-        print(f"Creating event: {event}")
+        logger.debug("Creating event", extra={"event": event})
         
         # Create the event with better error handling
         try:
-            created_event = service.events().insert(
+            created_event = await execute(service.events().insert(
                 calendarId="primary",
                 body=event
-            ).execute()
+            ))
             
-            print(f"Event created successfully: {created_event.get('id')}")
+            logger.info("Event created", extra={"event_id": created_event.get("id")})
             
             return {
                 "event": {
@@ -244,11 +284,12 @@ async def create_calendar_event(
                     "end": created_event.get("end", {})
                 },
                 "status": "created",
-                "message": "Event created successfully!"
+                "message": "Event created successfully!",
+                "model": choice.info()
             }
             
         except Exception as calendar_error:
-            print(f"Calendar API error: {str(calendar_error)}")
+            logger.warning("Calendar API error: %s", calendar_error)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Failed to create calendar event: {str(calendar_error)}"
@@ -257,10 +298,20 @@ async def create_calendar_event(
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Unexpected error in create_calendar_event: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Unexpected error in create_calendar_event")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error creating calendar event: {str(e)}"
         )
+
+async def events_for_chat(user_data):
+    result, _, _ = await upcoming_events(build_service("calendar", "v3", google_credentials(user_data)))
+    return result
+
+# Tools the chat assistant may call; creating events stays an explicit user action
+chat_tools.register(
+    "get_calendar_events",
+    "List the user's next upcoming calendar events.",
+    lambda args, user_data: events_for_chat(user_data),
+    requires_user=True
+)
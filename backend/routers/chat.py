@@ -1,19 +1,27 @@
-from fastapi import APIRouter, HTTPException, status, Request
+from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.responses import StreamingResponse
-import google.generativeai as genai
+from schemas import ChatRequest
+from services.gemini import GeminiUnavailable, generate, is_quota_error
 import json
 import os
 import datetime
 from typing import List, Dict, Any
 import asyncio
+from services.log import get_logger
+from services.model_policy import ModelRouter
+from services.prompt_budget import fit_section
+from services.sse import format_event
+from services.tools import run_with_tools
+from .auth import get_optional_user
 
 router = APIRouter()
+logger = get_logger(__name__)
 
 @router.get("/test")
 async def test_chat():
     """Test endpoint to verify chat functionality."""
     try:
-        response = gemini_model.generate_content("Say hello and confirm you're working!")
+        response = await generate(gemini_models.default_model(), "Say hello and confirm you're working!")
         return {
             "status": "success",
             "response": response.text,
@@ -34,26 +42,26 @@ async def test_chat():
             "gemini_working": False
         }
 
-# Configure Gemini model - using flash model for better quota limits
-gemini_model = genai.GenerativeModel(
-    model_name="gemini-2.0-flash",  # Changed from pro to flash for better quota
+# Sampling settings; the tiering policy picks the model and output budget
+gemini_models = ModelRouter(
     generation_config={
         "temperature": 0.2,
         "top_p": 0.95,
         "top_k": 40,
-        "max_output_tokens": 2048,  # Reduced token limit
     }
 )
 
 @router.post("/chat")
-async def chat_stream(request: Request):
-    """Handle chat requests with streaming response for Vercel AI SDK compatibility."""
+async def chat_stream(body: ChatRequest, user_data = Depends(get_optional_user)):
+    """Handle chat requests with streaming response for Vercel AI SDK compatibility.
+
+    Gemini may call tools on the server while answering; their progress is
+    streamed as `tool_status` events ahead of the answer.
+    """
     try:
-        # Parse the request body
-        body = await request.json()
-        messages = body.get("messages", [])
+        messages = body.messages
         
-        print(f"Chat request received with {len(messages)} messages")
+        logger.info("Chat request received", extra={"message_count": len(messages)})
         
         if not messages:
             raise HTTPException(status_code=400, detail="No messages provided")
@@ -61,19 +69,17 @@ async def chat_stream(request: Request):
         # Get the last user message
         last_message = ""
         for msg in reversed(messages):
-            if msg["role"] == "user":
-                last_message = msg["content"]
+            if msg.role == "user":
+                last_message = msg.content
                 break
         
         if not last_message:
             raise HTTPException(status_code=400, detail="No user message found")
         
-        print(f"Processing message: {last_message[:100]}...")
+        logger.debug("Processing message", extra={"user_message": last_message})
         
-        # Generate response using Gemini with quota error handling
-        try:
-            # Add system prompt for better formatting
-            enhanced_prompt = f"""You are a helpful PA (Personal Assistant) agent designed to help professionals with various work tasks. 
+        # Add system prompt for better formatting
+        enhanced_prompt = f"""You are a helpful PA (Personal Assistant) agent designed to help professionals with various work tasks. 
 
 When responding:
 - Use **bold** for important points and headings
@@ -81,30 +87,44 @@ When responding:
 - Use numbered lists (1., 2., 3.) for step-by-step instructions
 - Use proper paragraph breaks for better readability
 - Be professional but friendly in tone
+- Use the available tools when they help answer the request
 
-User message: {last_message}"""
-            
-            response = gemini_model.generate_content(enhanced_prompt)
-            response_text = response.text
-        except Exception as gemini_error:
-            # Handle quota exceeded errors gracefully
-            if "quota" in str(gemini_error).lower() or "429" in str(gemini_error):
-                response_text = "I'm currently experiencing high usage and need to limit responses. Please try again in a few minutes, or consider upgrading to a paid Gemini API plan for unlimited access."
-            else:
-                response_text = f"I'm sorry, I encountered an error: {str(gemini_error)[:100]}..."
+User message: {fit_section("chat", "message", last_message)}"""
         
-        print(f"Generated response: {response_text[:100]}...")
+        choice = gemini_models.select("chat", enhanced_prompt)
+        model_name = choice.model.model_name
         
         # Return streaming response in the exact format Vercel AI SDK expects
-        def generate_stream():
+        async def generate_stream():
+            statuses = asyncio.Queue()
+            answer = asyncio.create_task(run_with_tools(choice.model, enhanced_prompt, user_data, on_status=statuses.put))
+            answer.add_done_callback(lambda _: statuses.put_nowait(None))
             try:
-                # Use the already generated response_text from above
+                while True:
+                    tool_status = await statuses.get()
+                    if tool_status is None:
+                        break
+                    yield format_event("tool_status", tool_status)
+                
+                # Generate response using Gemini with quota error handling
+                try:
+                    response, _ = answer.result()
+                    response_text = response.text
+                except Exception as gemini_error:
+                    # Handle quota exceeded errors gracefully
+                    if isinstance(gemini_error, GeminiUnavailable) or is_quota_error(gemini_error):
+                        response_text = "I'm currently experiencing high usage and need to limit responses. Please try again in a few minutes, or consider upgrading to a paid Gemini API plan for unlimited access."
+                    else:
+                        response_text = f"I'm sorry, I encountered an error: {str(gemini_error)[:100]}..."
+                
+                logger.debug("Generated response", extra={"response": response_text})
+                
                 # Send the complete response as a single chunk to avoid parsing issues
                 chunk_data = {
                     "id": "chatcmpl-123",
                     "object": "chat.completion.chunk",
                     "created": int(datetime.datetime.now().timestamp()),
-                    "model": "gemini-2.0-flash",
+                    "model": model_name,
                     "choices": [{
                         "index": 0,
                         "delta": {
@@ -121,7 +141,7 @@ User message: {last_message}"""
                     "id": "chatcmpl-123",
                     "object": "chat.completion.chunk",
                     "created": int(datetime.datetime.now().timestamp()),
-                    "model": "gemini-2.0-flash",
+                    "model": model_name,
                     "choices": [{
                         "index": 0,
                         "delta": {},
@@ -132,13 +152,13 @@ User message: {last_message}"""
                 yield "data: [DONE]\n\n"
                 
             except Exception as e:
-                print(f"Error in stream generation: {e}")
+                logger.exception("Error in stream generation")
                 # Send error in the expected format
                 error_chunk = {
                     "id": "chatcmpl-123",
                     "object": "chat.completion.chunk",
                     "created": int(datetime.datetime.now().timestamp()),
-                    "model": "gemini-2.0-flash",
+                    "model": model_name,
                     "choices": [{
                         "index": 0,
                         "delta": {
@@ -149,6 +169,9 @@ User message: {last_message}"""
                 }
                 yield f"data: {json.dumps(error_chunk)}\n\n"
                 yield "data: [DONE]\n\n"
+            finally:
+                # Stop tool calls and generation if the client went away
+                answer.cancel()
         
         return StreamingResponse(
             generate_stream(),
@@ -163,20 +186,17 @@ User message: {last_message}"""
         )
         
     except Exception as e:
-        print(f"Chat error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Chat error")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error in chat stream: {str(e)}"
         )
 
 @router.post("/chat-simple")
-async def chat_simple(request: Request):
-    """Simple chat endpoint without streaming."""
+async def chat_simple(body: ChatRequest, user_data = Depends(get_optional_user)):
+    """Simple chat endpoint without streaming; lists any tools Gemini called."""
     try:
-        body = await request.json()
-        messages = body.get("messages", [])
+        messages = body.messages
         
         if not messages:
             raise HTTPException(status_code=400, detail="No messages provided")
@@ -184,26 +204,31 @@ async def chat_simple(request: Request):
         # Get the last user message
         last_message = ""
         for msg in reversed(messages):
-            if msg["role"] == "user":
-                last_message = msg["content"]
+            if msg.role == "user":
+                last_message = msg.content
                 break
         
         if not last_message:
             raise HTTPException(status_code=400, detail="No user message found")
         
         # Generate response
+        prompt = fit_section("chat", "message", last_message)
+        choice = gemini_models.select("chat", prompt)
+        tool_calls = []
         try:
-            response = gemini_model.generate_content(last_message)
+            response, tool_calls = await run_with_tools(choice.model, prompt, user_data)
             response_text = response.text
         except Exception as gemini_error:
-            if "quota" in str(gemini_error).lower() or "429" in str(gemini_error):
+            if isinstance(gemini_error, GeminiUnavailable) or is_quota_error(gemini_error):
                 response_text = "I'm currently experiencing high usage. Please try again in a few minutes."
             else:
                 response_text = f"I encountered an error: {str(gemini_error)[:100]}..."
         
         return {
             "response": response_text,
-            "status": "success"
+            "status": "success",
+            "model": choice.info(),
+            "tool_calls": tool_calls
         }
         
     except Exception as e:
@@ -1,64 +1,79 @@
-from fastapi import APIRouter, HTTPException, status, Request
-import google.generativeai as genai
+from fastapi import APIRouter, HTTPException, status, Request, Query
+from schemas import CodeReviewRequest, RefactoringRequest, ExplainCodeRequest
+from services.compat import content_response
+from services.gemini import generate
+from services.jobs import job_queue, accepted_response
+from services.model_policy import ModelRouter
+from services.prompt_budget import fit_section
+from services.sse import stream_generation
+from services.tools import chat_tools
 import os
 
 router = APIRouter()
 
-# Configure Gemini model
-gemini_model = genai.GenerativeModel(
-    model_name="gemini-2.0-flash",
+# Sampling settings; the tiering policy picks the model and output budget
+gemini_models = ModelRouter(
     generation_config={
         "temperature": 0.2,
         "top_p": 0.95,
         "top_k": 40,
-        "max_output_tokens": 2048,
     }
 )
 
+def review_prompt(body: CodeReviewRequest):
+    code = fit_section("code.review", "code", body.code)
+    language = body.language
+    review_focus = body.review_focus
+    
+    return f"""
+    Review the following {language} code with a focus on {review_focus} aspects.
+
+    Code to review:
+    ```{language}
+    {code}
+    ```
+
+    Please provide:
+    1. A summary of the code's purpose and functionality
+    2. Key strengths of the implementation
+    3. Specific issues or areas for improvement (with line references when possible)
+    4. Suggested code changes or alternatives for identified issues
+    5. Overall assessment and recommendations
+
+    Format your review using markdown for better readability:
+    - Use **bold** for important points and headings
+    - Use numbered lists (1., 2., 3.) for structured sections
+    - Use bullet points (-) for sub-items
+    - Use `code snippets` for inline code references
+    - Use ```language blocks``` for code examples
+    - Use proper paragraph breaks for better readability
+    """
+
+async def write_review(body: CodeReviewRequest):
+    """Generate the review; returns its content and the model used."""
+    prompt = review_prompt(body)
+    choice = gemini_models.select("code.review", prompt)
+    response = await generate(choice.model, prompt)
+    return {"content": response.text, "model": choice.info()}
+
 @router.post("/review")
-async def review_code(request: Request):
+async def review_code(body: CodeReviewRequest, request: Request, run_async: bool = Query(False, alias="async"), stream: bool = False):
     """Review code and provide feedback."""
+    if not body.code:
+        raise HTTPException(status_code=400, detail="No code provided for review")
+    
+    if stream:
+        prompt = review_prompt(body)
+        choice = gemini_models.select("code.review", prompt)
+        return stream_generation(choice.model, prompt, model=choice.info())
+    
+    if run_async:
+        return accepted_response(await job_queue.submit("code.review", body.model_dump()))
+    
     try:
-        # Parse request body
-        body = await request.json()
-        code = body.get("code", "")
-        language = body.get("language", "unknown")
-        review_focus = body.get("review_focus", "general")
-        
-        if not code:
-            raise HTTPException(status_code=400, detail="No code provided for review")
-        
-        prompt = f"""
-        Review the following {language} code with a focus on {review_focus} aspects.
-        
-        Code to review:
-        ```{language}
-        {code}
-        ```
-        
-        Please provide:
-        1. A summary of the code's purpose and functionality
-        2. Key strengths of the implementation
-        3. Specific issues or areas for improvement (with line references when possible)
-        4. Suggested code changes or alternatives for identified issues
-        5. Overall assessment and recommendations
-        
-        Format your review using markdown for better readability:
-        - Use **bold** for important points and headings
-        - Use numbered lists (1., 2., 3.) for structured sections
-        - Use bullet points (-) for sub-items
-        - Use `code snippets` for inline code references
-        - Use ```language blocks``` for code examples
-        - Use proper paragraph breaks for better readability
-        """
-        
-        response = gemini_model.generate_content(prompt)
-        review = response.text
+        result = await write_review(body)
         
-        return {
-            "content": review,
-            "code_review": review  # Keep both for compatibility
-        }
+        return content_response(request, result["content"], "code_review", model=result["model"])
         
     except Exception as e:
         raise HTTPException(
@@ -66,48 +81,59 @@ async def review_code(request: Request):
             detail=f"Error reviewing code: {str(e)}"
         )
 
+def refactoring_prompt(body: RefactoringRequest):
+    code = fit_section("code.suggest-refactoring", "code", body.code)
+    language = body.language
+    refactoring_goal = body.refactoring_goal
+    
+    return f"""
+    Analyze the following {language} code and suggest refactoring to achieve the goal: {refactoring_goal}
+
+    Original code:
+    ```{language}
+    {code}
+    ```
+
+    Please provide:
+    1. An analysis of the current code structure and potential issues
+    2. A detailed refactoring plan with specific changes
+    3. The refactored code with comments explaining key changes
+    4. Benefits of the suggested refactoring
+
+    Format your response using markdown for better readability:
+    - Use **bold** for important points and headings
+    - Use numbered lists (1., 2., 3.) for structured sections
+    - Use bullet points (-) for sub-items
+    - Use `code snippets` for inline code references
+    - Use ```language blocks``` for code examples
+    - Use proper paragraph breaks for better readability
+    """
+
+async def write_refactoring(body: RefactoringRequest):
+    """Generate the refactoring suggestions; returns its content and the model used."""
+    prompt = refactoring_prompt(body)
+    choice = gemini_models.select("code.suggest-refactoring", prompt)
+    response = await generate(choice.model, prompt)
+    return {"content": response.text, "model": choice.info()}
+
 @router.post("/suggest-refactoring")
-async def suggest_refactoring(request: Request):
+async def suggest_refactoring(body: RefactoringRequest, request: Request, run_async: bool = Query(False, alias="async"), stream: bool = False):
     """Suggest refactoring for given code based on a specific goal."""
+    if not body.code:
+        raise HTTPException(status_code=400, detail="No code provided for refactoring")
+    
+    if stream:
+        prompt = refactoring_prompt(body)
+        choice = gemini_models.select("code.suggest-refactoring", prompt)
+        return stream_generation(choice.model, prompt, model=choice.info())
+    
+    if run_async:
+        return accepted_response(await job_queue.submit("code.suggest-refactoring", body.model_dump()))
+    
     try:
-        body = await request.json()
-        code = body.get("code", "")
-        language = body.get("language", "unknown")
-        refactoring_goal = body.get("refactoring_goal", "improve code quality")
-        
-        if not code:
-            raise HTTPException(status_code=400, detail="No code provided for refactoring")
-        
-        prompt = f"""
-        Analyze the following {language} code and suggest refactoring to achieve the goal: {refactoring_goal}
-        
-        Original code:
-        ```{language}
-        {code}
-        ```
-        
-        Please provide:
-        1. An analysis of the current code structure and potential issues
-        2. A detailed refactoring plan with specific changes
-        3. The refactored code with comments explaining key changes
-        4. Benefits of the suggested refactoring
-        
-        Format your response using markdown for better readability:
-        - Use **bold** for important points and headings
-        - Use numbered lists (1., 2., 3.) for structured sections
-        - Use bullet points (-) for sub-items
-        - Use `code snippets` for inline code references
-        - Use ```language blocks``` for code examples
-        - Use proper paragraph breaks for better readability
-        """
+        result = await write_refactoring(body)
         
-        response = gemini_model.generate_content(prompt)
-        refactoring = response.text
-        
-        return {
-            "content": refactoring,
-            "refactoring_suggestions": refactoring  # Keep both for compatibility
-        }
+        return content_response(request, result["content"], "refactoring_suggestions", model=result["model"])
         
     except Exception as e:
         raise HTTPException(
@@ -115,50 +141,110 @@ async def suggest_refactoring(request: Request):
             detail=f"Error generating refactoring suggestions: {str(e)}"
         )
 
+def explanation_prompt(body: ExplainCodeRequest):
+    code = fit_section("code.explain", "code", body.code)
+    language = body.language
+    detail_level = body.detail_level  # Options: basic, medium, detailed
+    
+    return f"""
+    Explain the following {language} code at a {detail_level} level of detail.
+
+    Code to explain:
+    ```{language}
+    {code}
+    ```
+
+    Please provide:
+    1. A high-level summary of what the code does
+    2. An explanation of the key components and their interactions
+    3. A walkthrough of the logic and control flow
+    4. Explanations of any complex or non-obvious parts
+
+    Format your explanation using markdown for better readability:
+    - Use **bold** for important points and headings
+    - Use numbered lists (1., 2., 3.) for structured sections
+    - Use bullet points (-) for sub-items
+    - Use `code snippets` for inline code references
+    - Use proper paragraph breaks for better readability
+    """
+
+async def write_explanation(body: ExplainCodeRequest):
+    """Generate the explanation; returns its content and the model used."""
+    prompt = explanation_prompt(body)
+    choice = gemini_models.select("code.explain", prompt)
+    response = await generate(choice.model, prompt)
+    return {"content": response.text, "model": choice.info()}
+
 @router.post("/explain")
-async def explain_code(request: Request):
+async def explain_code(body: ExplainCodeRequest, request: Request, run_async: bool = Query(False, alias="async"), stream: bool = False):
     """Explain code functionality in natural language."""
+    if not body.code:
+        raise HTTPException(status_code=400, detail="No code provided for explanation")
+    
+    if stream:
+        prompt = explanation_prompt(body)
+        choice = gemini_models.select("code.explain", prompt)
+        return stream_generation(choice.model, prompt, model=choice.info())
+    
+    if run_async:
+        return accepted_response(await job_queue.submit("code.explain", body.model_dump()))
+    
     try:
-        body = await request.json()
-        code = body.get("code", "")
-        language = body.get("language", "unknown")
-        detail_level = body.get("detail_level", "medium")  # Options: basic, medium, detailed
-        
-        if not code:
-            raise HTTPException(status_code=400, detail="No code provided for explanation")
-        
-        prompt = f"""
-        Explain the following {language} code at a {detail_level} level of detail.
-        
-        Code to explain:
-        ```{language}
-        {code}
-        ```
-        
-        Please provide:
-        1. A high-level summary of what the code does
-        2. An explanation of the key components and their interactions
-        3. A walkthrough of the logic and control flow
-        4. Explanations of any complex or non-obvious parts
+        result = await write_explanation(body)
         
-        Format your explanation using markdown for better readability:
-        - Use **bold** for important points and headings
-        - Use numbered lists (1., 2., 3.) for structured sections
-        - Use bullet points (-) for sub-items
-        - Use `code snippets` for inline code references
-        - Use proper paragraph breaks for better readability
-        """
-        
-        response = gemini_model.generate_content(prompt)
-        explanation = response.text
-        
-        return {
-            "content": explanation,
-            "code_explanation": explanation  # Keep both for compatibility
-        }
+        return content_response(request, result["content"], "code_explanation", model=result["model"])
         
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error explaining code: {str(e)}"
         )
+
+# Handlers for ?async=true jobs
+job_queue.register("code.review", lambda payload: write_review(CodeReviewRequest(**payload)), priority=5)
+job_queue.register("code.suggest-refactoring", lambda payload: write_refactoring(RefactoringRequest(**payload)), priority=5)
+job_queue.register("code.explain", lambda payload: write_explanation(ExplainCodeRequest(**payload)), priority=5)
+
+# Tools the chat assistant may call
+chat_tools.register(
+    "review_code",
+    "Review a piece of code for bugs, security, performance and style.",
+    lambda args, user_data: write_review(CodeReviewRequest(**args)),
+    parameters={
+        "type": "object",
+        "properties": {
+            "code": {"type": "string"},
+            "language": {"type": "string"},
+            "review_focus": {"type": "string"},
+        },
+        "required": ["code"],
+    }
+)
+chat_tools.register(
+    "suggest_code_refactoring",
+    "Suggest how to refactor a piece of code, with the improved version.",
+    lambda args, user_data: write_refactoring(RefactoringRequest(**args)),
+    parameters={
+        "type": "object",
+        "properties": {
+            "code": {"type": "string"},
+            "language": {"type": "string"},
+            "refactoring_goal": {"type": "string"},
+        },
+        "required": ["code"],
+    }
+)
+chat_tools.register(
+    "explain_code",
+    "Explain what a piece of code does.",
+    lambda args, user_data: write_explanation(ExplainCodeRequest(**args)),
+    parameters={
+        "type": "object",
+        "properties": {
+            "code": {"type": "string"},
+            "language": {"type": "string"},
+            "detail_level": {"type": "string", "enum": ["basic", "medium", "detailed"]},
+        },
+        "required": ["code"],
+    }
+)
@@ -1,63 +1,78 @@
-from fastapi import APIRouter, HTTPException, status, Request
-import google.generativeai as genai
+from fastapi import APIRouter, HTTPException, status, Request, Query
+from schemas import ProjectPlanRequest, ReportTemplateRequest, PresentationOutlineRequest, DocsBatchRequest, DEFAULT_REPORT_SECTIONS
+from services.compat import content_response
+from services.gemini import generate
+from services.jobs import job_queue, accepted_response
+from services.model_policy import ModelRouter
+from services.sse import format_event, event_stream, stream_generation
+from services.tools import chat_tools
+import asyncio
 import os
 
 router = APIRouter()
 
-# Configure Gemini model
-gemini_model = genai.GenerativeModel(
-    model_name="gemini-2.0-flash",
+# Sampling settings; the tiering policy picks the model and output budget
+gemini_models = ModelRouter(
     generation_config={
         "temperature": 0.3,
         "top_p": 0.95,
         "top_k": 40,
-        "max_output_tokens": 2048,
     }
 )
 
+def project_plan_prompt(body: ProjectPlanRequest):
+    project_title = body.project_title
+    project_description = body.project_description
+    timeline_weeks = body.timeline_weeks
+    team_size = body.team_size
+    
+    return f"""
+    Create a comprehensive project plan for the following project:
+
+    Title: {project_title}
+    Description: {project_description}
+    Timeline: {timeline_weeks} weeks
+    Team Size: {team_size} people
+
+    Your plan should include:
+    1. Executive Summary
+    2. Project Scope and Objectives
+    3. Key Deliverables
+    4. Timeline with milestones (broken down by week)
+    5. Resource Allocation
+    6. Risk Management
+    7. Success Metrics
+
+    Format your response using markdown for better readability:
+    - Use **bold** for important headings and key points
+    - Use numbered lists (1., 2., 3.) for main sections
+    - Use bullet points (-) for sub-items and details
+    - Use proper paragraph breaks for better readability
+    - Use tables where appropriate for timelines and resource allocation
+    """
+
+async def write_project_plan(body: ProjectPlanRequest):
+    """Generate the project plan; returns its content and the model used."""
+    prompt = project_plan_prompt(body)
+    choice = gemini_models.select("docs.project-plan", prompt)
+    response = await generate(choice.model, prompt)
+    return {"content": response.text, "model": choice.info()}
+
 @router.post("/project-plan")
-async def generate_project_plan(request: Request):
+async def generate_project_plan(body: ProjectPlanRequest, request: Request, run_async: bool = Query(False, alias="async"), stream: bool = False):
     """Generate a project plan from a brief description."""
+    if stream:
+        prompt = project_plan_prompt(body)
+        choice = gemini_models.select("docs.project-plan", prompt)
+        return stream_generation(choice.model, prompt, model=choice.info())
+    
+    if run_async:
+        return accepted_response(await job_queue.submit("docs.project-plan", body.model_dump()))
+    
     try:
-        # Parse request body
-        body = await request.json()
-        project_title = body.get("project_title", "Untitled Project")
-        project_description = body.get("project_description", "No description provided")
-        timeline_weeks = body.get("timeline_weeks", 4)
-        team_size = body.get("team_size", 3)
-        
-        prompt = f"""
-        Create a comprehensive project plan for the following project:
+        result = await write_project_plan(body)
         
-        Title: {project_title}
-        Description: {project_description}
-        Timeline: {timeline_weeks} weeks
-        Team Size: {team_size} people
-        
-        Your plan should include:
-        1. Executive Summary
-        2. Project Scope and Objectives
-        3. Key Deliverables
-        4. Timeline with milestones (broken down by week)
-        5. Resource Allocation
-        6. Risk Management
-        7. Success Metrics
-        
-        Format your response using markdown for better readability:
-        - Use **bold** for important headings and key points
-        - Use numbered lists (1., 2., 3.) for main sections
-        - Use bullet points (-) for sub-items and details
-        - Use proper paragraph breaks for better readability
-        - Use tables where appropriate for timelines and resource allocation
-        """
-        
-        response = gemini_model.generate_content(prompt)
-        plan = response.text
-        
-        return {
-            "content": plan,
-            "project_plan": plan  # Keep both for compatibility
-        }
+        return content_response(request, result["content"], "project_plan", model=result["model"])
         
     except Exception as e:
         raise HTTPException(
@@ -65,43 +80,54 @@ async def generate_project_plan(request: Request):
             detail=f"Error generating project plan: {str(e)}"
         )
 
+def report_template_prompt(body: ReportTemplateRequest):
+    report_type = body.report_type
+    report_topic = body.report_topic
+    sections = body.sections or DEFAULT_REPORT_SECTIONS
+    
+    section_text = "\n".join([f"- {section}" for section in sections])
+    
+    return f"""
+    Create a template for a {report_type} report on the topic of {report_topic}.
+
+    The report should include these sections:
+    {section_text}
+
+    For each section, provide:
+    1. A brief description of what should be included
+    2. 2-3 bullet points of example content or key points to address
+    3. Any relevant formatting suggestions
+
+    Format your response using markdown for better readability:
+    - Use **bold** for section headings and important points
+    - Use numbered lists (1., 2., 3.) for main sections
+    - Use bullet points (-) for sub-items and examples
+    - Use proper paragraph breaks for better readability
+    - Include placeholders in [brackets] for content to be filled in
+    """
+
+async def write_report_template(body: ReportTemplateRequest):
+    """Generate the report template; returns its content and the model used."""
+    prompt = report_template_prompt(body)
+    choice = gemini_models.select("docs.report-template", prompt)
+    response = await generate(choice.model, prompt)
+    return {"content": response.text, "model": choice.info()}
+
 @router.post("/report-template")
-async def generate_report_template(request: Request):
+async def generate_report_template(body: ReportTemplateRequest, request: Request, run_async: bool = Query(False, alias="async"), stream: bool = False):
     """Generate a report template with structure and placeholders."""
+    if stream:
+        prompt = report_template_prompt(body)
+        choice = gemini_models.select("docs.report-template", prompt)
+        return stream_generation(choice.model, prompt, model=choice.info())
+    
+    if run_async:
+        return accepted_response(await job_queue.submit("docs.report-template", body.model_dump()))
+    
     try:
-        body = await request.json()
-        report_type = body.get("report_type", "General")
-        report_topic = body.get("report_topic", "Sample Topic")
-        sections = body.get("sections", ["Introduction", "Methodology", "Findings", "Recommendations", "Conclusion"])
-        
-        section_text = "\n".join([f"- {section}" for section in sections])
-        
-        prompt = f"""
-        Create a template for a {report_type} report on the topic of {report_topic}.
-        
-        The report should include these sections:
-        {section_text}
-        
-        For each section, provide:
-        1. A brief description of what should be included
-        2. 2-3 bullet points of example content or key points to address
-        3. Any relevant formatting suggestions
-        
-        Format your response using markdown for better readability:
-        - Use **bold** for section headings and important points
-        - Use numbered lists (1., 2., 3.) for main sections
-        - Use bullet points (-) for sub-items and examples
-        - Use proper paragraph breaks for better readability
-        - Include placeholders in [brackets] for content to be filled in
-        """
-        
-        response = gemini_model.generate_content(prompt)
-        template = response.text
+        result = await write_report_template(body)
         
-        return {
-            "content": template,
-            "report_template": template  # Keep both for compatibility
-        }
+        return content_response(request, result["content"], "report_template", model=result["model"])
         
     except Exception as e:
         raise HTTPException(
@@ -109,42 +135,145 @@ async def generate_report_template(request: Request):
             detail=f"Error generating report template: {str(e)}"
         )
 
+def presentation_outline_prompt(body: PresentationOutlineRequest):
+    presentation_title = body.presentation_title
+    audience = body.audience
+    duration_minutes = body.duration_minutes
+    
+    return f"""
+    Create an outline for a {duration_minutes}-minute presentation titled "{presentation_title}" for an audience of {audience}.
+
+    Your outline should include:
+    1. A recommended slide structure (number of slides and their titles)
+    2. Brief bullet points for the content of each slide
+    3. Suggestions for visuals or data to include
+    4. Estimated time allocation for each section
+
+    Format your response using markdown for better readability:
+    - Use **bold** for slide titles and important headings
+    - Use numbered lists (1., 2., 3.) for slide numbers and main sections
+    - Use bullet points (-) for slide content and suggestions
+    - Use proper paragraph breaks for better readability
+    - Include time estimates for each section
+    """
+
+async def write_presentation_outline(body: PresentationOutlineRequest):
+    """Generate the presentation outline; returns its content and the model used."""
+    prompt = presentation_outline_prompt(body)
+    choice = gemini_models.select("docs.presentation-outline", prompt)
+    response = await generate(choice.model, prompt)
+    return {"content": response.text, "model": choice.info()}
+
 @router.post("/presentation-outline")
-async def generate_presentation_outline(request: Request):
+async def generate_presentation_outline(body: PresentationOutlineRequest, request: Request, run_async: bool = Query(False, alias="async"), stream: bool = False):
     """Generate a presentation outline with slide suggestions."""
+    if stream:
+        prompt = presentation_outline_prompt(body)
+        choice = gemini_models.select("docs.presentation-outline", prompt)
+        return stream_generation(choice.model, prompt, model=choice.info())
+    
+    if run_async:
+        return accepted_response(await job_queue.submit("docs.presentation-outline", body.model_dump()))
+    
     try:
-        body = await request.json()
-        presentation_title = body.get("presentation_title", "Sample Presentation")
-        audience = body.get("audience", "General Audience")
-        duration_minutes = body.get("duration_minutes", 15)
-        
-        prompt = f"""
-        Create an outline for a {duration_minutes}-minute presentation titled "{presentation_title}" for an audience of {audience}.
-        
-        Your outline should include:
-        1. A recommended slide structure (number of slides and their titles)
-        2. Brief bullet points for the content of each slide
-        3. Suggestions for visuals or data to include
-        4. Estimated time allocation for each section
+        result = await write_presentation_outline(body)
         
-        Format your response using markdown for better readability:
-        - Use **bold** for slide titles and important headings
-        - Use numbered lists (1., 2., 3.) for slide numbers and main sections
-        - Use bullet points (-) for slide content and suggestions
-        - Use proper paragraph breaks for better readability
-        - Include time estimates for each section
-        """
-        
-        response = gemini_model.generate_content(prompt)
-        outline = response.text
-        
-        return {
-            "content": outline,
-            "presentation_outline": outline  # Keep both for compatibility
-        }
+        return content_response(request, result["content"], "presentation_outline", model=result["model"])
         
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error generating presentation outline: {str(e)}"
         )
+
+# Shared by all batch requests, so a few large batches can't monopolise Gemini
+BATCH_CONCURRENCY = int(os.getenv("DOCS_BATCH_CONCURRENCY", "4"))
+batch_semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+BATCH_WRITERS = {
+    "project-plan": write_project_plan,
+    "report-template": write_report_template,
+    "presentation-outline": write_presentation_outline,
+}
+
+@router.post("/batch")
+async def generate_batch(body: DocsBatchRequest):
+    """Generate several documents concurrently, streaming each as an SSE `item` event when it completes."""
+    async def run_item(index, item):
+        result = {"index": index, "id": item.id, "type": item.type}
+        async with batch_semaphore:
+            try:
+                result.update(await BATCH_WRITERS[item.type](item))
+                result["status"] = "succeeded"
+            except Exception as e:
+                # One failed item doesn't fail the batch
+                result["status"] = "failed"
+                result["error"] = str(e)
+        return result
+
+    async def events():
+        tasks = [asyncio.create_task(run_item(index, item)) for index, item in enumerate(body.items)]
+        failed = 0
+        try:
+            for completed in asyncio.as_completed(tasks):
+                result = await completed
+                failed += result["status"] == "failed"
+                yield format_event("item", result)
+            summary = {"total": len(tasks), "succeeded": len(tasks) - failed, "failed": failed}
+            yield format_event("done", summary)
+        finally:
+            # Stop generating if the client went away
+            for task in tasks:
+                task.cancel()
+
+    return event_stream(events())
+
+# Handlers for ?async=true jobs
+job_queue.register("docs.project-plan", lambda payload: write_project_plan(ProjectPlanRequest(**payload)), priority=6)
+job_queue.register("docs.report-template", lambda payload: write_report_template(ReportTemplateRequest(**payload)), priority=6)
+job_queue.register("docs.presentation-outline", lambda payload: write_presentation_outline(PresentationOutlineRequest(**payload)), priority=6)
+
+# Tools the chat assistant may call
+chat_tools.register(
+    "generate_project_plan",
+    "Write a project plan with phases, milestones, resources and risks.",
+    lambda args, user_data: write_project_plan(ProjectPlanRequest(**args)),
+    parameters={
+        "type": "object",
+        "properties": {
+            "project_title": {"type": "string"},
+            "project_description": {"type": "string"},
+            "timeline_weeks": {"type": "integer"},
+            "team_size": {"type": "integer"},
+        },
+        "required": ["project_title", "project_description"],
+    }
+)
+chat_tools.register(
+    "generate_report_template",
+    "Write a report template for a given report type and topic.",
+    lambda args, user_data: write_report_template(ReportTemplateRequest(**args)),
+    parameters={
+        "type": "object",
+        "properties": {
+            "report_type": {"type": "string"},
+            "report_topic": {"type": "string"},
+            "sections": {"type": "array", "items": {"type": "string"}},
+        },
+        "required": ["report_topic"],
+    }
+)
+chat_tools.register(
+    "generate_presentation_outline",
+    "Write a slide-by-slide presentation outline.",
+    lambda args, user_data: write_presentation_outline(PresentationOutlineRequest(**args)),
+    parameters={
+        "type": "object",
+        "properties": {
+            "presentation_title": {"type": "string"},
+            "audience": {"type": "string"},
+            "duration_minutes": {"type": "integer"},
+        },
+        "required": ["presentation_title"],
+    }
+)
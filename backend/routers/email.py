@@ -1,80 +1,151 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from googleapiclient.discovery import build
-from google.oauth2.credentials import Credentials
-import google.generativeai as genai
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, status
+from fastapi.responses import JSONResponse
+import asyncio
 import base64
+import functools
 from email.mime.text import MIMEText
-import os
-from .auth import get_current_user
+from email.utils import make_msgid
+import time
+from typing import Literal, Optional
+from schemas import DEFAULT_TONE, DraftReplyRequest, SendEmailRequest
+from services.conditional import LONG_POLL_MAX_SECONDS, etag_matches, make_etag, not_modified, set_etag, wait_for_change
+from services.gemini import GeminiUnavailable, circuit_open, generate, is_quota_error
+from services.google_http import build_service, execute
+from services.log import get_logger
+from services.mail import (
+    cached_summary,
+    get_thread,
+    mailbox_history_id,
+    needs_reply,
+    parse_message,
+    remember_threads,
+    sender_address,
+    split_thread,
+    store_summary,
+    strip_quoted,
+)
+from services.mail_index import MAIL_INDEX, mail_index
+from services.metrics import LOCAL_SUMMARIES
+from services.model_policy import ModelRouter
+from services.outbox import outbox
+from services.predraft import PREDRAFT, PREDRAFT_TOP_N, cached_draft, predrafter, store_draft
+from services.prompt_budget import fit_section
+from services.shared_state import SharedCache
+from services.summarizer import LOCAL_MODEL_INFO, summarize
+from services.tools import chat_tools
+from .auth import get_current_user, google_credentials, user_key
 
 router = APIRouter()
+logger = get_logger(__name__)
+
+# user:mode -> {"history_id", "degraded", "etag"} of the last /unread response
+unread_versions = SharedCache("unread_versions", ttl_seconds=24 * 3600)
 
-# Configure Gemini model
-gemini_model = genai.GenerativeModel(
-    model_name="gemini-2.0-flash",
+# Sampling settings; the tiering policy picks the model and output budget
+gemini_models = ModelRouter(
     generation_config={
         "temperature": 0.2,
         "top_p": 0.95,
         "top_k": 40,
-        "max_output_tokens": 2048,
     }
 )
 
+def unread_etag(user, mode, result):
+    """ETag of an /unread response, from its payload."""
+    return make_etag("email.unread", user, mode, result)
+
 @router.get("/unread")
-async def get_unread_emails(user_data = Depends(get_current_user)):
-    """Fetch unread emails and provide summaries."""
+async def get_unread_emails(
+    request: Request,
+    response: Response,
+    mode: Literal["auto", "fast"] = Query("auto"),
+    wait: int = Query(0, ge=0, le=LONG_POLL_MAX_SECONDS),
+    user_data = Depends(get_current_user)
+):
+    """Fetch unread emails and provide summaries.
+
+    `mode=fast` summarises locally instead of with Gemini. `auto` does the
+    same while Gemini is over quota or its circuit breaker is open.
+    Send the ETag back in If-None-Match for a 304 while the mailbox
+    historyId is unchanged, with `wait=N` to hold the request until it
+    changes.
+    """
     try:
-        credentials = Credentials(
-            token=user_data["access_token"],
-            refresh_token=None,
-            token_uri="https://oauth2.googleapis.com/token",
-            client_id=os.getenv("GOOGLE_CLIENT_ID"),
-            client_secret=os.getenv("GOOGLE_CLIENT_SECRET")
-        )
-        
-        service = build("gmail", "v1", credentials=credentials)
+        service = build_service("gmail", "v1", google_credentials(user_data))
+        user = user_key(user_data)
+        version_key = f"{user}:{mode}"
+        history_id = None
         
-        # Fetch unread messages
-        results = service.users().messages().list(
-            userId="me", 
-            q="is:unread"
-        ).execute()
+        async def current_etag():
+            nonlocal history_id
+            history_id = await mailbox_history_id(service)
+            state = await unread_versions.get_async(version_key)
+            # While the circuit is open a rebuilt response would be degraded too
+            if state is None or state["history_id"] != history_id or state["degraded"] != (mode == "auto" and circuit_open()):
+                return None
+            return state["etag"]
         
-        messages = results.get("messages", [])
+        etag = await wait_for_change(request, current_etag, wait)
+        if etag_matches(request, etag):
+            return not_modified(etag)
         
-        if not messages:
-            return {"emails": [], "message": "No unread emails found"}
+        result = await unread_summaries(user_data, mode)
+        etag = unread_etag(user, mode, result)
+        # history_id is only known for conditional requests; until then the next one rebuilds
+        await unread_versions.set_async(version_key, {"history_id": history_id, "degraded": result["degraded"], "etag": etag})
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        set_etag(response, etag)
+        return result
         
-        email_summaries = []
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error fetching emails: {str(e)}"
+        )
+
+async def unread_summaries(user_data, mode="auto"):
+    """Summaries of up to 5 unread emails; also indexes them and queues pre-drafts."""
+    credentials = google_credentials(user_data)
+    
+    service = build_service("gmail", "v1", credentials)
+    
+    user = user_key(user_data)
+    
+    # Fetch unread messages
+    results = await execute(service.users().messages().list(
+        userId="me", 
+        q="is:unread"
+    ))
+    
+    messages = results.get("messages", [])
+    
+    if not messages:
+        return {"emails": [], "message": "No unread emails found", "degraded": False}
+    
+    await remember_threads(user, messages)
+    email_summaries = []
+    reply_candidates = []
+    indexed = []
+    fallback = "fast" if mode == "fast" else ("circuit_open" if circuit_open() else None)
+    
+    # Process up to 5 emails to avoid rate limits
+    for message in messages[:5]:
+        raw = await execute(service.users().messages().get(
+            userId="me", 
+            id=message["id"],
+            format="full"
+        ))
+        email = parse_message(raw)
+        sender = email["from"]
+        subject = email["subject"]
+        body = email["body"]
         
-        # Process up to 5 emails to avoid rate limits
-        for message in messages[:5]:
-            email = service.users().messages().get(
-                userId="me", 
-                id=message["id"],
-                format="full"
-            ).execute()
-            
-            # Extract email content
-            headers = email["payload"]["headers"]
-            subject = next((h["value"] for h in headers if h["name"] == "Subject"), "No Subject")
-            sender = next((h["value"] for h in headers if h["name"] == "From"), "Unknown Sender")
-            
-            # Extract body content (simplified)
-            parts = email["payload"].get("parts", [])
-            body = ""
-            
-            if parts:
-                for part in parts:
-                    if part["mimeType"] == "text/plain":
-                        body_data = part["body"].get("data", "")
-                        if body_data:
-                            body += base64.urlsafe_b64decode(body_data).decode("utf-8")
-            else:
-                body_data = email["payload"]["body"].get("data", "")
-                if body_data:
-                    body = base64.urlsafe_b64decode(body_data).decode("utf-8")
-            
+        # Gemini summaries are reused; fast mode is always local
+        cached = await cached_summary(user, message["id"]) if mode == "auto" else None
+        if cached is not None:
+            summary, model_info = cached["summary"], cached["model"]
+        elif fallback is None:
             # Generate summary with Gemini
             prompt = f"""
             Please summarize this email concisely in 2-3 sentences:
@@ -82,113 +153,154 @@ async def get_unread_emails(user_data = Depends(get_current_user)):
             From: {sender}
             Subject: {subject}
             
-            {body[:2000]}  # Limit to avoid token issues
+            {fit_section("email.summary", "body", body)}
             """
             
-            response = gemini_model.generate_content(prompt)
-            summary = response.text
-            
-            email_summaries.append({
-                "id": message["id"],
-                "sender": sender,
-                "subject": subject,
-                "summary": summary
-            })
+            choice = gemini_models.select("email.summary", prompt)
+            try:
+                response = await generate(choice.model, prompt)
+                summary = response.text
+                model_info = choice.info()
+                await store_summary(user, message["id"], summary, model_info)
+            except Exception as gemini_error:
+                if not (isinstance(gemini_error, GeminiUnavailable) or is_quota_error(gemini_error)):
+                    raise
+                # Summarise this and the remaining emails locally rather than fail the inbox
+                fallback = "circuit_open" if isinstance(gemini_error, GeminiUnavailable) else "quota"
         
-        return {"emails": email_summaries}
+        if cached is None and fallback is not None:
+            summary = summarize(strip_quoted(body), title=subject)
+            model_info = LOCAL_MODEL_INFO
+            LOCAL_SUMMARIES.inc(fallback)
         
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error fetching emails: {str(e)}"
-        )
+        email_summaries.append({
+            "id": message["id"],
+            "sender": sender,
+            "subject": subject,
+            "summary": summary,
+            "model": model_info
+        })
+        if needs_reply(raw):
+            reply_candidates.append(email)
+        indexed.append(email)
+    
+    await mail_index.add(user, indexed)
+    
+    if PREDRAFT:
+        # Direct questions first
+        reply_candidates.sort(key=lambda e: "?" not in e["body"])
+        for email in reply_candidates[:PREDRAFT_TOP_N]:
+            predrafter.schedule(
+                user, email["id"], DEFAULT_TONE,
+                functools.partial(write_draft, credentials, user, email["id"], DEFAULT_TONE)
+            )
+    
+    # Tells clients the summaries are local because Gemini was unavailable
+    return {"emails": email_summaries, "degraded": fallback in ("circuit_open", "quota")}
+
+@router.get("/search")
+async def search_email(
+    q: str = Query(min_length=1, max_length=500),
+    limit: int = Query(10, ge=1, le=50),
+    user_data = Depends(get_current_user)
+):
+    """Search mail the app has already fetched, best matches first."""
+    if not MAIL_INDEX:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Mail search is disabled")
+    started = time.perf_counter()
+    results = await mail_index.search(user_key(user_data), q, limit)
+    return {"query": q, "results": results, "took_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+@router.delete("/search/index")
+async def clear_search_index(user_data = Depends(get_current_user)):
+    """Forget all indexed mail for the current user."""
+    removed = await mail_index.clear(user_key(user_data))
+    return {"status": "cleared", "removed": removed}
+
+async def write_draft(credentials, user, message_id, tone):
+    """Draft a reply from the whole thread, reusing a draft made for the same thread state."""
+    service = build_service("gmail", "v1", credentials)
+    
+    # The whole conversation, in one call or from the cache
+    thread = await get_thread(service, user, message_id)
+    cached = await cached_draft(user, message_id, thread["history_id"], tone)
+    if cached is not None:
+        return cached
+    
+    email, earlier = split_thread(thread, message_id)
+    subject = email["subject"]
+    sender = email["from"]
+    message_id_header = email["message_id_header"]
+    references = email["references"]
+    
+    conversation = ""
+    if earlier:
+        history = "\n\n".join(f"From: {m['from']}\nDate: {m['date']}\n\n{m['body']}" for m in earlier)
+        conversation = f"""
+    Earlier messages in this conversation, oldest first:
+    
+    {fit_section("email.draft-reply", "thread", history)}
+    """
+    
+    # Generate reply with Gemini
+    prompt = f"""
+    Please draft a reply to this email in a {tone} tone. 
+    The reply should be contextually relevant and address the main points or questions in the email.
+    {conversation}
+    Email to reply to:
+    From: {sender}
+    Subject: {subject}
+    
+    {fit_section("email.draft-reply", "body", email["body"])}
+    
+    Draft a complete reply, including a suitable greeting and sign-off.
+    
+    Format your response using markdown for better readability:
+    - Use **bold** for important points
+    - Use bullet points (-) for lists when appropriate
+    - Use proper paragraph breaks for better readability
+    """
+    
+    choice = gemini_models.select("email.draft-reply", prompt)
+    response = await generate(choice.model, prompt)
+    
+    # Build threading headers for proper email threading
+    reply_subject = subject if subject.lower().startswith("re:") else f"Re: {subject}"
+    
+    draft = {
+        "reply": response.text, 
+        "subject": reply_subject, 
+        "to": sender,
+        "in_reply_to": message_id_header,
+        "references": f"{references} {message_id_header}".strip() if references else message_id_header,
+        "model": choice.info()
+    }
+    await store_draft(user, message_id, thread["history_id"], tone, draft)
+    return draft
 
 @router.post("/draft-reply")
 async def draft_email_reply(
-    request: dict,
+    request: DraftReplyRequest,
     user_data = Depends(get_current_user)
 ):
     """Draft a reply to an email using Gemini."""
-    message_id = request.get("message_id")
-    tone = request.get("tone", "professional")
+    message_id = request.message_id
+    tone = request.tone
     
-    if not message_id:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="message_id is required"
-        )
     try:
-        credentials = Credentials(
-            token=user_data["access_token"],
-            refresh_token=None,
-            token_uri="https://oauth2.googleapis.com/token",
-            client_id=os.getenv("GOOGLE_CLIENT_ID"),
-            client_secret=os.getenv("GOOGLE_CLIENT_SECRET")
-        )
-        
-        service = build("gmail", "v1", credentials=credentials)
-        
-        # Get the email content
-        email = service.users().messages().get(
-            userId="me", 
-            id=message_id,
-            format="full"
-        ).execute()
-        
-        # Extract email content
-        headers = email["payload"]["headers"]
-        subject = next((h["value"] for h in headers if h["name"] == "Subject"), "No Subject")
-        sender = next((h["value"] for h in headers if h["name"] == "From"), "Unknown Sender")
-        message_id_header = next((h["value"] for h in headers if h["name"] == "Message-ID"), None)
-        references = next((h["value"] for h in headers if h["name"] == "References"), "")
-        
-        # Extract body content (simplified)
-        parts = email["payload"].get("parts", [])
-        body = ""
+        credentials = google_credentials(user_data)
+        user = user_key(user_data)
         
-        if parts:
-            for part in parts:
-                if part["mimeType"] == "text/plain":
-                    body_data = part["body"].get("data", "")
-                    if body_data:
-                        body += base64.urlsafe_b64decode(body_data).decode("utf-8")
-        else:
-            body_data = email["payload"]["body"].get("data", "")
-            if body_data:
-                body = base64.urlsafe_b64decode(body_data).decode("utf-8")
+        # Wait for a speculative draft of this message that is already running
+        predraft = predrafter.claim(user, message_id, tone)
+        if predraft is not None:
+            try:
+                return await asyncio.shield(predraft)
+            except Exception:
+                # The speculative draft failed; draft it here instead
+                pass
         
-        # Generate reply with Gemini
-        prompt = f"""
-        Please draft a reply to this email in a {tone} tone. 
-        The reply should be contextually relevant and address the main points or questions in the email.
-        
-        Original Email:
-        From: {sender}
-        Subject: {subject}
-        
-        {body[:3000]}  # Limit to avoid token issues
-        
-        Draft a complete reply, including a suitable greeting and sign-off.
-        
-        Format your response using markdown for better readability:
-        - Use **bold** for important points
-        - Use bullet points (-) for lists when appropriate
-        - Use proper paragraph breaks for better readability
-        """
-        
-        response = gemini_model.generate_content(prompt)
-        draft_reply = response.text
-        
-        # Build threading headers for proper email threading
-        reply_subject = subject if subject.lower().startswith("re:") else f"Re: {subject}"
-        
-        return {
-            "reply": draft_reply, 
-            "subject": reply_subject, 
-            "to": sender,
-            "in_reply_to": message_id_header,
-            "references": f"{references} {message_id_header}".strip() if references else message_id_header
-        }
+        return await write_draft(credentials, user, message_id, tone)
         
     except Exception as e:
         raise HTTPException(
@@ -196,46 +308,56 @@ async def draft_email_reply(
             detail=f"Error drafting reply: {str(e)}"
         )
 
-@router.post("/send")
+def _queued_response(entry):
+    """202 pointing at the outbox entry that tracks a send."""
+    return JSONResponse(
+        {
+            "id": entry["id"],
+            "status": entry["status"],
+            "message_id_header": entry["message_id_header"],
+            "status_url": f"/email/outbox/{entry['id']}",
+        },
+        status_code=status.HTTP_202_ACCEPTED,
+        headers={"Location": f"/email/outbox/{entry['id']}"}
+    )
+
+@router.post("/send", status_code=status.HTTP_202_ACCEPTED)
 async def send_email(
-    request: dict,
-    user_data = Depends(get_current_user)
+    request: SendEmailRequest,
+    user_data = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, max_length=200)
 ):
-    """Send an email via Gmail API."""
-    to = request.get("to")
-    subject = request.get("subject")
-    body = request.get("body")
-    in_reply_to = request.get("in_reply_to")
-    references = request.get("references")
-    
-    if not to or not subject or not body:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="to, subject, and body are required"
-        )
+    """Queue an email for sending via Gmail API; poll /email/outbox/{id} for delivery."""
+    to = request.to
+    subject = request.subject
+    body = request.body
+    in_reply_to = request.in_reply_to
+    references = request.references
     
     try:
-        print(f"Sending email to: {to}, subject: {subject}")
-        credentials = Credentials(
-            token=user_data["access_token"],
-            refresh_token=None,
-            token_uri="https://oauth2.googleapis.com/token",
-            client_id=os.getenv("GOOGLE_CLIENT_ID"),
-            client_secret=os.getenv("GOOGLE_CLIENT_SECRET")
-        )
+        logger.info("Queueing email", extra={"subject_length": len(subject)})
+        user = user_key(user_data)
         
-        service = build("gmail", "v1", credentials=credentials)
+        # A retried send is answered from the outbox without calling Gmail again
+        if idempotency_key:
+            entry_id = await outbox.find(user, idempotency_key)
+            if entry_id is not None:
+                logger.info("Email queued", extra={"outbox_id": entry_id, "duplicate": True})
+                return _queued_response(await outbox.get(user, entry_id))
         
-        # Get user's email address
-        user_profile = service.users().getProfile(userId="me").execute()
-        user_email = user_profile.get("emailAddress")
-        print(f"Sending from: {user_email}")
+        credentials = google_credentials(user_data)
+        service = build_service("gmail", "v1", credentials)
+        
+        # Get user's email address (cached)
+        user_email = await sender_address(service, user)
         
         # Create message
         message = MIMEText(body)
         message["to"] = to
         message["from"] = user_email  # Gmail requires the From field to be set
         message["subject"] = subject
+        # Our own Message-ID lets a retry check whether an earlier attempt went out
+        message["Message-ID"] = make_msgid(domain=user_email.rpartition("@")[2] if user_email else None)
         
         # Add threading headers for proper email threading
         if in_reply_to:
@@ -246,20 +368,66 @@ async def send_email(
         # Encode message
         raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode("utf-8")
         
-        # Send message
-        sent_message = service.users().messages().send(
-            userId="me",
-            body={"raw": raw_message}
-        ).execute()
+        # Delivered in the background with per-user rate limiting and retries
+        entry_id, created = await outbox.submit(
+            user,
+            raw_message,
+            message["Message-ID"],
+            {"session_id": user_data.get("session_id"), "access_token": user_data["access_token"]},
+            idempotency_key
+        )
+        entry = await outbox.get(user, entry_id)
         
-        print(f"Email sent successfully. Message ID: {sent_message['id']}")
-        return {"message_id": sent_message["id"], "status": "sent"}
+        logger.info("Email queued", extra={"outbox_id": entry_id, "duplicate": not created})
+        return _queued_response(entry)
         
     except Exception as e:
-        print(f"Error sending email: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error queueing email")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error sending email: {str(e)}"
         )
+
+@router.get("/outbox/{entry_id}")
+async def get_send_status(entry_id: str, user_data = Depends(get_current_user)):
+    """Delivery status of a queued email: queued, sending, sent or failed."""
+    entry = await outbox.get(user_key(user_data), entry_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired outbox entry")
+    return entry
+
+# Tools the chat assistant may call; sending stays an explicit user action
+chat_tools.register(
+    "get_unread_emails",
+    "List the user's unread emails with a short summary of each.",
+    lambda args, user_data: unread_summaries(user_data),
+    requires_user=True
+)
+chat_tools.register(
+    "search_email",
+    "Search the user's email by keywords; returns the best-matching messages.",
+    lambda args, user_data: search_email(q=args["query"], limit=int(args.get("limit", 5)), user_data=user_data),
+    parameters={
+        "type": "object",
+        "properties": {
+            "query": {"type": "string", "description": "Keywords to search for"},
+            "limit": {"type": "integer", "description": "Maximum number of results"},
+        },
+        "required": ["query"],
+    },
+    requires_user=True
+)
+chat_tools.register(
+    "draft_email_reply",
+    "Draft (but do not send) a reply to one of the user's emails.",
+    lambda args, user_data: draft_email_reply(DraftReplyRequest(**args), user_data=user_data),
+    parameters={
+        "type": "object",
+        "properties": {
+            "message_id": {"type": "string", "description": "Id of the email to reply to"},
+            "tone": {"type": "string", "description": "Tone of the reply, e.g. professional or friendly"},
+        },
+        "required": ["message_id"],
+    },
+    requires_user=True
+)
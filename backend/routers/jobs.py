@@ -0,0 +1,44 @@
+from fastapi import APIRouter, HTTPException, status
+import os
+from services.jobs import job_queue, TERMINAL_STATUSES
+from services.sse import format_event, event_stream
+
+router = APIRouter()
+
+# Idle SSE connections get a comment this often so proxies keep them open
+KEEPALIVE_SECONDS = float(os.getenv("JOB_EVENTS_KEEPALIVE_SECONDS", "15"))
+
+@router.get("/{job_id}")
+async def get_job(job_id: str):
+    """Poll a background job's status and result."""
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return job
+
+@router.get("/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-sent events for a job: a `status` event per change, then `result` or `error`."""
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+
+    async def events():
+        current = job
+        last_status = None
+        while True:
+            if current is None:
+                yield format_event("error", {"error": "Job expired"})
+                return
+            if current["status"] != last_status:
+                last_status = current["status"]
+                yield format_event("status", {"status": last_status})
+            if last_status in TERMINAL_STATUSES:
+                event = "result" if last_status == "succeeded" else "error"
+                yield format_event(event, current)
+                return
+            await job_queue.wait_for_update(job_id, KEEPALIVE_SECONDS)
+            yield ": keep-alive\n\n"
+            current = await job_queue.get(job_id)
+
+    return event_stream(events())
@@ -0,0 +1,111 @@
+"""Request bodies for the API endpoints.
+
+Every text field has a maximum length so oversized inputs are rejected with
+a 422 before anything is sent to Gemini. The whole body is separately
+capped by BodySizeLimitMiddleware before it is parsed.
+"""
+import os
+from typing import Annotated, List, Literal, Optional, Union
+
+from pydantic import BaseModel, Field
+
+MAX_CODE_CHARS = int(os.getenv("MAX_CODE_CHARS", "100000"))
+MAX_MESSAGE_CHARS = int(os.getenv("MAX_MESSAGE_CHARS", "20000"))
+MAX_CHAT_MESSAGES = int(os.getenv("MAX_CHAT_MESSAGES", "100"))
+MAX_DESCRIPTION_CHARS = int(os.getenv("MAX_DESCRIPTION_CHARS", "5000"))
+MAX_EMAIL_BODY_CHARS = int(os.getenv("MAX_EMAIL_BODY_CHARS", "50000"))
+MAX_BATCH_ITEMS = int(os.getenv("MAX_BATCH_ITEMS", "20"))
+
+# Short free-text fields such as titles, languages and tones
+SHORT_TEXT = 200
+DEFAULT_TONE = "professional"
+DEFAULT_REPORT_SECTIONS = ["Introduction", "Methodology", "Findings", "Recommendations", "Conclusion"]
+
+
+class ChatMessage(BaseModel):
+    role: str = Field(max_length=20)
+    content: str = Field(max_length=MAX_MESSAGE_CHARS)
+
+
+class ChatRequest(BaseModel):
+    messages: List[ChatMessage] = Field(default_factory=list, max_length=MAX_CHAT_MESSAGES)
+
+
+class DraftReplyRequest(BaseModel):
+    message_id: str = Field(min_length=1, max_length=SHORT_TEXT)
+    tone: str = Field(DEFAULT_TONE, max_length=SHORT_TEXT)
+
+
+class SendEmailRequest(BaseModel):
+    to: str = Field(min_length=1, max_length=2000)
+    subject: str = Field(min_length=1, max_length=1000)
+    body: str = Field(min_length=1, max_length=MAX_EMAIL_BODY_CHARS)
+    in_reply_to: Optional[str] = Field(None, max_length=1000)
+    references: Optional[str] = Field(None, max_length=10000)
+
+
+class CreateEventRequest(BaseModel):
+    description: str = Field("", max_length=MAX_DESCRIPTION_CHARS)
+
+
+class ProjectPlanRequest(BaseModel):
+    project_title: str = Field("Untitled Project", max_length=SHORT_TEXT)
+    project_description: str = Field("No description provided", max_length=MAX_DESCRIPTION_CHARS)
+    timeline_weeks: int = Field(4, ge=1, le=520)
+    team_size: int = Field(3, ge=1, le=10000)
+
+
+class ReportTemplateRequest(BaseModel):
+    report_type: str = Field("General", max_length=SHORT_TEXT)
+    report_topic: str = Field("Sample Topic", max_length=MAX_DESCRIPTION_CHARS)
+    sections: Optional[List[Annotated[str, Field(max_length=SHORT_TEXT)]]] = Field(None, max_length=50)
+
+
+class PresentationOutlineRequest(BaseModel):
+    presentation_title: str = Field("Sample Presentation", max_length=SHORT_TEXT)
+    audience: str = Field("General Audience", max_length=SHORT_TEXT)
+    duration_minutes: int = Field(15, ge=1, le=1440)
+
+
+class BatchProjectPlan(ProjectPlanRequest):
+    type: Literal["project-plan"]
+    id: Optional[str] = Field(None, max_length=SHORT_TEXT)
+
+
+class BatchReportTemplate(ReportTemplateRequest):
+    type: Literal["report-template"]
+    id: Optional[str] = Field(None, max_length=SHORT_TEXT)
+
+
+class BatchPresentationOutline(PresentationOutlineRequest):
+    type: Literal["presentation-outline"]
+    id: Optional[str] = Field(None, max_length=SHORT_TEXT)
+
+
+BatchItem = Annotated[
+    Union[BatchProjectPlan, BatchReportTemplate, BatchPresentationOutline],
+    Field(discriminator="type")
+]
+
+
+class DocsBatchRequest(BaseModel):
+    items: List[BatchItem] = Field(min_length=1, max_length=MAX_BATCH_ITEMS)
+
+
+class CodeReviewRequest(BaseModel):
+    code: str = Field("", max_length=MAX_CODE_CHARS)
+    language: str = Field("unknown", max_length=SHORT_TEXT)
+    review_focus: str = Field("general", max_length=SHORT_TEXT)
+
+
+class RefactoringRequest(BaseModel):
+    code: str = Field("", max_length=MAX_CODE_CHARS)
+    language: str = Field("unknown", max_length=SHORT_TEXT)
+    refactoring_goal: str = Field("improve code quality", max_length=SHORT_TEXT)
+
+
+class ExplainCodeRequest(BaseModel):
+    code: str = Field("", max_length=MAX_CODE_CHARS)
+    language: str = Field("unknown", max_length=SHORT_TEXT)
+    # basic, medium or detailed
+    detail_level: str = Field("medium", max_length=SHORT_TEXT)
@@ -0,0 +1,108 @@
+"""Production entrypoint: multi-worker server with uvloop and httptools.
+
+    cd backend
+    python serve.py
+
+Uses gunicorn as the process manager so workers are restarted after
+MAX_REQUESTS requests and replaced if they crash. Where gunicorn is not
+available (e.g. Windows) it falls back to uvicorn's own multi-process mode,
+which cannot recycle workers.
+"""
+import multiprocessing
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", str(multiprocessing.cpu_count())))
+# Seconds an idle keep-alive connection is held open; keep above the load balancer's idle timeout
+KEEPALIVE_SECONDS = int(os.getenv("KEEPALIVE_SECONDS", "75"))
+BACKLOG = int(os.getenv("BACKLOG", "2048"))
+# Recycle each worker after this many requests (plus jitter) to bound memory growth; 0 disables
+MAX_REQUESTS = int(os.getenv("MAX_REQUESTS", "10000"))
+MAX_REQUESTS_JITTER = int(os.getenv("MAX_REQUESTS_JITTER", "1000"))
+GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+# Generations can take a while; workers silent for longer than this are restarted
+WORKER_TIMEOUT = int(os.getenv("WORKER_TIMEOUT", "120"))
+
+
+def _event_loop():
+    try:
+        import uvloop  # noqa: F401
+        return "uvloop"
+    except ImportError:
+        return "asyncio"
+
+
+def _http_protocol():
+    try:
+        import httptools  # noqa: F401
+        return "httptools"
+    except ImportError:
+        return "h11"
+
+
+try:
+    from uvicorn.workers import UvicornWorker
+except ImportError:
+    # uvicorn.workers needs gunicorn
+    UvicornWorker = None
+
+if UvicornWorker is not None:
+    class Worker(UvicornWorker):
+        """Uvicorn worker for gunicorn using uvloop and httptools when installed."""
+
+        CONFIG_KWARGS = {"loop": _event_loop(), "http": _http_protocol()}
+
+
+def run_gunicorn():
+    from gunicorn.app.base import BaseApplication
+
+    class Application(BaseApplication):
+        def load_config(self):
+            options = {
+                "bind": f"{HOST}:{PORT}",
+                "workers": WEB_WORKERS,
+                "worker_class": f"{__name__}.Worker",
+                "keepalive": KEEPALIVE_SECONDS,
+                "backlog": BACKLOG,
+                "max_requests": MAX_REQUESTS,
+                "max_requests_jitter": MAX_REQUESTS_JITTER,
+                "graceful_timeout": GRACEFUL_TIMEOUT,
+                "timeout": WORKER_TIMEOUT,
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from main import app
+            return app
+
+    Application().run()
+
+
+def run_uvicorn():
+    import uvicorn
+
+    uvicorn.run(
+        "main:app",
+        host=HOST,
+        port=PORT,
+        workers=WEB_WORKERS,
+        loop=_event_loop(),
+        http=_http_protocol(),
+        backlog=BACKLOG,
+        timeout_keep_alive=KEEPALIVE_SECONDS,
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+        access_log=False,
+    )
+
+
+if __name__ == "__main__":
+    if UvicornWorker is None:
+        run_uvicorn()
+    else:
+        run_gunicorn()
@@ -0,0 +1,302 @@
+"""Per-user admission control and load shedding.
+
+Every request is checked against limits for its route group (the first path
+segment, e.g. /code), per user: how many of the user's requests may run at
+once and how many may start per minute (a token bucket). Going over either
+is answered with 429 straight away. Requests that pass then need one of
+ADMISSION_MAX_IN_FLIGHT global slots. When those are all taken they wait in
+a bounded FIFO queue for at most ADMISSION_MAX_WAIT_SECONDS; a full queue or
+a wait that runs out is answered with 503. Both carry Retry-After, so a busy
+server turns excess load away in milliseconds instead of letting it pile up
+until clients time out.
+
+Users are identified by their bearer token once get_current_user has
+verified it, so a user's sessions and tokens share one set of limits.
+Tokens that were never verified, e.g. on routes that need no login, and
+anonymous requests are limited by client address; otherwise a client could
+get fresh limits by sending a new made-up token each time. Limits are kept
+per worker process. Conditional long polls on /email/unread and
+/calendar/events count against the user's limits but not the global slots,
+since they spend most of their time asleep. Server-sent event streams give
+their global slot back once the stream has started, so open watchers
+(e.g. /jobs/{id}/events) cannot crowd out other requests.
+
+Per-group limits can be overridden with ADMISSION_LIMITS, either JSON or a
+path to a JSON file, e.g. {"/code": {"concurrency": 1, "rate_per_minute": 10}}.
+ADMISSION=false turns admission control off.
+"""
+import asyncio
+import hashlib
+import json
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from urllib.parse import parse_qs
+
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+from services.log import get_logger
+from services.metrics import ADMISSION_QUEUE_WAIT, ADMISSION_REJECTIONS
+
+logger = get_logger(__name__)
+
+ADMISSION = os.getenv("ADMISSION", "true").lower() == "true"
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "64"))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "256"))
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "10"))
+# Suggested back-off when the server as a whole is saturated
+ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "5"))
+
+# Per user and route group; "default" covers groups not listed
+DEFAULT_LIMITS = {
+    "default": {"concurrency": 8, "rate_per_minute": 120, "burst": 30},
+    "/api": {"concurrency": 3, "rate_per_minute": 30, "burst": 10},
+    "/code": {"concurrency": 2, "rate_per_minute": 20, "burst": 5},
+    "/docs": {"concurrency": 2, "rate_per_minute": 20, "burst": 5},
+    "/email": {"concurrency": 4, "rate_per_minute": 60, "burst": 20},
+    "/calendar": {"concurrency": 4, "rate_per_minute": 60, "burst": 20},
+    "/jobs": {"concurrency": 8, "rate_per_minute": 300, "burst": 60},
+}
+# Health checks and scraping are never limited
+EXEMPT_PATHS = {"/", "/ready", "/metrics"}
+# Routes that hold `?wait=N` requests while If-None-Match is current, see services/conditional.py
+LONG_POLL_PATHS = {"/email/unread", "/calendar/events"}
+
+# Known tokens and per-user state are bounded; idle entries are dropped first
+MAX_IDENTITIES = 10000
+MAX_USER_STATES = 10000
+
+
+def _load_limits():
+    limits = {group: dict(values) for group, values in DEFAULT_LIMITS.items()}
+    override = os.getenv("ADMISSION_LIMITS")
+    if not override:
+        return limits
+    try:
+        if override.lstrip().startswith("{"):
+            loaded = json.loads(override)
+        else:
+            with open(override) as f:
+                loaded = json.load(f)
+        for group, values in loaded.items():
+            limits.setdefault(group, dict(limits["default"])).update(values)
+    except (OSError, ValueError, AttributeError) as e:
+        logger.warning("Ignoring invalid ADMISSION_LIMITS: %s", e)
+    return limits
+
+
+LIMITS = _load_limits()
+
+# sha256 of a bearer token -> user key, filled in by get_current_user
+_identities = OrderedDict()
+
+
+def _token_hash(token):
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def remember_identity(token, user):
+    """Record that `token` belongs to `user`, so its requests share the user's limits."""
+    token_hash = _token_hash(token)
+    _identities[token_hash] = user
+    _identities.move_to_end(token_hash)
+    while len(_identities) > MAX_IDENTITIES:
+        _identities.popitem(last=False)
+
+
+def _identity(scope):
+    authorization = Headers(scope=scope).get("authorization", "")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() == "bearer" and token:
+        user = _identities.get(_token_hash(token.strip()))
+        if user is not None:
+            return user
+    client = scope.get("client")
+    return f"ip:{client[0] if client else 'unknown'}"
+
+
+def _is_long_poll(scope):
+    """True for conditional `wait=` requests to a long-poll route, which mostly sleep."""
+    if scope["method"] != "GET" or scope["path"].rstrip("/") not in LONG_POLL_PATHS:
+        return False
+    if "if-none-match" not in Headers(scope=scope):
+        # Nothing to wait on: the request is answered straight away
+        return False
+    wait = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("wait", ["0"])[0]
+    return wait not in ("", "0")
+
+
+def _is_event_stream(message):
+    """True if an http.response.start message begins a server-sent event stream."""
+    content_type = Headers(raw=message.get("headers", [])).get("content-type", "")
+    return content_type.startswith("text/event-stream")
+
+
+class _UserState:
+    """One user's running requests and rate bucket within a route group."""
+
+    def __init__(self, limits):
+        self.active = 0
+        self.tokens = float(limits["burst"])
+        self.updated = time.monotonic()
+
+    def refill(self, limits, now):
+        rate = limits["rate_per_minute"] / 60
+        self.tokens = min(float(limits["burst"]), self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+    def idle(self, limits, now):
+        self.refill(limits, now)
+        return self.active == 0 and self.tokens >= limits["burst"]
+
+
+class _Gate:
+    """Global in-flight limit with a bounded FIFO queue of waiters."""
+
+    def __init__(self, limit, queue_size):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.in_flight = 0
+        self._waiters = deque()
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    async def acquire(self, timeout):
+        """Take a slot, waiting up to `timeout`; False if the queue is full or the wait ran out."""
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            return True
+        if len(self._waiters) >= self.queue_size:
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+            return True
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            return False
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+
+    def _abandon(self, waiter):
+        if waiter.done() and not waiter.cancelled():
+            # A slot was handed over just as the wait ended; pass it on
+            self.release()
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self):
+        # Hand the slot straight to the next waiter so it cannot be taken out of turn
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+
+class AdmissionControlMiddleware:
+    """Apply per-user limits and the global queue before a request reaches the app."""
+
+    def __init__(self, app, limits=None):
+        self.app = app
+        self.limits = limits or LIMITS
+        self.gate = _Gate(ADMISSION_MAX_IN_FLIGHT, ADMISSION_QUEUE_SIZE)
+        # (user, route group) -> _UserState
+        self._users = {}
+
+    def _group(self, path):
+        group = "/" + path.strip("/").split("/", 1)[0]
+        return group if group in self.limits else "default"
+
+    def _user_state(self, key, limits, now):
+        state = self._users.get(key)
+        if state is None:
+            if len(self._users) >= MAX_USER_STATES:
+                self._prune(now)
+            state = self._users[key] = _UserState(limits)
+        return state
+
+    def _prune(self, now):
+        for key, state in list(self._users.items()):
+            if state.idle(self.limits[key[1]], now):
+                del self._users[key]
+
+    async def _reject(self, scope, receive, send, status_code, detail, retry_after, group, reason):
+        ADMISSION_REJECTIONS.inc(group, reason)
+        response = JSONResponse(
+            {"detail": detail},
+            status_code=status_code,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+        await response(scope, receive, send)
+
+    async def __call__(self, scope, receive, send):
+        if not ADMISSION or scope["type"] != "http" or scope["method"] == "OPTIONS" or scope["path"] in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        group = self._group(scope["path"])
+        limits = self.limits[group]
+        now = time.monotonic()
+        state = self._user_state((_identity(scope), group), limits, now)
+
+        if state.active >= limits["concurrency"]:
+            await self._reject(
+                scope, receive, send, 429,
+                f"Too many concurrent requests; at most {limits['concurrency']} at a time",
+                1, group, "user_concurrency"
+            )
+            return
+        state.refill(limits, now)
+        if state.tokens < 1:
+            await self._reject(
+                scope, receive, send, 429,
+                f"Rate limit exceeded; at most {limits['rate_per_minute']} requests per minute",
+                (1 - state.tokens) * 60 / limits["rate_per_minute"], group, "user_rate"
+            )
+            return
+        state.tokens -= 1
+
+        # Queued requests count against the user too, so one user cannot fill the queue
+        state.active += 1
+        try:
+            if _is_long_poll(scope):
+                # Held long polls mostly sleep, so they skip the global queue
+                await self.app(scope, receive, send)
+                return
+            started = time.perf_counter()
+            queue_full = self.gate.queued >= self.gate.queue_size
+            if not await self.gate.acquire(ADMISSION_MAX_WAIT_SECONDS):
+                await self._reject(
+                    scope, receive, send, 503,
+                    "Server is busy; please retry shortly",
+                    ADMISSION_RETRY_AFTER_SECONDS, group, "queue_full" if queue_full else "queue_timeout"
+                )
+                return
+            ADMISSION_QUEUE_WAIT.observe(time.perf_counter() - started, group)
+            released = False
+
+            async def send_releasing_streams(message):
+                nonlocal released
+                # A started event stream mostly waits; its slot goes to the next request
+                if not released and message["type"] == "http.response.start" and _is_event_stream(message):
+                    released = True
+                    self.gate.release()
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_releasing_streams)
+            finally:
+                if not released:
+                    self.gate.release()
+        finally:
+            state.active -= 1
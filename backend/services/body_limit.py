@@ -0,0 +1,71 @@
+"""Reject oversized request bodies before they are read into memory.
+
+A declared Content-Length over the limit is answered with 413 straight
+away. Chunked bodies without a length are counted as they stream in and
+cut off as soon as they pass the limit, so the JSON parser never sees them.
+"""
+import os
+
+from fastapi import HTTPException, status
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+MAX_REQUEST_BODY_BYTES = int(os.getenv("MAX_REQUEST_BODY_BYTES", str(1024 * 1024)))
+
+
+class RequestBodyTooLarge(HTTPException):
+    def __init__(self, max_bytes=MAX_REQUEST_BODY_BYTES):
+        super().__init__(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Request body exceeds {max_bytes} bytes"
+        )
+
+
+class BodySizeLimitMiddleware:
+    """Answer 413 for request bodies larger than MAX_REQUEST_BODY_BYTES."""
+
+    def __init__(self, app, max_bytes=MAX_REQUEST_BODY_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_bytes:
+            await self._reject(scope, receive, send)
+            return
+
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Raised inside the app, where FastAPI turns it into a 413 response
+                    raise RequestBodyTooLarge(self.max_bytes)
+            return message
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except RequestBodyTooLarge:
+            # The body was read outside FastAPI's exception handling
+            if response_started:
+                raise
+            await self._reject(scope, receive, send)
+
+    async def _reject(self, scope, receive, send):
+        error = RequestBodyTooLarge(self.max_bytes)
+        response = JSONResponse({"detail": error.detail}, status_code=error.status_code, headers={"Connection": "close"})
+        await response(scope, receive, send)
@@ -0,0 +1,22 @@
+"""Opt-in legacy response fields.
+
+Generated markdown used to be returned twice: under `content` and again
+under an endpoint-specific name such as `project_plan`. Only `content` is
+returned now; clients that still read the old names can pass
+`?compat=true`, or the server can set LEGACY_RESPONSE_FIELDS=true.
+"""
+import os
+
+LEGACY_RESPONSE_FIELDS = os.getenv("LEGACY_RESPONSE_FIELDS", "false").lower() == "true"
+
+
+def wants_legacy_fields(request):
+    return LEGACY_RESPONSE_FIELDS or request.query_params.get("compat", "").lower() in ("1", "true")
+
+
+def content_response(request, content, legacy_field, **extra):
+    """Response body with generated text under `content` (and `legacy_field` if requested)."""
+    body = {"content": content, **extra}
+    if wants_legacy_fields(request):
+        body[legacy_field] = content
+    return body
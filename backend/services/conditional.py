@@ -0,0 +1,67 @@
+"""Conditional GET and long polling for endpoints that clients poll.
+
+Responses carry an ETag of their payload. When a request sends it back in
+If-None-Match, the endpoint works out a cheap version of its data, such as
+Gmail's historyId, and if that is unchanged since the ETag was issued the
+request gets an empty 304 instead of a recomputed payload. Requests
+without If-None-Match skip the version check and are answered directly. With `wait=N` the request is held for up to N seconds,
+re-checking the version every LONG_POLL_CHECK_SECONDS, and is answered as
+soon as the data changes, or with 304 when the wait runs out.
+"""
+import asyncio
+import hashlib
+import os
+import time
+
+from fastapi import Response
+
+LONG_POLL_MAX_SECONDS = int(os.getenv("LONG_POLL_MAX_SECONDS", "60"))
+# How often a held request re-checks the version upstream
+LONG_POLL_CHECK_SECONDS = float(os.getenv("LONG_POLL_CHECK_SECONDS", "10"))
+
+# Clients may keep the response but must revalidate it before reuse
+CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*parts):
+    """Strong ETag from the parts that identify a version of a response."""
+    digest = hashlib.sha256("\x1f".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def etag_matches(request, etag):
+    """True if the request's If-None-Match covers `etag`."""
+    header = request.headers.get("if-none-match")
+    if not header or etag is None:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in tags or etag in tags
+
+
+def not_modified(etag):
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+
+
+def set_etag(response, etag):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+
+
+async def wait_for_change(request, current_etag, wait=0):
+    """Latest ETag from `await current_etag()`, holding up to `wait` seconds while it matches If-None-Match.
+
+    `current_etag` may return None when the version can't be known without
+    building the response, which ends the wait. Without If-None-Match there
+    is nothing to compare against, so None is returned without a check.
+    """
+    if not request.headers.get("if-none-match"):
+        return None
+    deadline = time.monotonic() + min(wait, LONG_POLL_MAX_SECONDS)
+    etag = await current_etag()
+    while etag_matches(request, etag):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or await request.is_disconnected():
+            break
+        await asyncio.sleep(min(LONG_POLL_CHECK_SECONDS, remaining))
+        etag = await current_etag()
+    return etag
@@ -0,0 +1,275 @@
+"""Shared helpers for calling Gemini from the routers.
+
+The google.generativeai SDK is slow to import, so it is only imported and
+configured when the first model is actually used.
+
+Calls go through a circuit breaker: after GEMINI_BREAKER_FAILURES quota or
+availability errors in a row, calls fail fast with GeminiUnavailable for
+GEMINI_BREAKER_COOLDOWN_SECONDS, after which a single trial call decides
+whether the circuit closes again.
+"""
+import contextlib
+import contextvars
+import os
+import threading
+import time
+
+from fastapi.concurrency import run_in_threadpool
+
+from services.log import get_logger
+from services.metrics import (
+    UpstreamTimer,
+    GEMINI_CIRCUIT_OPENINGS,
+    GEMINI_PROMPT_TOKENS,
+    GEMINI_COMPLETION_TOKENS,
+    GEMINI_QUOTA_REJECTIONS,
+)
+from services.prompt_budget import calibrate
+from services.tracing import span, in_context
+
+logger = get_logger(__name__)
+
+GEMINI_BREAKER_FAILURES = int(os.getenv("GEMINI_BREAKER_FAILURES", "3"))
+GEMINI_BREAKER_COOLDOWN_SECONDS = float(os.getenv("GEMINI_BREAKER_COOLDOWN_SECONDS", "30"))
+# Errors that say Gemini can't take more work right now, as opposed to a bad request
+_UNAVAILABLE_ERRORS = {"ServiceUnavailable", "DeadlineExceeded", "InternalServerError", "TooManyRequests"}
+
+_configure_lock = threading.Lock()
+_configured = False
+
+# Interactive (request-driven) Gemini traffic, watched by background work so it can stay out of the way
+_activity = {"in_flight": 0, "last_active": 0.0, "last_quota_error": 0.0}
+_background = contextvars.ContextVar("gemini_background", default=False)
+
+
+def _genai():
+    """Import and configure the Gemini SDK on first use."""
+    global _configured
+    import google.generativeai as genai
+
+    if not _configured:
+        with _configure_lock:
+            if not _configured:
+                options = {}
+                if os.getenv("GEMINI_API_ENDPOINT"):
+                    # Point the SDK at a local stand-in, e.g. the benchmark fakes
+                    options = {"transport": "rest", "client_options": {"api_endpoint": os.getenv("GEMINI_API_ENDPOINT")}}
+                genai.configure(api_key=os.getenv("GEMINI_API_KEY"), **options)
+                _configured = True
+    return genai
+
+
+class LazyModel:
+    """GenerativeModel that is only constructed when first used."""
+
+    def __init__(self, model_name, generation_config=None):
+        self.model_name = model_name
+        self.generation_config = generation_config
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = _genai().GenerativeModel(
+                        model_name=self.model_name,
+                        generation_config=self.generation_config
+                    )
+        return self._model
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+
+def is_quota_error(error):
+    """True if Gemini rejected the call for quota or rate limits."""
+    message = str(error).lower()
+    return "quota" in message or "429" in message or type(error).__name__ == "ResourceExhausted"
+
+
+class GeminiUnavailable(Exception):
+    """Raised instead of calling Gemini while its circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Fail fast after repeated quota or availability errors."""
+
+    def __init__(self, failures=GEMINI_BREAKER_FAILURES, cooldown_seconds=GEMINI_BREAKER_COOLDOWN_SECONDS):
+        self.failures = failures
+        self.cooldown_seconds = cooldown_seconds
+        self._consecutive = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    def is_open(self):
+        """True while calls would be refused."""
+        if self._opened_at is None:
+            return False
+        return self._trial_running or time.monotonic() - self._opened_at < self.cooldown_seconds
+
+    def before_call(self):
+        """Raise GeminiUnavailable if open; returns True if this call is the trial."""
+        if self._opened_at is None:
+            return False
+        if self.is_open():
+            raise GeminiUnavailable("Gemini is unavailable (quota or capacity); try again shortly")
+        self._trial_running = True
+        return True
+
+    def end_trial(self):
+        # Called for the trial call however it ended, e.g. when cancelled
+        self._trial_running = False
+
+    def record_success(self):
+        self._consecutive = 0
+        self._opened_at = None
+
+    def record_failure(self, error):
+        if not (is_quota_error(error) or type(error).__name__ in _UNAVAILABLE_ERRORS):
+            return
+        self._consecutive += 1
+        if self._trial_running or self._consecutive >= self.failures:
+            if self._opened_at is None:
+                logger.warning("Gemini circuit opened after %s: %s", type(error).__name__, error)
+                GEMINI_CIRCUIT_OPENINGS.inc()
+            self._opened_at = time.monotonic()
+
+
+breaker = CircuitBreaker()
+
+
+def circuit_open():
+    """True while Gemini calls fail fast; callers can take a local fallback instead."""
+    return breaker.is_open()
+
+
+@contextlib.contextmanager
+def background():
+    """Mark Gemini calls made inside the block as background work."""
+    token = _background.set(True)
+    try:
+        yield
+    finally:
+        _background.reset(token)
+
+
+@contextlib.contextmanager
+def _track_activity():
+    interactive = not _background.get()
+    if interactive:
+        _activity["in_flight"] += 1
+    try:
+        yield
+    finally:
+        if interactive:
+            _activity["in_flight"] -= 1
+            _activity["last_active"] = time.monotonic()
+
+
+def has_headroom(idle_seconds, quota_backoff_seconds):
+    """True if Gemini has been free of interactive calls and quota errors for a while.
+
+    No interactive call may be running or have finished in the last
+    `idle_seconds`, nor any call rejected for quota in the last
+    `quota_backoff_seconds`.
+    """
+    now = time.monotonic()
+    return (
+        _activity["in_flight"] == 0
+        and now - _activity["last_active"] >= idle_seconds
+        and now - _activity["last_quota_error"] >= quota_backoff_seconds
+    )
+
+
+def _model_name(model):
+    return getattr(model, "model_name", "unknown").replace("models/", "")
+
+
+def record_usage(model, response, current_span=None, prompt=None):
+    """Count prompt and completion tokens reported by Gemini.
+
+    With the prompt text as well, the reported count also calibrates the
+    local token estimator.
+    """
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    name = _model_name(model)
+    prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    completion_tokens = getattr(usage, "candidates_token_count", 0) or 0
+    GEMINI_PROMPT_TOKENS.inc(name, amount=prompt_tokens)
+    GEMINI_COMPLETION_TOKENS.inc(name, amount=completion_tokens)
+    if isinstance(prompt, str):
+        calibrate(prompt, prompt_tokens)
+    if current_span is not None:
+        current_span.set_attribute("gemini.prompt_tokens", prompt_tokens)
+        current_span.set_attribute("gemini.completion_tokens", completion_tokens)
+
+
+def _record_failure(name, error):
+    if is_quota_error(error):
+        _activity["last_quota_error"] = time.monotonic()
+        GEMINI_QUOTA_REJECTIONS.inc(name)
+    breaker.record_failure(error)
+
+
+async def generate(model, prompt, **options):
+    """Run generate_content on the thread pool, recording latency and usage.
+
+    `options` go to generate_content as is, e.g. tools for function calling.
+    Raises GeminiUnavailable without calling Gemini while the circuit is open.
+    """
+    trial = breaker.before_call()
+    try:
+        with _track_activity(), span("gemini.generate_content", model=_model_name(model)) as current_span:
+            try:
+                with UpstreamTimer("gemini", "generate_content"):
+                    response = await run_in_threadpool(in_context(model.generate_content, prompt, **options))
+            except Exception as e:
+                _record_failure(_model_name(model), e)
+                raise
+            breaker.record_success()
+            record_usage(model, response, current_span, prompt)
+    finally:
+        if trial:
+            breaker.end_trial()
+    return response
+
+
+async def generate_stream(model, prompt):
+    """Yield chunks of a streaming generate_content call as Gemini produces them."""
+    name = _model_name(model)
+    trial = breaker.before_call()
+    try:
+        with _track_activity(), UpstreamTimer("gemini", "stream_generate_content"):
+            try:
+                # The span covers time to first chunk; spans can't safely stay open across yields
+                with span("gemini.stream_generate_content", model=name):
+                    response = await run_in_threadpool(in_context(model.generate_content, prompt, stream=True))
+                    chunks = iter(response)
+                    chunk = await run_in_threadpool(next, chunks, None)
+                while chunk is not None:
+                    yield chunk
+                    chunk = await run_in_threadpool(next, chunks, None)
+            except Exception as e:
+                _record_failure(name, e)
+                raise
+        breaker.record_success()
+    finally:
+        if trial:
+            breaker.end_trial()
+    record_usage(model, response, prompt=prompt)
+
+
+def usage_summary(response):
+    """Token counts from a response or final stream chunk, or None."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return None
+    return {
+        "prompt_tokens": getattr(usage, "prompt_token_count", 0) or 0,
+        "completion_tokens": getattr(usage, "candidates_token_count", 0) or 0,
+        "total_tokens": getattr(usage, "total_token_count", 0) or 0,
+    }
@@ -0,0 +1,209 @@
+"""Shared pooled HTTP transport for Gmail, Calendar and OAuth calls.
+
+googleapiclient normally creates a new httplib2 transport per build() call, so
+every request pays for a fresh TCP and TLS handshake. Instead, all Google API
+traffic goes through one thread-safe httpx client with connection pooling,
+keep-alive and HTTP/2 when the h2 package is installed.
+"""
+import os
+import socket
+import threading
+import time
+
+from fastapi.concurrency import run_in_threadpool
+
+from services.log import get_logger
+from services.metrics import UpstreamTimer
+from services.tracing import span, in_context
+
+GOOGLE_HTTP_MAX_CONNECTIONS = int(os.getenv("GOOGLE_HTTP_MAX_CONNECTIONS", "100"))
+GOOGLE_HTTP_MAX_KEEPALIVE = int(os.getenv("GOOGLE_HTTP_MAX_KEEPALIVE", "20"))
+GOOGLE_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("GOOGLE_HTTP_KEEPALIVE_EXPIRY", "60"))
+GOOGLE_HTTP_TIMEOUT = float(os.getenv("GOOGLE_HTTP_TIMEOUT", "30"))
+GOOGLE_HTTP_CONNECT_TIMEOUT = float(os.getenv("GOOGLE_HTTP_CONNECT_TIMEOUT", "5"))
+# Override the API host, e.g. to use the benchmark fakes
+GOOGLE_API_ENDPOINT = os.getenv("GOOGLE_API_ENDPOINT")
+
+logger = get_logger(__name__)
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def _http2_available():
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def get_client():
+    """Return the process-wide pooled client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import httpx
+
+                _client = httpx.Client(
+                    http2=_http2_available(),
+                    limits=httpx.Limits(
+                        max_connections=GOOGLE_HTTP_MAX_CONNECTIONS,
+                        max_keepalive_connections=GOOGLE_HTTP_MAX_KEEPALIVE,
+                        keepalive_expiry=GOOGLE_HTTP_KEEPALIVE_EXPIRY,
+                    ),
+                    timeout=httpx.Timeout(GOOGLE_HTTP_TIMEOUT, connect=GOOGLE_HTTP_CONNECT_TIMEOUT),
+                )
+    return _client
+
+
+def close_client():
+    """Close pooled connections, e.g. on shutdown."""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def _send(method, uri, body=None, headers=None):
+    """Send a request over the shared client, raising socket-style errors.
+
+    googleapiclient retries on socket.timeout and ConnectionError, so httpx
+    transport errors are translated to those.
+    """
+    import httpx
+
+    try:
+        return get_client().request(method, uri, content=body, headers=headers)
+    except httpx.TimeoutException as e:
+        raise socket.timeout(str(e)) from e
+    except httpx.TransportError as e:
+        raise ConnectionError(str(e)) from e
+
+
+class AuthorizedHttp:
+    """httplib2-compatible adapter passed to googleapiclient's build().
+
+    Only carries the user's credentials; the connections themselves live in
+    the shared client, so instances are cheap and safe to create per request.
+    """
+
+    def __init__(self, credentials):
+        self.credentials = credentials
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        import httplib2
+
+        headers = dict(headers or {})
+        self.credentials.apply(headers)
+        response = _send(method, uri, body=body, headers=headers)
+
+        info = {key.lower(): value for key, value in response.headers.items()}
+        info["status"] = str(response.status_code)
+        return httplib2.Response(info), response.content
+
+
+class _AuthResponse:
+    """google.auth transport response backed by an httpx response."""
+
+    def __init__(self, response):
+        self.status = response.status_code
+        self.headers = response.headers
+        self.data = response.content
+
+
+class AuthRequest:
+    """google.auth transport request used for token refreshes."""
+
+    def __call__(self, url, method="GET", body=None, headers=None, timeout=None, **kwargs):
+        from google.auth import exceptions
+
+        try:
+            return _AuthResponse(_send(method, url, body=body, headers=headers))
+        except (socket.timeout, ConnectionError) as e:
+            raise exceptions.TransportError(str(e)) from e
+
+
+_discovery_docs = {}
+
+
+def _discovery_doc(api, version):
+    """Discovery document text bundled with googleapiclient, read once per process.
+
+    The text rather than the parsed dict is cached because build mutates the
+    parsed document while constructing resources.
+    """
+    key = (api, version)
+    if key not in _discovery_docs:
+        from googleapiclient.discovery_cache import get_static_doc
+
+        _discovery_docs[key] = get_static_doc(api, version)
+    return _discovery_docs[key]
+
+
+def build_service(api, version, credentials):
+    """Build a Google API client that uses the shared transport."""
+    from googleapiclient.discovery import build, build_from_document
+
+    client_options = {"api_endpoint": GOOGLE_API_ENDPOINT} if GOOGLE_API_ENDPOINT else None
+    with span("google.build", api=api, version=version):
+        document = _discovery_doc(api, version)
+        if document is None:
+            return build(
+                api,
+                version,
+                http=AuthorizedHttp(credentials),
+                cache_discovery=False,
+                static_discovery=True,
+                client_options=client_options
+            )
+        return build_from_document(document, http=AuthorizedHttp(credentials), client_options=client_options)
+
+
+def preload_discovery(apis):
+    """Read and parse the discovery documents for (api, version) pairs ahead of use."""
+    from googleapiclient.discovery import build_from_document
+
+    for api, version in apis:
+        document = _discovery_doc(api, version)
+        if document is not None:
+            # Also imports the rest of googleapiclient and warms its parsing code
+            build_from_document(document, developerKey="warmup")
+
+
+def warm_connections(urls):
+    """Open pooled connections to each host so the first request skips DNS and TLS.
+
+    Returns the number of hosts that answered; any HTTP status counts.
+    """
+    warmed = 0
+    for url in urls:
+        started = time.perf_counter()
+        try:
+            _send("HEAD", url)
+        except (socket.timeout, ConnectionError) as e:
+            logger.warning("Connection warm-up to %s failed: %s", url, e)
+            continue
+        warmed += 1
+        logger.debug("Connection to %s warmed in %.0f ms", url, (time.perf_counter() - started) * 1000)
+    return warmed
+
+
+def http_status(error):
+    """HTTP status of a googleapiclient HttpError, or None for other errors."""
+    status = getattr(getattr(error, "resp", None), "status", None)
+    return int(status) if status is not None else None
+
+
+async def execute(request):
+    """Execute a googleapiclient request on the thread pool and time it.
+
+    The operation name comes from the discovery method id, e.g.
+    "gmail.users.messages.get" is recorded as gmail / messages.get.
+    """
+    parts = request.methodId.split(".")
+    upstream, operation = parts[0], ".".join(parts[-2:])
+    with span(f"{upstream}.{operation}"), UpstreamTimer(upstream, operation):
+        return await run_in_threadpool(in_context(request.execute))
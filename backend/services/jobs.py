@@ -0,0 +1,285 @@
+"""Background jobs for long-running generations.
+
+Endpoints called with `?async=true` submit a job and return 202 with its id
+right away instead of holding the connection open. Jobs are stored in SQLite
+and that table is the queue: each worker process runs JOB_WORKERS
+coroutines that claim the highest-priority queued job, hold a lease on it
+while it runs and write the result back. Results survive restarts, and a
+job whose worker died is picked up again once its lease expires. Any worker
+can answer GET /jobs/{id}, whichever one ran the job.
+"""
+import asyncio
+import json
+import os
+import secrets
+import time
+
+from fastapi import status
+from fastapi.responses import JSONResponse
+
+from services.log import get_logger
+from services.metrics import JOB_DURATION, JOB_QUEUE_WAIT
+from services.shared_state import STATE_DB_PATH, connect, register_migration
+
+logger = get_logger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_TIMEOUT_SECONDS = float(os.getenv("JOB_TIMEOUT_SECONDS", "300"))
+# Finished jobs are kept this long for polling
+JOB_RESULT_TTL_SECONDS = int(os.getenv("JOB_RESULT_TTL_SECONDS", str(24 * 3600)))
+# How often idle workers look for jobs submitted by other processes
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "1"))
+JOB_LEASE_SECONDS = 30
+JOB_MAX_ATTEMPTS = 2
+SWEEP_INTERVAL_SECONDS = 60
+
+# Lower runs first
+DEFAULT_PRIORITY = 5
+TERMINAL_STATUSES = ("succeeded", "failed")
+
+
+def _create_jobs(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL,
+            priority INTEGER NOT NULL,
+            payload TEXT NOT NULL,
+            result TEXT,
+            error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            lease_until REAL NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS jobs_by_priority ON jobs (status, priority, created_at)")
+
+
+class JobQueue:
+    """Priority job queue persisted in SQLite and shared by all workers."""
+
+    def __init__(self, path=STATE_DB_PATH):
+        self.path = path
+        register_migration(path, "jobs.0001_create", _create_jobs)
+        self._handlers = {}
+        self._wakeup = None
+        # job id -> [event set when this process next changes the job, number of waiters]
+        self._updates = {}
+        self._last_sweep = 0.0
+
+    def _connect(self):
+        return connect(self.path)
+
+    def register(self, kind, handler, priority=DEFAULT_PRIORITY):
+        """Register `async handler(payload)` returning a str or JSON-able dict."""
+        self._handlers[kind] = (handler, priority)
+
+    def _insert(self, job_id, kind, payload, priority):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, priority, payload, created_at) VALUES (?, ?, 'queued', ?, ?, ?)",
+                (job_id, kind, priority, json.dumps(payload), time.time())
+            )
+
+    async def submit(self, kind, payload, priority=None):
+        """Queue a job and return its id."""
+        if kind not in self._handlers:
+            raise ValueError(f"No handler registered for job kind {kind}")
+        if priority is None:
+            priority = self._handlers[kind][1]
+        job_id = secrets.token_urlsafe(16)
+        await asyncio.to_thread(self._insert, job_id, kind, payload, priority)
+        logger.info("Job queued", extra={"job_id": job_id, "kind": kind, "priority": priority})
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job_id
+
+    def _get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute(
+                """
+                SELECT id, kind, status, priority, result, error, attempts, created_at, started_at, finished_at
+                FROM jobs WHERE id = ?
+                """,
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row[0],
+            "kind": row[1],
+            "status": row[2],
+            "priority": row[3],
+            "result": json.loads(row[4]) if row[4] else None,
+            "error": row[5],
+            "attempts": row[6],
+            "created_at": row[7],
+            "started_at": row[8],
+            "finished_at": row[9],
+        }
+
+    async def get(self, job_id):
+        """Current state of a job, or None if it is unknown or expired."""
+        return await asyncio.to_thread(self._get, job_id)
+
+    async def wait_for_update(self, job_id, timeout):
+        """Wait until this process updates the job, or `timeout` seconds.
+
+        Jobs run by other processes are only noticed when the caller polls
+        again after the timeout.
+        """
+        entry = self._updates.setdefault(job_id, [asyncio.Event(), 0])
+        entry[1] += 1
+        try:
+            await asyncio.wait_for(entry[0].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            # The last waiter to leave drops the entry, unless a notification already replaced it
+            entry[1] -= 1
+            if entry[1] == 0 and self._updates.get(job_id) is entry:
+                del self._updates[job_id]
+
+    def _notify(self, job_id):
+        # Wakes every current waiter; callers re-read the job, then wait on a fresh event
+        entry = self._updates.pop(job_id, None)
+        if entry is not None:
+            entry[0].set()
+
+    def _claim(self):
+        """Atomically take the next runnable job; returns (id, kind, payload, created_at) or None."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            while True:
+                row = conn.execute(
+                    """
+                    SELECT id, kind, payload, attempts, created_at FROM jobs
+                    WHERE status = 'queued' OR (status = 'running' AND lease_until < ?)
+                    ORDER BY priority, created_at LIMIT 1
+                    """,
+                    (now,)
+                ).fetchone()
+                if row is None:
+                    conn.commit()
+                    return None
+                job_id, kind, payload, attempts, created_at = row
+                if attempts >= JOB_MAX_ATTEMPTS:
+                    # Its worker died every time; don't let it take down another one
+                    conn.execute(
+                        "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                        ("Job was interrupted too many times", now, job_id)
+                    )
+                    continue
+                conn.execute(
+                    """
+                    UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ?, started_at = ?
+                    WHERE id = ?
+                    """,
+                    (now + JOB_LEASE_SECONDS, now, job_id)
+                )
+                conn.commit()
+                return job_id, kind, json.loads(payload), created_at
+        except Exception:
+            conn.rollback()
+            raise
+
+    def _renew_lease(self, job_id):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = 'running'",
+                (time.time() + JOB_LEASE_SECONDS, job_id)
+            )
+
+    def _finish(self, job_id, job_status, result=None, error=None):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+                (job_status, json.dumps(result) if result is not None else None, error, time.time(), job_id)
+            )
+
+    def _sweep(self):
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?",
+                (time.time() - JOB_RESULT_TTL_SECONDS,)
+            )
+
+    async def _keep_lease(self, job_id):
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            await asyncio.to_thread(self._renew_lease, job_id)
+
+    async def _run(self, job_id, kind, payload, created_at):
+        JOB_QUEUE_WAIT.observe(time.time() - created_at, kind)
+        self._notify(job_id)
+        started = time.perf_counter()
+        lease = asyncio.create_task(self._keep_lease(job_id))
+        try:
+            handler = self._handlers[kind][0]
+            result = await asyncio.wait_for(handler(payload), JOB_TIMEOUT_SECONDS)
+            if isinstance(result, str):
+                result = {"content": result}
+            await asyncio.to_thread(self._finish, job_id, "succeeded", result)
+            job_status = "succeeded"
+        except asyncio.CancelledError:
+            # Shutting down; the lease expires and another worker retries the job
+            raise
+        except Exception as e:
+            logger.warning("Job %s (%s) failed: %s", job_id, kind, e)
+            error = "Job timed out" if isinstance(e, asyncio.TimeoutError) else str(e)
+            await asyncio.to_thread(self._finish, job_id, "failed", None, error)
+            job_status = "failed"
+        finally:
+            lease.cancel()
+        JOB_DURATION.observe(time.perf_counter() - started, kind, job_status)
+        self._notify(job_id)
+
+    async def _worker(self):
+        while True:
+            try:
+                if time.time() - self._last_sweep > SWEEP_INTERVAL_SECONDS:
+                    self._last_sweep = time.time()
+                    await asyncio.to_thread(self._sweep)
+                self._wakeup.clear()
+                job = await asyncio.to_thread(self._claim)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Error claiming job")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_INTERVAL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(*job)
+
+    async def run(self):
+        """Run the worker pool until cancelled."""
+        self._wakeup = asyncio.Event()
+        await asyncio.gather(*(self._worker() for _ in range(JOB_WORKERS)))
+
+
+def accepted_response(job_id):
+    """202 response pointing the client at the job's status and event URLs."""
+    return JSONResponse(
+        {
+            "job_id": job_id,
+            "status": "queued",
+            "status_url": f"/jobs/{job_id}",
+            "events_url": f"/jobs/{job_id}/events",
+        },
+        status_code=status.HTTP_202_ACCEPTED,
+        headers={"Location": f"/jobs/{job_id}"}
+    )
+
+
+job_queue = JobQueue()
@@ -0,0 +1,229 @@
+"""Gmail message parsing and a cache of parsed conversation threads.
+
+Drafting a reply needs the whole conversation, not just the last message,
+so threads are fetched with one threads.get call. Quoted history is stripped
+from each message because the earlier messages are already in the thread.
+The parsed thread is cached, encrypted, under its threadId and historyId,
+which changes whenever anything in the thread does. A map from message id
+to thread lets the next draft in the same conversation skip Gmail entirely.
+Gemini summaries are cached per message, since a message never changes.
+"""
+import asyncio
+import base64
+import os
+import re
+
+from services.google_http import execute, http_status
+from services.mail_index import mail_index
+from services.metrics import CACHE_REQUESTS
+from services.shared_state import SharedCache
+
+GMAIL_THREAD_CACHE_TTL_SECONDS = int(os.getenv("GMAIL_THREAD_CACHE_TTL_SECONDS", "600"))
+# Threads carry full message bodies, so the cache is capped by size
+GMAIL_THREAD_CACHE_MAX_BYTES = int(os.getenv("GMAIL_THREAD_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# A user's own address practically never changes
+SENDER_CACHE_TTL_SECONDS = int(os.getenv("SENDER_CACHE_TTL_SECONDS", str(24 * 3600)))
+SUMMARY_CACHE_TTL_SECONDS = int(os.getenv("SUMMARY_CACHE_TTL_SECONDS", str(24 * 3600)))
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", "2000"))
+
+# "On Mon, 6 Oct 2026 at 09:00, Jane <jane@example.com> wrote:", possibly wrapped onto a second line
+_REPLY_HEADER = re.compile(
+    r"^(?:On\b[^\n]*(?:\n[^\n]*)?wrote:[ \t]*$"
+    r"|-{2,}\s*Original Message\s*-{2,}"
+    r"|From:[^\n]+\n(?:Sent|Date):)",
+    re.MULTILINE
+)
+
+# Senders and headers of mail nobody replies to
+_AUTOMATED_SENDER = re.compile(r"no-?reply|do-?not-?reply|notifications?@|mailer-daemon|bounce", re.IGNORECASE)
+_BULK_PRECEDENCE = ("bulk", "list", "junk")
+
+thread_cache = SharedCache(
+    "gmail_threads", ttl_seconds=GMAIL_THREAD_CACHE_TTL_SECONDS, encrypt=True, max_bytes=GMAIL_THREAD_CACHE_MAX_BYTES
+)
+# user:message id -> {"thread_id", "history_id"}; history_id is None until the thread is fetched
+message_threads = SharedCache("gmail_message_threads", ttl_seconds=GMAIL_THREAD_CACHE_TTL_SECONDS, encrypt=True)
+sender_addresses = SharedCache("gmail_sender", ttl_seconds=SENDER_CACHE_TTL_SECONDS, encrypt=True)
+# user:message id -> {"summary", "model"} written by Gemini; local summaries are not cached
+summary_cache = SharedCache("email_summaries", ttl_seconds=SUMMARY_CACHE_TTL_SECONDS, encrypt=True, max_entries=SUMMARY_CACHE_SIZE)
+
+
+def header(message, name, default=None):
+    """Value of the first header called `name` (case-insensitive)."""
+    name = name.lower()
+    for h in message["payload"].get("headers", []):
+        if h["name"].lower() == name:
+            return h["value"]
+    return default
+
+
+def _decode(data):
+    return base64.urlsafe_b64decode(data).decode("utf-8", errors="replace")
+
+
+def extract_body(payload):
+    """Plain-text body of a message payload, searching nested multiparts."""
+    parts = payload.get("parts")
+    if not parts:
+        data = payload.get("body", {}).get("data", "")
+        return _decode(data) if data and payload.get("mimeType", "text/plain") == "text/plain" else ""
+    body = ""
+    for part in parts:
+        if part.get("mimeType") == "text/plain":
+            data = part.get("body", {}).get("data", "")
+            if data:
+                body += _decode(data)
+        elif part.get("mimeType", "").startswith("multipart/"):
+            body += extract_body(part)
+    return body
+
+
+def strip_quoted(body):
+    """Drop the quoted history that mail clients append to replies."""
+    match = _REPLY_HEADER.search(body)
+    own_text = body[:match.start()] if match else body
+    lines = [line for line in own_text.splitlines() if not line.startswith(">")]
+    stripped = "\n".join(lines).strip()
+    # A message that is only a quote (e.g. a bare forward) keeps its text
+    return stripped or body.strip()
+
+
+def needs_reply(message):
+    """Guess whether a Gmail API message is personal mail that expects an answer."""
+    if _AUTOMATED_SENDER.search(header(message, "From", "")):
+        return False
+    if header(message, "List-Unsubscribe") or header(message, "List-Id"):
+        return False
+    if (header(message, "Precedence") or "").lower() in _BULK_PRECEDENCE:
+        return False
+    return (header(message, "Auto-Submitted") or "no").lower() == "no"
+
+
+def parse_message(message):
+    """The fields used to summarise and reply to a Gmail API message."""
+    return {
+        "id": message["id"],
+        "thread_id": message.get("threadId"),
+        "from": header(message, "From", "Unknown Sender"),
+        "subject": header(message, "Subject", "No Subject"),
+        "date": header(message, "Date"),
+        "message_id_header": header(message, "Message-ID"),
+        "references": header(message, "References", ""),
+        "body": extract_body(message["payload"]),
+    }
+
+
+def parse_thread(thread):
+    """Messages of a threads.get response, oldest first, with quoted history stripped."""
+    messages = []
+    for raw in thread.get("messages", []):
+        message = parse_message(raw)
+        message["body"] = strip_quoted(message["body"])
+        messages.append(message)
+    return {"thread_id": thread["id"], "history_id": thread.get("historyId"), "messages": messages}
+
+
+def split_thread(thread, message_id):
+    """The message with id `message_id` and the distinct messages before it."""
+    messages = thread["messages"]
+    index = next((i for i, m in enumerate(messages) if m["id"] == message_id), len(messages) - 1)
+    target = messages[index]
+    earlier = []
+    seen = {target["body"]}
+    for message in messages[:index]:
+        # The same mail sent to several of the user's addresses shows up more than once
+        if message["body"] in seen:
+            continue
+        seen.add(message["body"])
+        earlier.append(message)
+    return target, earlier
+
+
+def _thread_key(user, thread_id, history_id):
+    return f"{user}:{thread_id}:{history_id}"
+
+
+def _remember_threads(user, messages):
+    for message in messages:
+        if message.get("threadId"):
+            # add() keeps an entry that already knows the thread's historyId
+            message_threads.add(f"{user}:{message['id']}", {"thread_id": message["threadId"], "history_id": None})
+
+
+async def remember_threads(user, messages):
+    """Record the thread of each {"id", "threadId"} from messages.list, saving a lookup later."""
+    await asyncio.to_thread(_remember_threads, user, messages)
+
+
+def _store_thread(user, thread_id, thread):
+    thread_cache.set(_thread_key(user, thread_id, thread["history_id"]), thread)
+    for message in thread["messages"]:
+        message_threads.set(f"{user}:{message['id']}", {"thread_id": thread_id, "history_id": thread["history_id"]})
+
+
+async def get_thread(service, user, message_id):
+    """Parsed thread containing `message_id`, from the cache when possible."""
+    location = await message_threads.get_async(f"{user}:{message_id}")
+    if location and location["history_id"]:
+        # Decrypting a large thread would stall the event loop
+        thread = await thread_cache.get_async(_thread_key(user, location["thread_id"], location["history_id"]))
+        if thread is not None:
+            CACHE_REQUESTS.inc("gmail_threads", "hit")
+            return thread
+    CACHE_REQUESTS.inc("gmail_threads", "miss")
+
+    try:
+        if location:
+            thread_id = location["thread_id"]
+        else:
+            message = await execute(service.users().messages().get(
+                userId="me",
+                id=message_id,
+                format="minimal",
+                fields="threadId"
+            ))
+            thread_id = message["threadId"]
+
+        thread = parse_thread(await execute(service.users().threads().get(
+            userId="me",
+            id=thread_id,
+            format="full"
+        )))
+    except Exception as e:
+        if http_status(e) == 404:
+            # Deleted from Gmail, so it shouldn't turn up in search either
+            await mail_index.remove(user, [message_id])
+        raise
+    await mail_index.sync_thread(user, thread)
+    await asyncio.to_thread(_store_thread, user, thread_id, thread)
+    return thread
+
+
+async def sender_address(service, user):
+    """The user's Gmail address for the From header, looked up once per SENDER_CACHE_TTL_SECONDS."""
+    address = await sender_addresses.get_async(user)
+    if address is not None:
+        CACHE_REQUESTS.inc("gmail_sender", "hit")
+        return address
+    CACHE_REQUESTS.inc("gmail_sender", "miss")
+    profile = await execute(service.users().getProfile(userId="me"))
+    address = profile.get("emailAddress")
+    if address:
+        await sender_addresses.set_async(user, address)
+    return address
+
+
+async def mailbox_history_id(service):
+    """The mailbox's current historyId, which changes whenever anything in it does."""
+    profile = await execute(service.users().getProfile(userId="me", fields="historyId"))
+    return profile.get("historyId")
+
+
+async def cached_summary(user, message_id):
+    summary = await summary_cache.get_async(f"{user}:{message_id}")
+    CACHE_REQUESTS.inc("email_summaries", "miss" if summary is None else "hit")
+    return summary
+
+
+async def store_summary(user, message_id, summary, model):
+    await summary_cache.set_async(f"{user}:{message_id}", {"summary": summary, "model": model})
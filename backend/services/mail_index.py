@@ -0,0 +1,210 @@
+"""Per-user full-text index over mail the app has already fetched.
+
+Every message parsed for /email/unread or a reply draft is added to a
+SQLite FTS5 index, so /email/search (and the chat assistant) can find mail
+locally in milliseconds instead of with a Gmail search round-trip. Results
+are ranked with BM25, weighting subject over sender over body.
+
+The index is incremental. Re-indexing a message replaces it, a thread
+fetched again drops messages that were deleted from it, and messages Gmail
+no longer has are removed when a fetch 404s. Each user keeps at most
+MAIL_INDEX_MAX_MESSAGES messages, the most recently indexed ones.
+
+FTS5 needs the text in the clear, so unlike the other caches the index is
+not encrypted. It lives in its own file (MAIL_INDEX_DB_PATH); set
+MAIL_INDEX=false to turn it off.
+"""
+import asyncio
+import os
+import re
+import time
+
+from services.log import get_logger
+from services.shared_state import DATA_DIR, connect, register_migration
+
+logger = get_logger(__name__)
+
+MAIL_INDEX = os.getenv("MAIL_INDEX", "true").lower() == "true"
+MAIL_INDEX_DB_PATH = os.getenv("MAIL_INDEX_DB_PATH", os.path.join(DATA_DIR, "mail_index.db"))
+MAIL_INDEX_MAX_MESSAGES = int(os.getenv("MAIL_INDEX_MAX_MESSAGES", "5000"))
+# Longer bodies are indexed from their start only
+MAIL_INDEX_MAX_BODY_CHARS = int(os.getenv("MAIL_INDEX_MAX_BODY_CHARS", "20000"))
+
+# bm25 column weights: subject, sender, body
+_WEIGHTS = (5.0, 3.0, 1.0)
+_QUERY_TERM = re.compile(r"\w+")
+
+
+def _match_expression(query, operator):
+    """FTS5 query from free text: quoted terms, the last one as a prefix."""
+    terms = [f'"{term}"' for term in _QUERY_TERM.findall(query.lower())]
+    if not terms:
+        return None
+    terms[-1] += "*"
+    return f" {operator} ".join(terms)
+
+
+def _create_index(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS mail_docs (
+            id INTEGER PRIMARY KEY,
+            user TEXT NOT NULL,
+            message_id TEXT NOT NULL,
+            thread_id TEXT,
+            sender TEXT,
+            subject TEXT,
+            date TEXT,
+            indexed_at REAL NOT NULL,
+            UNIQUE (user, message_id)
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS mail_docs_by_thread ON mail_docs (user, thread_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS mail_docs_by_age ON mail_docs (user, indexed_at)")
+    conn.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS mail_fts USING fts5(
+            subject, sender, body,
+            tokenize = 'porter unicode61 remove_diacritics 2'
+        )
+        """
+    )
+
+
+class MailIndex:
+    """SQLite FTS5 index of fetched messages, partitioned by user."""
+
+    def __init__(self, path=MAIL_INDEX_DB_PATH):
+        self.path = path
+        register_migration(path, "mail_index.0001_create", _create_index)
+
+    def _connect(self):
+        return connect(self.path)
+
+    def _delete_docs(self, conn, ids):
+        for doc_id in ids:
+            conn.execute("DELETE FROM mail_fts WHERE rowid = ?", (doc_id,))
+            conn.execute("DELETE FROM mail_docs WHERE id = ?", (doc_id,))
+
+    def _add(self, user, messages):
+        now = time.time()
+        with self._connect() as conn:
+            for message in messages:
+                existing = conn.execute(
+                    "SELECT id FROM mail_docs WHERE user = ? AND message_id = ?",
+                    (user, message["id"])
+                ).fetchone()
+                if existing:
+                    self._delete_docs(conn, [existing[0]])
+                cursor = conn.execute(
+                    """
+                    INSERT INTO mail_docs (user, message_id, thread_id, sender, subject, date, indexed_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (user, message["id"], message.get("thread_id"), message["from"], message["subject"], message.get("date"), now)
+                )
+                conn.execute(
+                    "INSERT INTO mail_fts (rowid, subject, sender, body) VALUES (?, ?, ?, ?)",
+                    (cursor.lastrowid, message["subject"], message["from"], message["body"][:MAIL_INDEX_MAX_BODY_CHARS])
+                )
+            # Keep each user's index bounded, dropping what was indexed longest ago
+            overflow = conn.execute(
+                "SELECT id FROM mail_docs WHERE user = ? ORDER BY indexed_at DESC, id DESC LIMIT -1 OFFSET ?",
+                (user, MAIL_INDEX_MAX_MESSAGES)
+            ).fetchall()
+            self._delete_docs(conn, [row[0] for row in overflow])
+
+    def _sync_thread(self, user, thread):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, message_id FROM mail_docs WHERE user = ? AND thread_id = ?",
+                (user, thread["thread_id"])
+            ).fetchall()
+            current = {message["id"] for message in thread["messages"]}
+            self._delete_docs(conn, [doc_id for doc_id, message_id in rows if message_id not in current])
+        self._add(user, [{**message, "thread_id": thread["thread_id"]} for message in thread["messages"]])
+
+    def _remove(self, user, message_ids):
+        with self._connect() as conn:
+            ids = []
+            for message_id in message_ids:
+                row = conn.execute(
+                    "SELECT id FROM mail_docs WHERE user = ? AND message_id = ?",
+                    (user, message_id)
+                ).fetchone()
+                if row:
+                    ids.append(row[0])
+            self._delete_docs(conn, ids)
+
+    def _clear(self, user):
+        with self._connect() as conn:
+            ids = [row[0] for row in conn.execute("SELECT id FROM mail_docs WHERE user = ?", (user,))]
+            self._delete_docs(conn, ids)
+        return len(ids)
+
+    def _search(self, user, query, limit):
+        with self._connect() as conn:
+            # All terms first; if nothing has them all, rank mail with any of them
+            for operator in ("AND", "OR"):
+                expression = _match_expression(query, operator)
+                if expression is None:
+                    return []
+                rows = conn.execute(
+                    f"""
+                    SELECT d.message_id, d.thread_id, d.sender, d.subject, d.date,
+                           snippet(mail_fts, 2, '**', '**', '...', 16),
+                           bm25(mail_fts, {", ".join(str(w) for w in _WEIGHTS)}) AS score
+                    FROM mail_fts JOIN mail_docs d ON d.id = mail_fts.rowid
+                    WHERE mail_fts MATCH ? AND d.user = ?
+                    ORDER BY score LIMIT ?
+                    """,
+                    (expression, user, limit)
+                ).fetchall()
+                if rows:
+                    break
+        return [
+            {
+                "id": row[0],
+                "thread_id": row[1],
+                "sender": row[2],
+                "subject": row[3],
+                "date": row[4],
+                "snippet": row[5],
+                # bm25() is lower-is-better; report higher-is-better
+                "score": round(-row[6], 3),
+            }
+            for row in rows
+        ]
+
+    async def _run(self, func, *args):
+        if not MAIL_INDEX:
+            return None
+        try:
+            return await asyncio.to_thread(func, *args)
+        except Exception as e:
+            # The index is an optimisation; never fail the request that feeds it
+            logger.warning("Mail index update failed: %s", e)
+            return None
+
+    async def add(self, user, messages):
+        """Index (or re-index) parsed messages, see mail.parse_message."""
+        await self._run(self._add, user, messages)
+
+    async def sync_thread(self, user, thread):
+        """Index a parsed thread and drop its messages that no longer exist."""
+        await self._run(self._sync_thread, user, thread)
+
+    async def remove(self, user, message_ids):
+        await self._run(self._remove, user, message_ids)
+
+    async def clear(self, user):
+        """Drop everything indexed for `user`; returns the number of messages removed."""
+        return await asyncio.to_thread(self._clear, user)
+
+    async def search(self, user, query, limit=10):
+        """Best-matching indexed messages for a free-text query."""
+        return await asyncio.to_thread(self._search, user, query, limit)
+
+
+mail_index = MailIndex()
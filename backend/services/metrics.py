@@ -0,0 +1,329 @@
+"""In-process metrics exposed in Prometheus text format at /metrics.
+
+Recording is lock-free on the hot path: every thread writes to its own shard
+and shards are only merged when /metrics is scraped. Shards of threads that
+have exited are folded into a retired total at scrape time and dropped.
+"""
+import bisect
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Base class holding one shard of label values -> state per thread."""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        # (owning thread, shard) pairs
+        self._shards = []
+        # Merged state of shards whose threads have exited
+        self._retired = {}
+        self._shards_lock = threading.Lock()
+        _registry.append(self)
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = {}
+            with self._shards_lock:
+                self._shards.append((threading.current_thread(), shard))
+            self._local.shard = shard
+        return shard
+
+    def _merge(self, totals, snapshot):
+        """Add the label values -> state of `snapshot` into `totals`."""
+        raise NotImplementedError
+
+    def _snapshots(self):
+        with self._shards_lock:
+            live = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    live.append((thread, shard))
+                else:
+                    # Nothing writes to a dead thread's shard any more
+                    self._merge(self._retired, shard)
+            self._shards = live
+            retired = self._merge({}, self._retired)
+        # dict.copy() is atomic under the GIL, so owners can keep writing
+        return [retired] + [shard.copy() for _, shard in live]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._render_samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def _merge(self, totals, snapshot):
+        for labels, value in snapshot.items():
+            totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def _render_samples(self):
+        totals = {}
+        for snapshot in self._snapshots():
+            self._merge(totals, snapshot)
+        for labels, value in sorted(totals.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_number(value)}"
+
+
+class Gauge(Counter):
+    """Up/down counter; shards are summed like a counter."""
+
+    kind = "gauge"
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        shard = self._shard()
+        state = shard.get(labels)
+        if state is None:
+            # Per-bucket counts (non-cumulative), then sum and count
+            state = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    def _merge(self, totals, snapshot):
+        for labels, state in snapshot.items():
+            merged = totals.setdefault(labels, [0] * len(state))
+            for index, value in enumerate(list(state)):
+                merged[index] += value
+        return totals
+
+    def _render_samples(self):
+        totals = {}
+        for snapshot in self._snapshots():
+            self._merge(totals, snapshot)
+        for labels, state in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state):
+                cumulative += count
+                label_text = _format_labels(self.labelnames, labels, extra=(("le", _format_number(bound)),))
+                yield f"{self.name}_bucket{label_text} {cumulative}"
+            label_text = _format_labels(self.labelnames, labels)
+            yield f"{self.name}_sum{label_text} {_format_number(state[-2])}"
+            yield f"{self.name}_count{label_text} {state[-1]}"
+
+
+def render():
+    """Render every registered metric in Prometheus text exposition format."""
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route",
+    ("method", "route", "status")
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "HTTP requests currently being served, by route group",
+    ("group",)
+)
+UPSTREAM_DURATION = Histogram(
+    "upstream_request_duration_seconds",
+    "Latency of calls to Gemini and Google APIs",
+    ("upstream", "operation")
+)
+UPSTREAM_ERRORS = Counter(
+    "upstream_errors_total",
+    "Failed calls to Gemini and Google APIs",
+    ("upstream", "operation", "kind")
+)
+GEMINI_PROMPT_TOKENS = Counter(
+    "gemini_prompt_tokens_total",
+    "Prompt tokens sent to Gemini",
+    ("model",)
+)
+GEMINI_COMPLETION_TOKENS = Counter(
+    "gemini_completion_tokens_total",
+    "Completion tokens generated by Gemini",
+    ("model",)
+)
+GEMINI_QUOTA_REJECTIONS = Counter(
+    "gemini_quota_rejections_total",
+    "Gemini calls rejected for quota or rate limits",
+    ("model",)
+)
+GEMINI_CIRCUIT_OPENINGS = Counter(
+    "gemini_circuit_openings_total",
+    "Times the Gemini circuit breaker opened after repeated quota or availability errors"
+)
+LOCAL_SUMMARIES = Counter(
+    "local_summaries_total",
+    "Summaries written by the local extractive summarizer instead of Gemini, by reason",
+    ("reason",)
+)
+GEMINI_MODEL_SELECTIONS = Counter(
+    "gemini_model_selections_total",
+    "Model tier chosen by the tiering policy, by task",
+    ("task", "tier")
+)
+PROMPT_TOKENS = Histogram(
+    "gemini_prompt_estimated_tokens",
+    "Estimated size of each prompt before it is sent, by task",
+    ("task",),
+    buckets=TOKEN_BUCKETS
+)
+PROMPT_TRUNCATIONS = Counter(
+    "gemini_prompt_truncations_total",
+    "Prompt sections cut down to fit their token budget",
+    ("task", "section")
+)
+
+CACHE_REQUESTS = Counter(
+    "cache_requests_total",
+    "Lookups in application caches, by cache and hit or miss",
+    ("cache", "result")
+)
+PREDRAFTS = Counter(
+    "email_predrafts_total",
+    "Speculative reply drafts, by outcome",
+    ("outcome",)
+)
+OUTBOX_DELIVERIES = Counter(
+    "email_outbox_deliveries_total",
+    "Outbound mail queue events: queued, sent, retried and failed",
+    ("outcome",)
+)
+OUTBOX_QUEUE_WAIT = Histogram(
+    "email_outbox_queue_wait_seconds",
+    "Time from accepting a send to its first delivery attempt"
+)
+CHAT_TOOL_CALLS = Counter(
+    "chat_tool_calls_total",
+    "Tools called by Gemini during chat, by tool and outcome",
+    ("tool", "outcome")
+)
+CHAT_TOOL_DURATION = Histogram(
+    "chat_tool_duration_seconds",
+    "Run time of tools called during chat",
+    ("tool",)
+)
+ADMISSION_REJECTIONS = Counter(
+    "admission_rejections_total",
+    "Requests turned away by admission control, by route group and reason",
+    ("group", "reason")
+)
+ADMISSION_QUEUE_WAIT = Histogram(
+    "admission_queue_wait_seconds",
+    "Time admitted requests waited for a global slot",
+    ("group",)
+)
+
+JOB_DURATION = Histogram(
+    "job_duration_seconds",
+    "Run time of background jobs",
+    ("kind", "status")
+)
+JOB_QUEUE_WAIT = Histogram(
+    "job_queue_wait_seconds",
+    "Time background jobs spent queued before a worker picked them up",
+    ("kind",)
+)
+
+
+class UpstreamTimer:
+    """Context manager timing one upstream call and counting its errors."""
+
+    def __init__(self, upstream, operation):
+        self.upstream = upstream
+        self.operation = operation
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        UPSTREAM_DURATION.observe(time.perf_counter() - self.started, self.upstream, self.operation)
+        if exc_type is not None:
+            UPSTREAM_ERRORS.inc(self.upstream, self.operation, exc_type.__name__)
+        return False
+
+
+class MetricsMiddleware:
+    """Record per-route latency and in-flight requests."""
+
+    def __init__(self, app):
+        self.app = app
+        self._groups = None
+
+    def _group(self, scope):
+        """First path segment, limited to mounted prefixes to bound label cardinality."""
+        if self._groups is None:
+            self._groups = {
+                "/" + route.path.strip("/").split("/", 1)[0]
+                for route in getattr(scope.get("app"), "routes", [])
+            }
+        group = "/" + scope["path"].strip("/").split("/", 1)[0]
+        return group if group in self._groups else "other"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        group = self._group(scope)
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc(group)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUESTS_IN_FLIGHT.dec(group)
+            route = scope.get("route")
+            REQUEST_DURATION.observe(
+                time.perf_counter() - started,
+                scope["method"],
+                route.path if route is not None else "unmatched",
+                status_code
+            )
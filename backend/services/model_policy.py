@@ -0,0 +1,131 @@
+"""Choose the Gemini model tier and output budget for each task.
+
+Short, high-volume work (email summaries, date parsing) goes to a lite
+model with a small output budget; large code reviews get a stronger model
+and more room. Each task has a list of rules tried in order; the first
+whose `max_input_tokens` fits the prompt wins.
+
+Tiers map to model names through GEMINI_MODEL_LITE / _STANDARD / _STRONG.
+Rules can be replaced per task with MODEL_POLICY, either inline JSON or a
+path to a JSON file, e.g.
+
+    MODEL_POLICY='{"code.review": [{"tier": "strong", "max_output_tokens": 4096}]}'
+"""
+import json
+import os
+import threading
+
+from services.gemini import LazyModel
+from services.log import get_logger
+from services.metrics import GEMINI_MODEL_SELECTIONS
+from services.prompt_budget import record_prompt
+
+logger = get_logger(__name__)
+
+TIERS = {
+    "lite": os.getenv("GEMINI_MODEL_LITE", "gemini-2.0-flash-lite"),
+    "standard": os.getenv("GEMINI_MODEL_STANDARD", "gemini-2.0-flash"),
+    "strong": os.getenv("GEMINI_MODEL_STRONG", "gemini-2.5-flash"),
+}
+
+# Rules without max_input_tokens match any size
+DEFAULT_POLICY = {
+    "email.summary": [
+        {"max_input_tokens": 1500, "tier": "lite", "max_output_tokens": 256},
+        {"tier": "standard", "max_output_tokens": 512},
+    ],
+    "email.draft-reply": [{"tier": "standard", "max_output_tokens": 1024}],
+    "calendar.parse-event": [{"tier": "lite", "max_output_tokens": 256}],
+    "chat": [{"tier": "standard", "max_output_tokens": 2048}],
+    "docs.project-plan": [{"tier": "standard", "max_output_tokens": 4096}],
+    "docs.report-template": [{"tier": "standard", "max_output_tokens": 2048}],
+    "docs.presentation-outline": [{"tier": "standard", "max_output_tokens": 2048}],
+    "code.review": [
+        {"max_input_tokens": 3000, "tier": "standard", "max_output_tokens": 2048},
+        {"tier": "strong", "max_output_tokens": 4096},
+    ],
+    "code.suggest-refactoring": [
+        {"max_input_tokens": 3000, "tier": "standard", "max_output_tokens": 2048},
+        {"tier": "strong", "max_output_tokens": 4096},
+    ],
+    "code.explain": [
+        {"max_input_tokens": 3000, "tier": "standard", "max_output_tokens": 1536},
+        {"tier": "standard", "max_output_tokens": 3072},
+    ],
+}
+DEFAULT_RULE = {"tier": "standard", "max_output_tokens": 2048}
+
+
+def _load_policy():
+    policy = dict(DEFAULT_POLICY)
+    override = os.getenv("MODEL_POLICY")
+    if not override:
+        return policy
+    try:
+        if override.lstrip().startswith("{"):
+            policy.update(json.loads(override))
+        else:
+            with open(override) as f:
+                policy.update(json.load(f))
+    except (OSError, ValueError) as e:
+        logger.warning("Ignoring invalid MODEL_POLICY: %s", e)
+    return policy
+
+
+POLICY = _load_policy()
+
+
+class Selection:
+    """The tier picked for one call."""
+
+    def __init__(self, task, tier, model, max_output_tokens):
+        self.task = task
+        self.tier = tier
+        self.model = model
+        self.max_output_tokens = max_output_tokens
+
+    def info(self):
+        """Reported to clients alongside the generated content."""
+        return {"tier": self.tier, "name": self.model.model_name, "max_output_tokens": self.max_output_tokens}
+
+
+class ModelRouter:
+    """Per-router model factory that applies the tiering policy.
+
+    Routers keep their own sampling settings (temperature etc.); the policy
+    decides the model and max_output_tokens.
+    """
+
+    def __init__(self, generation_config=None):
+        self.generation_config = generation_config or {}
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def model(self, tier, max_output_tokens):
+        key = (tier, max_output_tokens)
+        if key not in self._models:
+            with self._lock:
+                if key not in self._models:
+                    self._models[key] = LazyModel(
+                        model_name=TIERS.get(tier, TIERS["standard"]),
+                        generation_config={**self.generation_config, "max_output_tokens": max_output_tokens}
+                    )
+        return self._models[key]
+
+    def select(self, task, prompt):
+        """Pick the model for `task` given the prompt that will be sent."""
+        input_tokens = record_prompt(task, prompt)
+        rule = DEFAULT_RULE
+        for candidate in POLICY.get(task, [DEFAULT_RULE]):
+            limit = candidate.get("max_input_tokens")
+            if limit is None or input_tokens <= limit:
+                rule = candidate
+                break
+        tier = rule.get("tier", "standard")
+        max_output_tokens = rule.get("max_output_tokens", DEFAULT_RULE["max_output_tokens"])
+        GEMINI_MODEL_SELECTIONS.inc(task, tier)
+        return Selection(task, tier, self.model(tier, max_output_tokens), max_output_tokens)
+
+    def default_model(self):
+        """Standard-tier model, e.g. for warm-up."""
+        return self.model("standard", DEFAULT_RULE["max_output_tokens"])
@@ -0,0 +1,344 @@
+"""Outbound mail queue for /email/send.
+
+A send is accepted with one local write and delivered in the background,
+the same way background jobs are: the SQLite `outbox` table is the queue
+and every worker process claims due messages from it under a lease.
+
+Deliveries are rate limited per user with a token bucket kept in the same
+database, so bursts from one user are spread out instead of tripping Gmail's
+limits, whichever worker sends them. Failed deliveries are retried with
+exponential backoff. Every message carries its own Message-ID. Before a
+retry, Gmail is searched for that id, so a send whose response was lost is
+not sent twice. Clients can pass an idempotency key so a resubmitted send
+returns the original entry instead of queueing a second copy.
+
+Message contents and credentials are stored encrypted.
+"""
+import asyncio
+import json
+import os
+import random
+import secrets
+import sqlite3
+import time
+
+from services.google_http import build_service, execute, http_status
+from services.log import get_logger
+from services.metrics import OUTBOX_DELIVERIES, OUTBOX_QUEUE_WAIT
+from services.sessions import session_store
+from services.shared_state import STATE_DB_PATH, build_cipher, connect, register_migration
+
+logger = get_logger(__name__)
+
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "2"))
+# Per-user token bucket: sustained sends per minute and burst size
+OUTBOX_RATE_PER_MINUTE = float(os.getenv("OUTBOX_RATE_PER_MINUTE", "20"))
+OUTBOX_BURST = int(os.getenv("OUTBOX_BURST", "5"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+OUTBOX_RETRY_BASE_SECONDS = float(os.getenv("OUTBOX_RETRY_BASE_SECONDS", "5"))
+# Delivered and failed entries are kept this long for status lookups
+OUTBOX_RESULT_TTL_SECONDS = int(os.getenv("OUTBOX_RESULT_TTL_SECONDS", str(7 * 24 * 3600)))
+OUTBOX_POLL_INTERVAL_SECONDS = float(os.getenv("OUTBOX_POLL_INTERVAL_SECONDS", "1"))
+OUTBOX_LEASE_SECONDS = 60
+SWEEP_INTERVAL_SECONDS = 300
+# Claim looks at this many due messages to find one whose user has a send token
+CLAIM_BATCH = 20
+
+# Gmail statuses worth retrying; anything else in 4xx is permanent
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+def is_retryable(error):
+    """Transient errors: rate limits, server errors and network failures."""
+    status = http_status(error)
+    if status is None:
+        # The shared transport raises socket errors for timeouts and dropped connections
+        return isinstance(error, OSError)
+    return status in RETRYABLE_STATUSES
+
+
+def _create_outbox(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id TEXT PRIMARY KEY,
+            user TEXT NOT NULL,
+            idempotency_key TEXT,
+            status TEXT NOT NULL,
+            payload BLOB NOT NULL,
+            message_id_header TEXT NOT NULL,
+            gmail_message_id TEXT,
+            error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            lease_until REAL NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            sent_at REAL
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)")
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS outbox_idempotency ON outbox (user, idempotency_key)"
+        " WHERE idempotency_key IS NOT NULL"
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS outbox_buckets (
+            user TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        """
+    )
+
+
+class Outbox:
+    """Persistent, rate-limited queue of messages waiting to be sent."""
+
+    def __init__(self, path=STATE_DB_PATH):
+        self.path = path
+        self._cipher = build_cipher()
+        register_migration(path, "outbox.0001_create", _create_outbox)
+        self._wakeup = None
+        self._last_sweep = 0.0
+
+    def _connect(self):
+        return connect(self.path)
+
+    def _encrypt(self, payload):
+        return self._cipher.encrypt(json.dumps(payload).encode("utf-8"))
+
+    def _decrypt(self, blob):
+        return json.loads(self._cipher.decrypt(blob).decode("utf-8"))
+
+    def _insert(self, user, raw_message, message_id_header, credentials, idempotency_key):
+        entry_id = secrets.token_urlsafe(16)
+        now = time.time()
+        payload = {"raw": raw_message, **credentials}
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    """
+                    INSERT INTO outbox (id, user, idempotency_key, status, payload, message_id_header, next_attempt_at, created_at)
+                    VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)
+                    """,
+                    (entry_id, user, idempotency_key, self._encrypt(payload), message_id_header, now, now)
+                )
+        except sqlite3.IntegrityError:
+            # Same idempotency key as an earlier send: report that one instead
+            return self._find(user, idempotency_key), False
+        return entry_id, True
+
+    def _find(self, user, idempotency_key):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id FROM outbox WHERE user = ? AND idempotency_key = ?",
+                (user, idempotency_key)
+            ).fetchone()
+        return row[0] if row else None
+
+    async def find(self, user, idempotency_key):
+        """Id of `user`'s send with this idempotency key, or None."""
+        return await asyncio.to_thread(self._find, user, idempotency_key)
+
+    async def submit(self, user, raw_message, message_id_header, credentials, idempotency_key=None):
+        """Queue a base64url-encoded message; returns (id, created).
+
+        `credentials` holds the sender's "session_id" and/or "access_token";
+        a session lets delivery use a fresh token if the send is delayed.
+        """
+        entry_id, created = await asyncio.to_thread(
+            self._insert, user, raw_message, message_id_header, credentials, idempotency_key
+        )
+        if created:
+            OUTBOX_DELIVERIES.inc("queued")
+            if self._wakeup is not None:
+                self._wakeup.set()
+        return entry_id, created
+
+    def _get(self, user, entry_id):
+        with self._connect() as conn:
+            row = conn.execute(
+                """
+                SELECT id, status, message_id_header, gmail_message_id, error, attempts, created_at, sent_at
+                FROM outbox WHERE id = ? AND user = ?
+                """,
+                (entry_id, user)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row[0],
+            "status": row[1],
+            "message_id_header": row[2],
+            "gmail_message_id": row[3],
+            "error": row[4],
+            "attempts": row[5],
+            "created_at": row[6],
+            "sent_at": row[7],
+        }
+
+    async def get(self, user, entry_id):
+        """Delivery status of one of `user`'s sends, or None."""
+        return await asyncio.to_thread(self._get, user, entry_id)
+
+    def _take_token(self, conn, user, now):
+        """Spend one send token for `user`; returns 0, or seconds until one is available."""
+        row = conn.execute("SELECT tokens, updated_at FROM outbox_buckets WHERE user = ?", (user,)).fetchone()
+        rate = OUTBOX_RATE_PER_MINUTE / 60
+        tokens = OUTBOX_BURST if row is None else min(OUTBOX_BURST, row[0] + (now - row[1]) * rate)
+        if tokens < 1:
+            return (1 - tokens) / rate
+        conn.execute(
+            "INSERT OR REPLACE INTO outbox_buckets (user, tokens, updated_at) VALUES (?, ?, ?)",
+            (user, tokens - 1, now)
+        )
+        return 0
+
+    def _claim(self):
+        """Atomically take the next due message whose user may send.
+
+        Returns (id, user, attempts, payload, message_id_header, created_at) or None.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                """
+                SELECT id, user, attempts, payload, message_id_header, created_at FROM outbox
+                WHERE (status = 'queued' AND next_attempt_at <= ?) OR (status = 'sending' AND lease_until < ?)
+                ORDER BY next_attempt_at LIMIT ?
+                """,
+                (now, now, CLAIM_BATCH)
+            ).fetchall()
+            for entry_id, user, attempts, payload, message_id_header, created_at in rows:
+                if attempts >= OUTBOX_MAX_ATTEMPTS:
+                    # Its worker died mid-send every time
+                    conn.execute(
+                        "UPDATE outbox SET status = 'failed', error = ?, payload = ? WHERE id = ?",
+                        ("Delivery was interrupted too many times", b"", entry_id)
+                    )
+                    continue
+                wait = self._take_token(conn, user, now)
+                if wait:
+                    # Over the user's rate; look again when a token is due
+                    conn.execute(
+                        "UPDATE outbox SET status = 'queued', next_attempt_at = ? WHERE id = ?",
+                        (now + wait, entry_id)
+                    )
+                    continue
+                conn.execute(
+                    "UPDATE outbox SET status = 'sending', attempts = attempts + 1, lease_until = ? WHERE id = ?",
+                    (now + OUTBOX_LEASE_SECONDS, entry_id)
+                )
+                conn.commit()
+                return entry_id, user, attempts + 1, self._decrypt(payload), message_id_header, created_at
+            conn.commit()
+            return None
+        except Exception:
+            conn.rollback()
+            raise
+
+    def _finish(self, entry_id, status, gmail_message_id=None, error=None):
+        with self._connect() as conn:
+            conn.execute(
+                """
+                UPDATE outbox SET status = ?, gmail_message_id = ?, error = ?, sent_at = ?, payload = ?
+                WHERE id = ?
+                """,
+                # The message and credentials are no longer needed once it is settled
+                (status, gmail_message_id, error, time.time() if status == "sent" else None, b"", entry_id)
+            )
+
+    def _retry_later(self, entry_id, attempts, error):
+        delay = OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1) * random.uniform(0.8, 1.2)
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE outbox SET status = 'queued', error = ?, next_attempt_at = ?, lease_until = 0 WHERE id = ?",
+                (error, time.time() + delay, entry_id)
+            )
+
+    def _sweep(self):
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM outbox WHERE status IN ('sent', 'failed') AND created_at < ?",
+                (time.time() - OUTBOX_RESULT_TTL_SECONDS,)
+            )
+
+    async def _credentials(self, payload):
+        from google.oauth2.credentials import Credentials
+
+        access_token = payload.get("access_token")
+        if payload.get("session_id"):
+            session = await session_store.resolve(payload["session_id"])
+            if session is not None:
+                access_token = session["access_token"]
+        return Credentials(token=access_token)
+
+    async def _already_sent(self, service, message_id_header):
+        """Gmail id of a message already sent with this Message-ID, if any."""
+        found = await execute(service.users().messages().list(
+            userId="me",
+            q=f"rfc822msgid:{message_id_header.strip('<>')}",
+            maxResults=1
+        ))
+        messages = found.get("messages", [])
+        return messages[0]["id"] if messages else None
+
+    async def _deliver(self, entry_id, user, attempts, payload, message_id_header, created_at):
+        if attempts == 1:
+            OUTBOX_QUEUE_WAIT.observe(time.time() - created_at)
+        try:
+            service = build_service("gmail", "v1", await self._credentials(payload))
+            # An earlier attempt may have been sent even though we never saw the response
+            gmail_message_id = await self._already_sent(service, message_id_header) if attempts > 1 else None
+            if gmail_message_id is None:
+                sent = await execute(service.users().messages().send(userId="me", body={"raw": payload["raw"]}))
+                gmail_message_id = sent["id"]
+        except asyncio.CancelledError:
+            # Shutting down; the lease expires and another worker retries
+            raise
+        except Exception as e:
+            if is_retryable(e) and attempts < OUTBOX_MAX_ATTEMPTS:
+                logger.info("Send %s failed, will retry: %s", entry_id, e)
+                OUTBOX_DELIVERIES.inc("retried")
+                await asyncio.to_thread(self._retry_later, entry_id, attempts, str(e))
+            else:
+                logger.warning("Send %s failed: %s", entry_id, e)
+                OUTBOX_DELIVERIES.inc("failed")
+                await asyncio.to_thread(self._finish, entry_id, "failed", None, str(e))
+            return
+        OUTBOX_DELIVERIES.inc("sent")
+        logger.info("Email sent", extra={"outbox_id": entry_id, "gmail_message_id": gmail_message_id})
+        await asyncio.to_thread(self._finish, entry_id, "sent", gmail_message_id)
+
+    async def _worker(self):
+        while True:
+            try:
+                if time.time() - self._last_sweep > SWEEP_INTERVAL_SECONDS:
+                    self._last_sweep = time.time()
+                    await asyncio.to_thread(self._sweep)
+                self._wakeup.clear()
+                entry = await asyncio.to_thread(self._claim)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Error claiming outbox entry")
+                entry = None
+            if entry is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), OUTBOX_POLL_INTERVAL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._deliver(*entry)
+
+    async def run(self):
+        """Run the delivery workers until cancelled."""
+        self._wakeup = asyncio.Event()
+        await asyncio.gather(*(self._worker() for _ in range(OUTBOX_WORKERS)))
+
+
+outbox = Outbox()
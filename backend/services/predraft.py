@@ -0,0 +1,127 @@
+"""Speculative reply drafts for unread mail.
+
+After /email/unread, the messages most likely to need an answer are queued
+for drafting in the background, so a later draft-reply is answered from the
+draft cache instead of waiting on Gmail and Gemini. Pre-drafting only uses
+spare capacity: one draft at a time per process, started only when no
+interactive Gemini call has run for PREDRAFT_IDLE_SECONDS and none was
+rejected for quota in the last PREDRAFT_QUOTA_BACKOFF_SECONDS. A
+draft-reply for a message that is still queued takes it over, and one that
+is already being drafted waits for that draft instead of starting another.
+
+Drafts are cached, encrypted and bounded, under the thread's historyId and
+the tone, so a thread that changed is drafted again. Off unless PREDRAFT=true.
+"""
+import asyncio
+import os
+import time
+
+from services import gemini
+from services.log import get_logger
+from services.metrics import CACHE_REQUESTS, PREDRAFTS
+from services.shared_state import SharedCache
+
+logger = get_logger(__name__)
+
+PREDRAFT = os.getenv("PREDRAFT", "false").lower() == "true"
+# Unread messages drafted per /email/unread call
+PREDRAFT_TOP_N = int(os.getenv("PREDRAFT_TOP_N", "3"))
+PREDRAFT_IDLE_SECONDS = float(os.getenv("PREDRAFT_IDLE_SECONDS", "2"))
+PREDRAFT_QUOTA_BACKOFF_SECONDS = float(os.getenv("PREDRAFT_QUOTA_BACKOFF_SECONDS", "60"))
+PREDRAFT_QUEUE_SIZE = int(os.getenv("PREDRAFT_QUEUE_SIZE", "50"))
+# Queued drafts older than this are dropped; the user has likely moved on
+PREDRAFT_MAX_AGE_SECONDS = float(os.getenv("PREDRAFT_MAX_AGE_SECONDS", "300"))
+DRAFT_CACHE_TTL_SECONDS = int(os.getenv("DRAFT_CACHE_TTL_SECONDS", "900"))
+DRAFT_CACHE_SIZE = int(os.getenv("DRAFT_CACHE_SIZE", "500"))
+HEADROOM_POLL_SECONDS = 0.5
+
+draft_cache = SharedCache("email_drafts", ttl_seconds=DRAFT_CACHE_TTL_SECONDS, encrypt=True, max_entries=DRAFT_CACHE_SIZE)
+
+
+def _cache_key(user, message_id, history_id, tone):
+    return f"{user}:{message_id}:{history_id}:{tone.lower()}"
+
+
+async def cached_draft(user, message_id, history_id, tone):
+    """Draft for the message as of the thread's current historyId, or None."""
+    draft = await draft_cache.get_async(_cache_key(user, message_id, history_id, tone))
+    CACHE_REQUESTS.inc("email_drafts", "miss" if draft is None else "hit")
+    return draft
+
+
+async def store_draft(user, message_id, history_id, tone, draft):
+    await draft_cache.set_async(_cache_key(user, message_id, history_id, tone), draft)
+
+
+class Predrafter:
+    """Per-process queue of speculative drafts that runs on idle Gemini capacity."""
+
+    def __init__(self):
+        self._queue = None
+        # (user, message id, tone) -> (draft coroutine function, queued at)
+        self._pending = {}
+        # (user, message id, tone) -> task drafting it now
+        self._running = {}
+
+    def schedule(self, user, message_id, tone, draft):
+        """Queue `await draft()` to run when Gemini is idle; False if not queued."""
+        key = (user, message_id, tone)
+        if not PREDRAFT or self._queue is None or key in self._pending or key in self._running:
+            return False
+        if self._queue.full():
+            PREDRAFTS.inc("dropped")
+            return False
+        self._pending[key] = (draft, time.monotonic())
+        self._queue.put_nowait(key)
+        PREDRAFTS.inc("queued")
+        return True
+
+    def claim(self, user, message_id, tone):
+        """Take a message over for an interactive request.
+
+        A queued draft is cancelled; a running one is returned as its task so
+        the caller can wait for it rather than draft the message twice.
+        """
+        key = (user, message_id, tone)
+        if self._pending.pop(key, None) is not None:
+            PREDRAFTS.inc("claimed")
+        return self._running.get(key)
+
+    async def _wait_for_headroom(self):
+        while not gemini.has_headroom(PREDRAFT_IDLE_SECONDS, PREDRAFT_QUOTA_BACKOFF_SECONDS):
+            await asyncio.sleep(HEADROOM_POLL_SECONDS)
+
+    async def _draft(self, draft):
+        with gemini.background():
+            return await draft()
+
+    async def run(self):
+        """Draft queued messages one at a time until cancelled."""
+        self._queue = asyncio.Queue(PREDRAFT_QUEUE_SIZE)
+        while True:
+            key = await self._queue.get()
+            await self._wait_for_headroom()
+            # Gone if an interactive request claimed it while it waited
+            entry = self._pending.pop(key, None)
+            if entry is None:
+                continue
+            draft, queued_at = entry
+            if time.monotonic() - queued_at > PREDRAFT_MAX_AGE_SECONDS:
+                PREDRAFTS.inc("expired")
+                continue
+            task = asyncio.create_task(self._draft(draft))
+            self._running[key] = task
+            try:
+                await asyncio.shield(task)
+                PREDRAFTS.inc("drafted")
+            except asyncio.CancelledError:
+                task.cancel()
+                raise
+            except Exception as e:
+                PREDRAFTS.inc("failed")
+                logger.warning("Pre-drafting a reply failed: %s", e)
+            finally:
+                del self._running[key]
+
+
+predrafter = Predrafter()
@@ -0,0 +1,175 @@
+"""Token budgets for the variable parts of prompts.
+
+User-supplied sections (email bodies and threads, code, chat messages) are fitted to a
+per-task token budget before they go into a prompt, so oversized inputs
+neither hit the model's context limit nor pay for tokens that add little.
+Text over budget keeps whole lines from its start and end and drops the
+middle, which is where long emails and files carry the least signal.
+
+Token counts come from a local estimator shaped like Gemini's tokenizer
+(words, single digits, punctuation). Its scale is corrected from the
+prompt token counts Gemini reports back, and from a count_tokens call
+during warm-up when WARMUP_GEMINI is on. Budgets can be replaced per task
+with PROMPT_BUDGETS, either inline JSON or a path to a JSON file, e.g.
+
+    PROMPT_BUDGETS='{"code.review": {"code": 20000}}'
+"""
+import json
+import math
+import os
+import re
+
+from services.log import get_logger
+from services.metrics import PROMPT_TOKENS, PROMPT_TRUNCATIONS
+
+logger = get_logger(__name__)
+
+# Tokens allowed for each section, by task
+DEFAULT_BUDGETS = {
+    "email.summary": {"body": 800},
+    "email.draft-reply": {"body": 1500, "thread": 3000},
+    "chat": {"message": 6000, "tool_result": 4000},
+    "code.review": {"code": 12000},
+    "code.suggest-refactoring": {"code": 12000},
+    "code.explain": {"code": 12000},
+}
+
+# Share of a section's budget kept from its start; the rest comes from its end
+HEAD_SHARE = 0.6
+OMITTED_MARKER = "[... {} lines omitted ...]"
+MARKER_TOKENS = 8
+
+# Gemini splits numbers into single digits; words of up to ~8 letters are usually one token
+_TOKEN_PATTERN = re.compile(r"[^\W\d_]+|\d|[^\w\s]|_")
+_WORD_CHARS_PER_TOKEN = 8
+# Prompts smaller than this say little about the estimator's accuracy
+_CALIBRATION_MIN_TOKENS = 50
+_CALIBRATION_WEIGHT = 0.1
+_scale = 1.0
+
+CALIBRATION_SAMPLE = """Hi team,
+
+Following up on Tuesday's review: the release moves to 14 March 2025 and
+QA sign-off is due by the 10th. Please update tickets #4821 and #4830.
+
+def merge_ranges(ranges):
+    result = []
+    for start, end in sorted(ranges):
+        if result and start <= result[-1][1]:
+            result[-1] = (result[-1][0], max(result[-1][1], end))
+        else:
+            result.append((start, end))
+    return result
+"""
+
+
+def _load_budgets():
+    budgets = {task: dict(sections) for task, sections in DEFAULT_BUDGETS.items()}
+    override = os.getenv("PROMPT_BUDGETS")
+    if not override:
+        return budgets
+    try:
+        if override.lstrip().startswith("{"):
+            loaded = json.loads(override)
+        else:
+            with open(override) as f:
+                loaded = json.load(f)
+        for task, sections in loaded.items():
+            budgets.setdefault(task, {}).update(sections)
+    except (OSError, ValueError, AttributeError) as e:
+        logger.warning("Ignoring invalid PROMPT_BUDGETS: %s", e)
+    return budgets
+
+
+BUDGETS = _load_budgets()
+
+
+def _raw_estimate(text):
+    tokens = 0
+    for piece in _TOKEN_PATTERN.findall(text):
+        if len(piece) <= _WORD_CHARS_PER_TOKEN:
+            tokens += 1
+        elif piece.isascii():
+            tokens += math.ceil(len(piece) / _WORD_CHARS_PER_TOKEN)
+        else:
+            # Scripts without spaces (CJK etc.) run together into one "word"
+            tokens += math.ceil(len(piece) / 2)
+    return tokens
+
+
+def estimate_tokens(text):
+    """Estimated Gemini token count of `text`."""
+    return math.ceil(_raw_estimate(text) * _scale)
+
+
+def calibrate(text, actual_tokens):
+    """Nudge the estimator towards a token count Gemini reported for `text`."""
+    global _scale
+    estimated = _raw_estimate(text)
+    if estimated < _CALIBRATION_MIN_TOKENS or not actual_tokens:
+        return
+    ratio = min(max(actual_tokens / estimated, 0.5), 2.0)
+    _scale += (ratio - _scale) * _CALIBRATION_WEIGHT
+    logger.debug("Token estimate scale is now %.3f", _scale)
+
+
+def _take(lines, budget):
+    """Leading lines of `lines` that fit in `budget` tokens, and the tokens they use."""
+    kept = []
+    used = 0
+    for line in lines:
+        # +1 for the newline
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget:
+            break
+        kept.append(line)
+        used += cost
+    return kept, used
+
+
+def _truncate_chars(text, max_tokens):
+    # For text with very long lines: cut at spaces instead of line breaks
+    budget = max(max_tokens - MARKER_TOKENS, 1)
+    keep = int(len(text) * budget / max(estimate_tokens(text), 1))
+    head_chars = int(keep * HEAD_SHARE)
+    # Drop the word cut in half at each end; whitespace-only ends split into nothing
+    head_parts = text[:head_chars].rsplit(None, 1) if head_chars else []
+    head = head_parts[0] if head_parts else ""
+    tail_parts = text[len(text) - (keep - head_chars):].split(None, 1) if keep > head_chars else []
+    tail = tail_parts[-1] if tail_parts else ""
+    return f"{head} [...] {tail}".strip()
+
+
+def truncate(text, max_tokens):
+    """Cut `text` to about `max_tokens`, keeping whole lines from its start and end."""
+    # Every token covers at least one character, so short text needs no counting
+    if len(text) * _scale <= max_tokens or estimate_tokens(text) <= max_tokens:
+        return text
+    lines = text.splitlines()
+    budget = max(max_tokens - MARKER_TOKENS, 1)
+    head, used = _take(lines, int(budget * HEAD_SHARE))
+    # Whatever the head didn't use goes to the tail
+    tail, _ = _take(reversed(lines[len(head):]), budget - used)
+    tail.reverse()
+    if not head and not tail:
+        return _truncate_chars(text, max_tokens)
+    omitted = len(lines) - len(head) - len(tail)
+    return "\n".join(head + [OMITTED_MARKER.format(omitted)] + tail)
+
+
+def fit_section(task, section, text):
+    """Fit one section of a `task` prompt to its budget; unbudgeted sections pass through."""
+    budget = BUDGETS.get(task, {}).get(section)
+    if budget is None or not text:
+        return text
+    fitted = truncate(text, budget)
+    if fitted is not text:
+        PROMPT_TRUNCATIONS.inc(task, section)
+    return fitted
+
+
+def record_prompt(task, prompt):
+    """Record the estimated size of a prompt about to be sent and return it."""
+    tokens = estimate_tokens(prompt)
+    PROMPT_TOKENS.observe(tokens, task)
+    return tokens
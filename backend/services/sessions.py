@@ -0,0 +1,253 @@
+"""Server-side OAuth sessions with proactive access token refresh.
+
+The refresh token from /auth/callback never leaves the server. The client only
+holds an opaque session id, and access tokens are refreshed in the background
+shortly before they expire.
+"""
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import secrets
+import time
+
+from cryptography.fernet import InvalidToken
+
+from services.log import get_logger
+from services.metrics import UpstreamTimer
+from services.shared_state import DATA_DIR, build_cipher, connect, register_migration
+
+logger = get_logger(__name__)
+
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", os.path.join(DATA_DIR, "sessions.db"))
+TOKEN_URI = os.getenv("GOOGLE_TOKEN_URI", "https://oauth2.googleapis.com/token")
+
+# Sessions idle for longer than this are dropped
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(30 * 24 * 3600)))
+# Refresh access tokens this long before they expire
+REFRESH_MARGIN_SECONDS = int(os.getenv("SESSION_REFRESH_MARGIN_SECONDS", "300"))
+# How often the background refresher scans for expiring tokens
+REFRESH_INTERVAL_SECONDS = int(os.getenv("SESSION_REFRESH_INTERVAL_SECONDS", "60"))
+# How long one worker may hold a session's refresh lease
+REFRESH_LEASE_SECONDS = 30
+
+
+def _hash_session_id(session_id):
+    """Sessions are stored under a hash so a leaked database holds no bearer ids."""
+    return hashlib.sha256(session_id.encode("utf-8")).hexdigest()
+
+
+def _expiry_timestamp(expiry):
+    """google-auth reports expiry as a naive UTC datetime."""
+    if expiry is None:
+        # Google access tokens live for an hour
+        return time.time() + 3600
+    return expiry.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def _create_sessions(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_key TEXT PRIMARY KEY,
+            payload BLOB NOT NULL,
+            expires_at REAL NOT NULL,
+            last_used REAL NOT NULL,
+            refresh_lease_until REAL NOT NULL DEFAULT 0
+        )
+        """
+    )
+
+
+def _add_refresh_lease(conn):
+    # Databases created before refresh leases lack the column
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(sessions)")]
+    if "refresh_lease_until" not in columns:
+        conn.execute("ALTER TABLE sessions ADD COLUMN refresh_lease_until REAL NOT NULL DEFAULT 0")
+
+
+class SessionStore:
+    """SQLite-backed session store with encrypted payloads."""
+
+    def __init__(self, path=SESSION_DB_PATH):
+        self.path = path
+        self._cipher = build_cipher()
+        register_migration(path, "sessions.0001_create", _create_sessions)
+        register_migration(path, "sessions.0002_refresh_lease", _add_refresh_lease)
+        # session key -> future of the refresh currently running for it
+        self._inflight = {}
+
+    def _connect(self):
+        return connect(self.path)
+
+    def _encrypt(self, payload):
+        return self._cipher.encrypt(json.dumps(payload).encode("utf-8"))
+
+    def _decrypt(self, blob):
+        return json.loads(self._cipher.decrypt(blob).decode("utf-8"))
+
+    def create(self, credentials, user_info=None):
+        """Persist OAuth credentials and return a new opaque session id."""
+        session_id = secrets.token_urlsafe(32)
+        payload = {
+            "access_token": credentials.token,
+            "refresh_token": credentials.refresh_token,
+            "scopes": list(credentials.scopes or []),
+            "user_info": user_info,
+        }
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO sessions (session_key, payload, expires_at, last_used) VALUES (?, ?, ?, ?)",
+                (_hash_session_id(session_id), self._encrypt(payload), _expiry_timestamp(credentials.expiry), now)
+            )
+        return session_id
+
+    def _load(self, key):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT payload, expires_at, last_used FROM sessions WHERE session_key = ?",
+                (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        if time.time() - row[2] > SESSION_TTL_SECONDS:
+            self._delete_key(key)
+            return None
+        try:
+            session = self._decrypt(row[0])
+        except InvalidToken:
+            # Encrypted with a key we no longer have
+            self._delete_key(key)
+            return None
+        session["expires_at"] = row[1]
+        return session
+
+    def _delete_key(self, key):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sessions WHERE session_key = ?", (key,))
+
+    def delete(self, session_id):
+        """Remove a session, e.g. on logout."""
+        self._delete_key(_hash_session_id(session_id))
+
+    def _expiring_keys(self, within_seconds):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT session_key FROM sessions WHERE expires_at < ?",
+                (time.time() + within_seconds,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def _refresh_blocking(self, key):
+        """Exchange the refresh token for a new access token."""
+        from google.auth.exceptions import RefreshError
+        from google.oauth2.credentials import Credentials
+        from services.google_http import AuthRequest
+
+        session = self._load(key)
+        if session is None:
+            return None
+        if not session.get("refresh_token"):
+            return session
+
+        if not self._acquire_lease(key):
+            # Another worker is refreshing this session; use its result
+            return self._wait_for_refresh(key, session["expires_at"])
+
+        credentials = Credentials(
+            token=session["access_token"],
+            refresh_token=session["refresh_token"],
+            token_uri=TOKEN_URI,
+            client_id=os.getenv("GOOGLE_CLIENT_ID"),
+            client_secret=os.getenv("GOOGLE_CLIENT_SECRET"),
+            scopes=session.get("scopes") or None
+        )
+        try:
+            with UpstreamTimer("oauth2", "token.refresh"):
+                credentials.refresh(AuthRequest())
+        except RefreshError as e:
+            # The grant was revoked or expired, the user has to log in again
+            logger.info("Session refresh rejected, dropping session: %s", e)
+            self._delete_key(key)
+            return None
+
+        session["access_token"] = credentials.token
+        if credentials.refresh_token:
+            session["refresh_token"] = credentials.refresh_token
+        expires_at = _expiry_timestamp(credentials.expiry)
+        session.pop("expires_at", None)
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE sessions SET payload = ?, expires_at = ?, refresh_lease_until = 0 WHERE session_key = ?",
+                (self._encrypt(session), expires_at, key)
+            )
+        session["expires_at"] = expires_at
+        return session
+
+    def _acquire_lease(self, key):
+        """Claim the right to refresh a session, across all worker processes."""
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE sessions SET refresh_lease_until = ? WHERE session_key = ? AND refresh_lease_until < ?",
+                (now + REFRESH_LEASE_SECONDS, key, now)
+            )
+            return cursor.rowcount == 1
+
+    def _wait_for_refresh(self, key, stale_expiry):
+        """Poll until the lease holder stores a new token or gives up."""
+        deadline = time.time() + REFRESH_LEASE_SECONDS
+        while time.time() < deadline:
+            time.sleep(0.2)
+            session = self._load(key)
+            if session is None or session["expires_at"] != stale_expiry:
+                return session
+        return self._load(key)
+
+    async def _refresh(self, key):
+        """Refresh a session, sharing one in-flight refresh between all callers."""
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(asyncio.to_thread(self._refresh_blocking, key))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def resolve(self, session_id):
+        """Return the session with a valid access token, or None if unknown."""
+        key = _hash_session_id(session_id)
+        session = await asyncio.to_thread(self._load, key)
+        if session is None:
+            return None
+
+        if session["expires_at"] - time.time() < REFRESH_MARGIN_SECONDS:
+            session = await self._refresh(key)
+            if session is None:
+                return None
+
+        await asyncio.to_thread(self._touch, key)
+        return session
+
+    def _touch(self, key):
+        with self._connect() as conn:
+            conn.execute("UPDATE sessions SET last_used = ? WHERE session_key = ?", (time.time(), key))
+
+    async def run_refresher(self):
+        """Background loop that refreshes tokens before they expire."""
+        while True:
+            await asyncio.sleep(REFRESH_INTERVAL_SECONDS)
+            try:
+                keys = await asyncio.to_thread(
+                    self._expiring_keys, REFRESH_MARGIN_SECONDS + REFRESH_INTERVAL_SECONDS
+                )
+                for key in keys:
+                    await self._refresh(key)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Background session refresh error")
+
+
+session_store = SessionStore()
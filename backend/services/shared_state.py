@@ -0,0 +1,285 @@
+"""Small key/value state shared by every worker process on one host.
+
+Module-level dicts only work with a single process. State that has to be
+seen by all workers (e.g. which OAuth codes were already exchanged) lives
+in a SQLite database in WAL mode instead.
+
+Modules that keep their own tables (sessions, jobs, the outbox, the mail
+index) create and alter them through register_migration(). Each migration
+runs once per database, under an exclusive lock, so concurrent workers
+never race on schema changes. Connections are reused per thread, and
+expired cache entries are swept periodically by run_sweeper(). Namespaces
+can be capped by entry count and by size, and STATE_QUOTAS overrides the
+caps per namespace.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from services.log import get_logger
+
+logger = get_logger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(pathlib.Path(__file__).parent.parent, "data"))
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", os.path.join(DATA_DIR, "state.db"))
+STATE_SWEEP_SECONDS = float(os.getenv("STATE_SWEEP_SECONDS", "300"))
+
+_init_lock = threading.Lock()
+_initialized_paths = set()
+_cipher = None
+_local = threading.local()
+# path -> {migration name: func(conn)}, in registration order
+_migrations = {}
+# path -> names of migrations known to be applied, per process
+_applied = {}
+
+
+def _load_quotas():
+    """Per-namespace caps from STATE_QUOTAS (JSON or a path to a JSON file)."""
+    override = os.getenv("STATE_QUOTAS")
+    if not override:
+        return {}
+    try:
+        if override.lstrip().startswith("{"):
+            return json.loads(override)
+        with open(override) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning("Ignoring invalid STATE_QUOTAS: %s", e)
+        return {}
+
+
+QUOTAS = _load_quotas()
+
+
+def build_cipher():
+    """Cipher for state encrypted at rest, shared by every worker via SECRET_KEY."""
+    global _cipher
+    if _cipher is not None:
+        return _cipher
+
+    key = os.getenv("SESSION_ENCRYPTION_KEY")
+    secret = os.getenv("SECRET_KEY")
+    if key:
+        _cipher = Fernet(key.encode("utf-8"))
+    elif secret:
+        digest = hashlib.sha256(secret.encode("utf-8")).digest()
+        _cipher = Fernet(base64.urlsafe_b64encode(digest))
+    else:
+        # Encrypted state will not survive a restart or be readable by other workers
+        logger.warning("SECRET_KEY is not set, using an ephemeral encryption key")
+        _cipher = Fernet(Fernet.generate_key())
+    return _cipher
+
+
+def register_migration(path, name, migrate):
+    """Run `migrate(conn)` once on the database at `path`, before it is next used.
+
+    Names are recorded in the database, so a migration is applied once
+    however many workers start. Registering the same name again is a no-op.
+    """
+    _migrations.setdefault(path, {}).setdefault(name, migrate)
+
+
+def _apply_migrations(path):
+    pending = [name for name in _migrations.get(path, {}) if name not in _applied.setdefault(path, set())]
+    if not pending:
+        return
+    with _init_lock:
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS schema_migrations (name TEXT PRIMARY KEY, applied_at REAL NOT NULL)")
+            # One worker migrates at a time; the others wait, then find the work done
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                done = {row[0] for row in conn.execute("SELECT name FROM schema_migrations")}
+                for name, migrate in list(_migrations[path].items()):
+                    if name not in done:
+                        migrate(conn)
+                        conn.execute("INSERT INTO schema_migrations (name, applied_at) VALUES (?, ?)", (name, time.time()))
+                        logger.info("Applied state migration %s", name)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+        _applied[path].update(_migrations[path])
+
+
+def connect(path):
+    """Connection to a shared SQLite database, creating and migrating it if needed.
+
+    Connections are reused within a thread; use them as `with conn:` so
+    each block commits (or rolls back) before the next.
+    """
+    if path not in _initialized_paths:
+        with _init_lock:
+            if path not in _initialized_paths:
+                pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+                with sqlite3.connect(path) as conn:
+                    # WAL lets readers in other workers proceed during writes
+                    conn.execute("PRAGMA journal_mode=WAL")
+                conn.close()
+                _initialized_paths.add(path)
+    _apply_migrations(path)
+
+    connections = getattr(_local, "connections", None)
+    # A forked worker must not share its parent's connections
+    if connections is None or _local.pid != os.getpid():
+        connections = _local.connections = {}
+        _local.pid = os.getpid()
+    conn = connections.get(path)
+    if conn is None:
+        conn = connections[path] = sqlite3.connect(path, timeout=10)
+        conn.execute("PRAGMA busy_timeout=10000")
+        # Durable across application crashes; WAL only risks the last commits on power loss
+        conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def _create_shared_cache(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS shared_cache (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value BLOB,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (namespace, key)
+        )
+        """
+    )
+
+
+def _index_cache_expiry(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS shared_cache_expiry ON shared_cache (expires_at)")
+
+
+class SharedCache:
+    """Namespaced key/value cache with expiry, safe across worker processes."""
+
+    def __init__(self, namespace, ttl_seconds, encrypt=False, path=STATE_DB_PATH, max_entries=None, max_bytes=None):
+        self.namespace = namespace
+        self.ttl_seconds = ttl_seconds
+        quota = QUOTAS.get(namespace, {})
+        # Entries expiring soonest are evicted on set() beyond either cap
+        self.max_entries = quota.get("max_entries", max_entries)
+        self.max_bytes = quota.get("max_bytes", max_bytes)
+        self.path = path
+        self._cipher = build_cipher() if encrypt else None
+        register_migration(path, "shared_cache.0001_create", _create_shared_cache)
+        register_migration(path, "shared_cache.0002_expiry_index", _index_cache_expiry)
+
+    def _connect(self):
+        return connect(self.path)
+
+    def _encode(self, value):
+        data = json.dumps(value).encode("utf-8")
+        return self._cipher.encrypt(data) if self._cipher else data
+
+    def _decode(self, blob):
+        if self._cipher:
+            blob = self._cipher.decrypt(blob)
+        return json.loads(blob)
+
+    def add(self, key, value=None):
+        """Store a value only if the key is absent; True if this call stored it."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM shared_cache WHERE namespace = ? AND key = ? AND expires_at < ?",
+                (self.namespace, key, now)
+            )
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO shared_cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (self.namespace, key, self._encode(value), now + self.ttl_seconds)
+            )
+            return cursor.rowcount == 1
+
+    def set(self, key, value):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO shared_cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (self.namespace, key, self._encode(value), time.time() + self.ttl_seconds)
+            )
+            if self.max_entries:
+                conn.execute(
+                    """
+                    DELETE FROM shared_cache WHERE namespace = ? AND key IN (
+                        SELECT key FROM shared_cache WHERE namespace = ?
+                        ORDER BY expires_at DESC LIMIT -1 OFFSET ?
+                    )
+                    """,
+                    (self.namespace, self.namespace, self.max_entries)
+                )
+            if self.max_bytes:
+                conn.execute(
+                    """
+                    DELETE FROM shared_cache WHERE namespace = ? AND key IN (
+                        SELECT key FROM (
+                            SELECT key, SUM(length(value)) OVER (ORDER BY expires_at DESC, key) AS total
+                            FROM shared_cache WHERE namespace = ?
+                        ) WHERE total > ?
+                    )
+                    """,
+                    (self.namespace, self.namespace, self.max_bytes)
+                )
+
+    def get(self, key, default=None):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value FROM shared_cache WHERE namespace = ? AND key = ? AND expires_at >= ?",
+                (self.namespace, key, time.time())
+            ).fetchone()
+        if row is None:
+            return default
+        try:
+            return self._decode(row[0])
+        except InvalidToken:
+            return default
+
+    def delete(self, key):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM shared_cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+
+    # Off the event loop, for large values or hot paths
+    async def add_async(self, key, value=None):
+        return await asyncio.to_thread(self.add, key, value)
+
+    async def set_async(self, key, value):
+        await asyncio.to_thread(self.set, key, value)
+
+    async def get_async(self, key, default=None):
+        return await asyncio.to_thread(self.get, key, default)
+
+    async def delete_async(self, key):
+        await asyncio.to_thread(self.delete, key)
+
+
+def sweep_expired(path=STATE_DB_PATH):
+    """Delete expired cache entries; returns how many were removed."""
+    with connect(path) as conn:
+        return conn.execute("DELETE FROM shared_cache WHERE expires_at < ?", (time.time(),)).rowcount
+
+
+async def run_sweeper(path=STATE_DB_PATH):
+    """Sweep expired cache entries every STATE_SWEEP_SECONDS until cancelled."""
+    register_migration(path, "shared_cache.0001_create", _create_shared_cache)
+    register_migration(path, "shared_cache.0002_expiry_index", _index_cache_expiry)
+    while True:
+        try:
+            removed = await asyncio.to_thread(sweep_expired, path)
+            if removed:
+                logger.debug("Swept %s expired cache entries", removed)
+        except Exception as e:
+            logger.warning("Sweeping expired state failed: %s", e)
+        await asyncio.sleep(STATE_SWEEP_SECONDS)
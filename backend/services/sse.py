@@ -0,0 +1,46 @@
+"""Server-sent event helpers shared by the streaming endpoints."""
+import json
+
+from fastapi.responses import StreamingResponse
+
+from services.gemini import generate_stream, usage_summary
+from services.log import get_logger
+
+logger = get_logger(__name__)
+
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def event_stream(events):
+    """StreamingResponse for an async iterator of formatted events."""
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        # X-Accel-Buffering stops nginx from holding events back
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def generation_events(gemini_model, prompt, **done_fields):
+    """`delta` events with Gemini's text as it arrives, then `done` with the full content and usage."""
+    parts = []
+    usage = None
+    try:
+        async for chunk in generate_stream(gemini_model, prompt):
+            text = chunk.text
+            if text:
+                parts.append(text)
+                yield format_event("delta", {"text": text})
+            usage = usage_summary(chunk) or usage
+    except Exception as e:
+        logger.warning("Streaming generation failed: %s", e)
+        yield format_event("error", {"error": str(e), "content": "".join(parts)})
+        return
+    yield format_event("done", {"content": "".join(parts), "usage": usage, **done_fields})
+
+
+def stream_generation(gemini_model, prompt, **done_fields):
+    """SSE response streaming a Gemini generation; `done_fields` (e.g. `model`) are added to the final event."""
+    return event_stream(generation_events(gemini_model, prompt, **done_fields))
@@ -0,0 +1,94 @@
+"""Local extractive summaries for when Gemini can't be used.
+
+Sentences are scored by the TF-IDF weight of their words, with sentences
+treated as documents, and the best few are returned in their original
+order. Pure Python and CPU-only: an email summarises in about a
+millisecond, so /email/unread stays useful while Gemini is over quota or
+its circuit breaker is open, and `mode=fast` can ask for it outright.
+"""
+import math
+import re
+from collections import Counter
+
+# Reported in place of a Gemini model alongside local summaries
+LOCAL_MODEL_INFO = {"tier": "local", "name": "extractive-tfidf", "max_output_tokens": None}
+
+# Sentences shorter than this are greetings, sign-offs and the like
+MIN_SENTENCE_WORDS = 4
+# Longer bodies are summarised from their start; the gist is rarely at the end
+MAX_INPUT_CHARS = 20000
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[\"'(\[]?[A-Z0-9])")
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+_LIST_ITEM = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s+")
+_WORD = re.compile(r"[a-z0-9][a-z0-9'-]*")
+_STOPWORDS = frozenset("""
+    a about above after again all also am an and any are as at be because been before being
+    below between both but by can could did do does doing down during each few for from
+    further had has have having he her here hers herself him himself his how i if in into is
+    it its itself just let me more most my myself no nor not now of off on once only or other
+    our ours ourselves out over own same she should so some such than that the their theirs
+    them themselves then there these they this those through to too under until up very was
+    we were what when where which while who whom why will with would you your yours yourself
+    yourselves hi hello hey dear thanks thank regards best cheers please
+""".split())
+
+
+def split_sentences(text):
+    """Sentences of plain text, treating paragraphs and list items as boundaries."""
+    sentences = []
+    for paragraph in _PARAGRAPH_BREAK.split(text):
+        # Hard-wrapped lines are joined back up; list items stand on their own
+        chunks, current = [], []
+        for line in paragraph.splitlines():
+            if _LIST_ITEM.match(line) and current:
+                chunks.append(" ".join(current))
+                current = []
+            if line.strip():
+                current.append(_LIST_ITEM.sub("", line).strip())
+        if current:
+            chunks.append(" ".join(current))
+        for chunk in chunks:
+            sentences.extend(s.strip() for s in _SENTENCE_END.split(chunk) if s.strip())
+    return sentences
+
+
+def _terms(sentence):
+    return [word for word in _WORD.findall(sentence.lower()) if word not in _STOPWORDS]
+
+
+def summarize(text, max_sentences=3, title=""):
+    """Up to `max_sentences` of the most informative sentences of `text`, in order.
+
+    Words from `title` (e.g. the subject line) count extra, since they say
+    what the message is about.
+    """
+    sentences = [s for s in split_sentences(text[:MAX_INPUT_CHARS]) if len(s.split()) >= MIN_SENTENCE_WORDS]
+    if len(sentences) <= max_sentences:
+        return " ".join(sentences) or text.strip()[:300]
+
+    counts = [Counter(_terms(sentence)) for sentence in sentences]
+    document_frequency = Counter(term for terms in counts for term in terms)
+    title_terms = set(_terms(title))
+    total = len(sentences)
+
+    scores = []
+    for index, terms in enumerate(counts):
+        length = sum(terms.values())
+        if not length:
+            scores.append(0.0)
+            continue
+        weight = sum(
+            (count / length) * math.log(1 + total / document_frequency[term]) * (2.0 if term in title_terms else 1.0)
+            for term, count in terms.items()
+        )
+        # Favour longer sentences a little, and the opening of the message
+        weight *= math.log(1 + length)
+        weight *= 1.0 + 0.5 / (1 + index)
+        # Questions are usually what the sender needs answered
+        if sentences[index].endswith("?"):
+            weight *= 1.5
+        scores.append(weight)
+
+    best = sorted(range(total), key=lambda i: scores[i], reverse=True)[:max_sentences]
+    return " ".join(sentences[i] for i in sorted(best))
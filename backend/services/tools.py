@@ -0,0 +1,164 @@
+"""Server-side tools for Gemini function calling in chat.
+
+Routers register in-process functions (reading mail and the calendar,
+writing documents, reviewing code) here, the same way they register
+background job handlers. A chat turn then runs entirely on the server:
+Gemini asks for tools, they are called directly instead of by the browser
+over HTTP, and the results go back to Gemini until it answers. Calls
+requested in the same step run concurrently.
+
+Tools that need Google access are only offered when the chat request is
+authenticated. Tools with side effects (sending mail, creating events) are
+deliberately not registered; those stay behind an explicit user action.
+"""
+import asyncio
+import json
+import os
+import time
+
+from fastapi import HTTPException
+
+from services.gemini import generate
+from services.log import get_logger
+from services.metrics import CHAT_TOOL_CALLS, CHAT_TOOL_DURATION
+from services.prompt_budget import fit_section
+
+logger = get_logger(__name__)
+
+CHAT_TOOLS = os.getenv("CHAT_TOOLS", "true").lower() == "true"
+# Rounds of tool calls before Gemini has to answer with what it has
+CHAT_MAX_TOOL_STEPS = int(os.getenv("CHAT_MAX_TOOL_STEPS", "4"))
+CHAT_TOOL_TIMEOUT_SECONDS = float(os.getenv("CHAT_TOOL_TIMEOUT_SECONDS", "60"))
+
+# Tool calls may not be requested once the step limit is reached
+_NO_MORE_CALLS = {"function_calling_config": {"mode": "NONE"}}
+
+
+class Tool:
+    def __init__(self, name, description, handler, parameters, requires_user):
+        self.name = name
+        self.description = description
+        self.handler = handler
+        self.parameters = parameters
+        self.requires_user = requires_user
+
+    def declaration(self):
+        declaration = {"name": self.name, "description": self.description}
+        if self.parameters:
+            declaration["parameters"] = self.parameters
+        return declaration
+
+
+class ToolRegistry:
+    """Functions Gemini may call during a chat turn."""
+
+    def __init__(self):
+        self._tools = {}
+
+    def register(self, name, description, handler, parameters=None, requires_user=False):
+        """Register `async handler(args, user_data)` returning a JSON-able result.
+
+        `parameters` is a JSON schema object for the arguments.
+        """
+        self._tools[name] = Tool(name, description, handler, parameters, requires_user)
+
+    def _available(self, name, user_data):
+        tool = self._tools.get(name)
+        if tool is None or (tool.requires_user and user_data is None):
+            return None
+        return tool
+
+    def declarations(self, user_data):
+        """Gemini `tools` for the tools this user may call, or None."""
+        declarations = [tool.declaration() for tool in self._tools.values() if self._available(tool.name, user_data)]
+        return [{"function_declarations": declarations}] if declarations else None
+
+    async def call(self, name, args, user_data):
+        """Run a tool; failures are returned to Gemini as {"error": ...}."""
+        tool = self._available(name, user_data)
+        if tool is None:
+            return {"error": f"Unknown tool {name}"}
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(tool.handler(args, user_data), CHAT_TOOL_TIMEOUT_SECONDS)
+            outcome = "ok"
+        except HTTPException as e:
+            result, outcome = {"error": e.detail}, "error"
+        except asyncio.TimeoutError:
+            result, outcome = {"error": "The tool took too long"}, "error"
+        except Exception as e:
+            logger.warning("Chat tool %s failed: %s", name, e)
+            result, outcome = {"error": str(e)}, "error"
+        CHAT_TOOL_CALLS.inc(name, outcome)
+        CHAT_TOOL_DURATION.observe(time.perf_counter() - started, name)
+        return _as_response(result)
+
+
+def _as_response(result):
+    """Tool result as a JSON object small enough to send back to Gemini."""
+    if hasattr(result, "body") and hasattr(result, "media_type"):
+        # Endpoints may return a Response object rather than a dict
+        result = json.loads(result.body)
+    text = json.dumps(result, default=str)
+    fitted = fit_section("chat", "tool_result", text)
+    if fitted is not text:
+        return {"result": fitted, "truncated": True}
+    result = json.loads(text)
+    return result if isinstance(result, dict) else {"result": result}
+
+
+def _function_calls(response):
+    if not response.candidates:
+        return []
+    return [part.function_call for part in response.candidates[0].content.parts if part.function_call.name]
+
+
+def _args(call):
+    return type(call).to_dict(call).get("args") or {}
+
+
+async def run_with_tools(model, prompt, user_data, on_status=None, registry=None):
+    """Answer `prompt`, letting Gemini call tools along the way.
+
+    `on_status`, if given, is awaited with {"id", "name", "status", ...}
+    as each tool call starts and finishes. Returns the final response and
+    a summary of the tool calls made.
+    """
+    registry = registry or chat_tools
+    declarations = registry.declarations(user_data) if CHAT_TOOLS else None
+    if not declarations:
+        return await generate(model, prompt), []
+
+    contents = [{"role": "user", "parts": [prompt]}]
+    calls_made = []
+
+    async def call_tool(call):
+        entry = {"id": f"call_{len(calls_made) + 1}", "name": call.name, "status": "running"}
+        calls_made.append(entry)
+        if on_status is not None:
+            await on_status(dict(entry))
+        started = time.perf_counter()
+        result = await registry.call(call.name, _args(call), user_data)
+        entry["status"] = "error" if "error" in result else "done"
+        entry["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        if on_status is not None:
+            await on_status(dict(entry))
+        return result
+
+    for _ in range(CHAT_MAX_TOOL_STEPS):
+        response = await generate(model, contents, tools=declarations)
+        calls = _function_calls(response)
+        if not calls:
+            return response, calls_made
+        contents.append(response.candidates[0].content)
+        results = await asyncio.gather(*(call_tool(call) for call in calls))
+        contents.append({
+            "role": "user",
+            "parts": [{"function_response": {"name": call.name, "response": result}} for call, result in zip(calls, results)],
+        })
+
+    response = await generate(model, contents, tools=declarations, tool_config=_NO_MORE_CALLS)
+    return response, calls_made
+
+
+chat_tools = ToolRegistry()
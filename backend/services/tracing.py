@@ -0,0 +1,203 @@
+"""Lightweight request tracing with a local JSON lines exporter.
+
+A sampled request gets a root span from TracingMiddleware; code on the
+request path opens child spans with `span(...)`. Spans follow the request
+across the thread pool because the current span lives in a context
+variable. Finished spans are written by a background thread to
+TRACE_EXPORT_PATH, one JSON object per line.
+"""
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import pathlib
+import queue
+import random
+import secrets
+import threading
+import time
+
+from fastapi.responses import JSONResponse
+
+try:
+    # orjson serializes the large markdown payloads several times faster
+    from fastapi.responses import ORJSONResponse as _BaseJSONResponse
+    import orjson  # noqa: F401
+except ImportError:
+    _BaseJSONResponse = JSONResponse
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.0"))
+TRACE_EXPORT_PATH = os.getenv(
+    "TRACE_EXPORT_PATH",
+    os.path.join(pathlib.Path(__file__).parent.parent, "data", "traces.jsonl")
+)
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "10000"))
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """One timed operation within a trace."""
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "attributes", "start", "end", "status")
+
+    def __init__(self, trace_id, name, parent_id=None, attributes=None):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.start = time.time()
+        self.end = None
+        self.status = "ok"
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round((self.end - self.start) * 1000, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class _JsonLinesExporter:
+    """Writes finished spans to a file from a background thread."""
+
+    def __init__(self, path):
+        self.path = path
+        self._queue = queue.Queue(maxsize=TRACE_QUEUE_SIZE)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                    self._thread.start()
+        try:
+            self._queue.put_nowait(span.to_dict())
+        except queue.Full:
+            pass
+
+    def _run(self):
+        pathlib.Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as out:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                out.write(json.dumps(item, default=str) + "\n")
+                # Flush once the backlog is drained so traces show up promptly
+                if self._queue.empty():
+                    out.flush()
+
+    def shutdown(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+_exporter = _JsonLinesExporter(TRACE_EXPORT_PATH)
+
+
+def current_span():
+    return _current_span.get()
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """Open a child span of the current span; a no-op for unsampled requests."""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+
+    child = Span(parent.trace_id, name, parent_id=parent.span_id, attributes=attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.status = f"error: {type(e).__name__}"
+        raise
+    finally:
+        child.end = time.time()
+        _current_span.reset(token)
+        _exporter.export(child)
+
+
+def in_context(func, *args, **kwargs):
+    """Bind a call to the current context so spans cross into worker threads."""
+    return functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+
+
+class TracedJSONResponse(_BaseJSONResponse):
+    """JSON response whose serialization shows up as its own span."""
+
+    def render(self, content):
+        with span("response.serialize"):
+            return super().render(content)
+
+
+def shutdown_tracing():
+    _exporter.shutdown()
+
+
+def _parse_traceparent(value):
+    """Parse a W3C traceparent header into (trace_id, parent_id, sampled)."""
+    parts = value.split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return parts[1], parts[2], parts[3] == "01"
+
+
+class TracingMiddleware:
+    """Start a root span for head-sampled requests."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        trace_id, parent_id, sampled = None, None, random.random() < TRACE_SAMPLE_RATE
+        for name, value in scope["headers"]:
+            if name == b"traceparent":
+                parsed = _parse_traceparent(value.decode("latin-1"))
+                if parsed:
+                    trace_id, parent_id, sampled = parsed
+                break
+        if not sampled:
+            return await self.app(scope, receive, send)
+
+        root = Span(trace_id or secrets.token_hex(16), f"{scope['method']} {scope['path']}", parent_id=parent_id)
+        token = _current_span.set(root)
+
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                root.set_attribute("http.status_code", message["status"])
+                message["headers"] = list(message.get("headers", [])) + [(b"x-trace-id", root.trace_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_trace)
+        except BaseException as e:
+            root.status = f"error: {type(e).__name__}"
+            raise
+        finally:
+            route = scope.get("route")
+            if route is not None:
+                root.name = f"{scope['method']} {route.path}"
+            root.end = time.time()
+            _current_span.reset(token)
+            _exporter.export(root)
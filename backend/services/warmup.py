@@ -0,0 +1,96 @@
+"""Optional start-up warm-up so the first user request doesn't pay cold costs.
+
+Runs in the background from the app lifespan: imports the SDKs, parses the
+discovery documents, opens pooled connections to the Google API hosts and
+optionally sends Gemini a small count_tokens request, which also calibrates
+the prompt token estimator. `/ready` returns 503
+until it has finished, so load balancers keep traffic off cold workers.
+"""
+import asyncio
+import os
+import time
+
+from fastapi.concurrency import run_in_threadpool
+
+from services.log import get_logger
+from services.metrics import UpstreamTimer
+
+logger = get_logger(__name__)
+
+WARMUP = os.getenv("WARMUP", "true").lower() == "true"
+# Costs one count_tokens call per worker start
+WARMUP_GEMINI = os.getenv("WARMUP_GEMINI", "false").lower() == "true"
+# Past this the worker reports ready anyway rather than staying out of rotation
+WARMUP_TIMEOUT_SECONDS = float(os.getenv("WARMUP_TIMEOUT_SECONDS", "20"))
+
+DISCOVERY_APIS = [("gmail", "v1"), ("calendar", "v3"), ("oauth2", "v2")]
+GOOGLE_HOSTS = [
+    "https://gmail.googleapis.com/",
+    "https://www.googleapis.com/",
+    "https://oauth2.googleapis.com/",
+]
+
+status = {"ready": not WARMUP, "steps": {}}
+
+
+def _discovery():
+    from services.google_http import preload_discovery
+
+    preload_discovery(DISCOVERY_APIS)
+
+
+def _connections():
+    from services.google_http import GOOGLE_API_ENDPOINT, warm_connections
+
+    hosts = [GOOGLE_API_ENDPOINT] if GOOGLE_API_ENDPOINT else GOOGLE_HOSTS
+    if not warm_connections(hosts):
+        raise ConnectionError("no Google API host reachable")
+
+
+def _gemini_models(models):
+    # Imports and configures the SDK once, then builds each router's model
+    for model in models:
+        model.model
+
+
+def _gemini_ping(model):
+    from services.prompt_budget import CALIBRATION_SAMPLE, calibrate
+
+    # Also checks the local token estimator against Gemini's tokenizer
+    with UpstreamTimer("gemini", "count_tokens"):
+        counted = model.count_tokens(CALIBRATION_SAMPLE)
+    calibrate(CALIBRATION_SAMPLE, counted.total_tokens)
+
+
+async def _step(name, func, *args):
+    started = time.perf_counter()
+    try:
+        await run_in_threadpool(func, *args)
+        status["steps"][name] = {"ok": True}
+    except Exception as e:
+        logger.warning("Warm-up step %s failed: %s", name, e)
+        status["steps"][name] = {"ok": False, "error": str(e)}
+    status["steps"][name]["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+
+async def _warm(models):
+    await asyncio.gather(
+        _step("discovery", _discovery),
+        _step("connections", _connections),
+        _step("gemini_models", _gemini_models, models),
+    )
+    if WARMUP_GEMINI and models:
+        await _step("gemini_ping", _gemini_ping, models[0])
+
+
+async def run(models=()):
+    """Warm up, then mark the worker ready even if some steps failed."""
+    if not WARMUP:
+        return
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(_warm(list(models)), WARMUP_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        logger.warning("Warm-up did not finish within %ss", WARMUP_TIMEOUT_SECONDS)
+    status["ready"] = True
+    logger.info("Warm-up finished in %.0f ms", (time.perf_counter() - started) * 1000)
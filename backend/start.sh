@@ -9,5 +9,5 @@ source venv/bin/activate
 # Install requirements
 pip install -r requirements.txt
 
-# Run the FastAPI server
+# Run the FastAPI server (development, auto-reload); use `python serve.py` in production
 uvicorn main:app --reload --host 0.0.0.0 --port 8000
@@ -0,0 +1,13 @@
+"""Shared setup: state databases go to a scratch directory, never data/."""
+import os
+import tempfile
+
+_scratch = tempfile.mkdtemp(prefix="pa-agent-tests-")
+
+# Read at import time by services.shared_state, sessions and mail_index
+os.environ.setdefault("DATA_DIR", _scratch)
+os.environ.setdefault("STATE_DB_PATH", os.path.join(_scratch, "state.db"))
+os.environ.setdefault("SESSION_DB_PATH", os.path.join(_scratch, "sessions.db"))
+os.environ.setdefault("MAIL_INDEX_DB_PATH", os.path.join(_scratch, "mail_index.db"))
+os.environ.setdefault("SECRET_KEY", "tests")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
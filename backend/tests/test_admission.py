@@ -0,0 +1,203 @@
+import asyncio
+
+import httpx
+import pytest
+from starlette.responses import JSONResponse
+
+from services import admission
+from services.admission import AdmissionControlMiddleware
+
+LIMITS = {"default": {"concurrency": 1, "rate_per_minute": 60, "burst": 2}}
+
+
+@pytest.fixture(autouse=True)
+def enabled(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION", True)
+    # As get_current_user does once it has verified a token
+    admission.remember_identity("alice", "user-alice")
+    admission.remember_identity("bob", "user-bob")
+
+
+class BlockingApp:
+    """ASGI app that holds every request until `release` is set."""
+
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.started = 0
+
+    async def __call__(self, scope, receive, send):
+        self.started += 1
+        await self.release.wait()
+        await JSONResponse({"ok": True})(scope, receive, send)
+
+
+class StreamingApp(BlockingApp):
+    """Starts an event stream for /stream, then holds it open until `release` is set."""
+
+    def __init__(self):
+        super().__init__()
+        self.streaming = False
+
+    async def __call__(self, scope, receive, send):
+        if scope["path"] != "/stream":
+            await JSONResponse({"ok": True})(scope, receive, send)
+            return
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/event-stream")]})
+        self.streaming = True
+        await self.release.wait()
+        await send({"type": "http.response.body", "body": b"event: done\ndata: {}\n\n"})
+
+
+def _client(middleware):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=middleware), base_url="http://test")
+
+
+async def _until(condition):
+    for _ in range(100):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition never became true")
+
+
+def test_rate_limit_answers_429_with_retry_after():
+    async def run():
+        app = BlockingApp()
+        app.release.set()
+        async with _client(AdmissionControlMiddleware(app, limits=LIMITS)) as client:
+            headers = {"Authorization": "Bearer alice"}
+            statuses = [(await client.get("/data", headers=headers)).status_code for _ in range(2)]
+            rejected = await client.get("/data", headers=headers)
+            # Another user has a bucket of their own
+            other = await client.get("/data", headers={"Authorization": "Bearer bob"})
+        return statuses, rejected, other
+
+    statuses, rejected, other = asyncio.run(run())
+    assert statuses == [200, 200]
+    assert rejected.status_code == 429
+    assert int(rejected.headers["Retry-After"]) >= 1
+    assert other.status_code == 200
+
+
+def test_user_concurrency_answers_429():
+    async def run():
+        app = BlockingApp()
+        async with _client(AdmissionControlMiddleware(app, limits=LIMITS)) as client:
+            headers = {"Authorization": "Bearer alice"}
+            first = asyncio.create_task(client.get("/data", headers=headers))
+            await _until(lambda: app.started == 1)
+            second = await client.get("/data", headers=headers)
+            app.release.set()
+            return (await first).status_code, second
+
+    first, second = asyncio.run(run())
+    assert first == 200
+    assert second.status_code == 429
+    assert "concurrent" in second.json()["detail"]
+
+
+def test_full_queue_answers_503(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_MAX_IN_FLIGHT", 1)
+    monkeypatch.setattr(admission, "ADMISSION_QUEUE_SIZE", 0)
+
+    async def run():
+        app = BlockingApp()
+        async with _client(AdmissionControlMiddleware(app, limits=LIMITS)) as client:
+            first = asyncio.create_task(client.get("/data", headers={"Authorization": "Bearer alice"}))
+            await _until(lambda: app.started == 1)
+            shed = await client.get("/data", headers={"Authorization": "Bearer bob"})
+            app.release.set()
+            return (await first).status_code, shed
+
+    first, shed = asyncio.run(run())
+    assert first == 200
+    assert shed.status_code == 503
+    assert shed.headers["Retry-After"] == str(admission.ADMISSION_RETRY_AFTER_SECONDS)
+
+
+def test_queue_wait_timeout_answers_503(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_MAX_IN_FLIGHT", 1)
+    monkeypatch.setattr(admission, "ADMISSION_QUEUE_SIZE", 1)
+    monkeypatch.setattr(admission, "ADMISSION_MAX_WAIT_SECONDS", 0.05)
+
+    async def run():
+        app = BlockingApp()
+        middleware = AdmissionControlMiddleware(app, limits=LIMITS)
+        async with _client(middleware) as client:
+            first = asyncio.create_task(client.get("/data", headers={"Authorization": "Bearer alice"}))
+            await _until(lambda: app.started == 1)
+            timed_out = await client.get("/data", headers={"Authorization": "Bearer bob"})
+            app.release.set()
+            await first
+        return timed_out, middleware.gate
+
+    timed_out, gate = asyncio.run(run())
+    assert timed_out.status_code == 503
+    # The abandoned wait must not leak a slot or a queue entry
+    assert gate.in_flight == 0
+    assert gate.queued == 0
+
+
+def test_unverified_tokens_share_the_client_limits():
+    async def run():
+        app = BlockingApp()
+        async with _client(AdmissionControlMiddleware(app, limits=LIMITS)) as client:
+            first = asyncio.create_task(client.get("/data", headers={"Authorization": "Bearer made-up-1"}))
+            await _until(lambda: app.started == 1)
+            # A new made-up token must not buy a fresh set of limits
+            second = await client.get("/data", headers={"Authorization": "Bearer made-up-2"})
+            app.release.set()
+            return (await first).status_code, second.status_code
+
+    assert asyncio.run(run()) == (200, 429)
+
+
+def _hold_slot_then(path, headers):
+    """Status of a request to `path` sent while alice holds the only global slot."""
+    async def run():
+        app = BlockingApp()
+        async with _client(AdmissionControlMiddleware(app, limits=LIMITS)) as client:
+            first = asyncio.create_task(client.get("/data", headers={"Authorization": "Bearer alice"}))
+            await _until(lambda: app.started == 1)
+            second = asyncio.create_task(client.get(path, headers={"Authorization": "Bearer bob", **headers}))
+            await asyncio.wait([second], timeout=0.2)
+            app.release.set()
+            await first
+            return (await second).status_code
+
+    return asyncio.run(run())
+
+
+def test_conditional_long_polls_skip_the_global_queue(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_MAX_IN_FLIGHT", 1)
+    monkeypatch.setattr(admission, "ADMISSION_QUEUE_SIZE", 0)
+
+    assert _hold_slot_then("/email/unread?wait=30", {"If-None-Match": '"abc"'}) == 200
+    assert _hold_slot_then("/calendar/events?wait=30", {"If-None-Match": '"abc"'}) == 200
+
+
+def test_wait_parameter_elsewhere_is_still_gated(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_MAX_IN_FLIGHT", 1)
+    monkeypatch.setattr(admission, "ADMISSION_QUEUE_SIZE", 0)
+
+    assert _hold_slot_then("/code/review?wait=1", {"If-None-Match": '"abc"'}) == 503
+    # Without If-None-Match there is nothing to wait for, so it is an ordinary request
+    assert _hold_slot_then("/email/unread?wait=30", {}) == 503
+
+
+def test_started_event_stream_frees_its_global_slot(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_MAX_IN_FLIGHT", 1)
+    monkeypatch.setattr(admission, "ADMISSION_QUEUE_SIZE", 0)
+
+    async def run():
+        app = StreamingApp()
+        middleware = AdmissionControlMiddleware(app, limits=LIMITS)
+        async with _client(middleware) as client:
+            stream = asyncio.create_task(client.get("/stream", headers={"Authorization": "Bearer alice"}))
+            await _until(lambda: app.streaming)
+            other = await client.get("/data", headers={"Authorization": "Bearer bob"})
+            app.release.set()
+            await stream
+        return other.status_code, middleware.gate.in_flight
+
+    assert asyncio.run(run()) == (200, 0)
@@ -0,0 +1,19 @@
+from routers.auth import user_key
+
+
+def test_user_key_does_not_expose_the_google_id():
+    key = user_key({"user_info": {"id": "1234567890", "email": "a@example.com"}, "access_token": "token"})
+
+    assert "1234567890" not in key
+    assert len(key) == 32
+    # Stable across tokens and sessions of the same account
+    assert key == user_key({"user_info": {"id": "1234567890"}, "access_token": "other"})
+
+
+def test_user_key_falls_back_to_email_then_token():
+    by_email = user_key({"user_info": {"email": "a@example.com"}, "access_token": "token"})
+    by_token = user_key({"user_info": None, "access_token": "token"})
+
+    assert "example" not in by_email
+    assert by_email != by_token
+    assert by_token == user_key({"access_token": "token"})
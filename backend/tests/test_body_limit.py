@@ -0,0 +1,61 @@
+import asyncio
+
+import httpx
+from fastapi import FastAPI, Request
+
+from services.body_limit import BodySizeLimitMiddleware
+
+LIMIT = 1024
+
+
+def _app():
+    app = FastAPI()
+    app.state.calls = 0
+
+    @app.post("/echo")
+    async def echo(request: Request):
+        app.state.calls += 1
+        return {"size": len(await request.body())}
+
+    app.add_middleware(BodySizeLimitMiddleware, max_bytes=LIMIT)
+    return app
+
+
+def _post(app, **kwargs):
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/echo", **kwargs)
+
+    return asyncio.run(run())
+
+
+def test_body_within_limit_reaches_the_route():
+    app = _app()
+
+    response = _post(app, content=b"x" * LIMIT)
+
+    assert response.status_code == 200
+    assert response.json() == {"size": LIMIT}
+
+
+def test_declared_length_over_limit_is_rejected_before_the_route_runs():
+    app = _app()
+
+    response = _post(app, content=b"x" * (LIMIT + 1))
+
+    assert response.status_code == 413
+    assert response.json()["detail"] == f"Request body exceeds {LIMIT} bytes"
+    assert response.headers["connection"] == "close"
+    assert app.state.calls == 0
+
+
+def test_chunked_body_is_cut_off_once_it_passes_the_limit():
+    async def chunks():
+        for _ in range(64):
+            yield b"x" * 256
+
+    response = _post(_app(), content=chunks())
+
+    assert "content-length" not in response.request.headers
+    assert response.status_code == 413
@@ -0,0 +1,135 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI, Request, Response
+from fastapi.testclient import TestClient
+
+from routers import calendar
+from routers.auth import get_current_user
+from services import conditional
+from services.conditional import etag_matches, make_etag, not_modified, set_etag, wait_for_change
+
+
+def _versioned_app(state):
+    """App whose /data is versioned by state["version"]; counts version checks in state["checks"]."""
+    app = FastAPI()
+
+    @app.get("/data")
+    async def data(request: Request, response: Response, wait: int = 0):
+        async def current_etag():
+            state["checks"] += 1
+            return make_etag("data", state["version"])
+
+        etag = await wait_for_change(request, current_etag, wait)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        set_etag(response, make_etag("data", state["version"]))
+        return {"version": state["version"]}
+
+    return app
+
+
+@pytest.fixture
+def state():
+    return {"version": 1, "checks": 0}
+
+
+def test_matching_etag_answers_304(state):
+    client = TestClient(_versioned_app(state))
+
+    first = client.get("/data")
+    etag = first.headers["ETag"]
+    again = client.get("/data", headers={"If-None-Match": etag})
+
+    assert first.status_code == 200
+    assert first.headers["Cache-Control"] == "private, no-cache"
+    assert again.status_code == 304
+    assert again.content == b""
+    assert again.headers["ETag"] == etag
+
+
+def test_etag_lists_and_weak_tags_match(state):
+    client = TestClient(_versioned_app(state))
+    etag = client.get("/data").headers["ETag"]
+
+    assert client.get("/data", headers={"If-None-Match": f'"other", W/{etag}'}).status_code == 304
+    assert client.get("/data", headers={"If-None-Match": "*"}).status_code == 304
+
+
+def test_changed_data_answers_200_with_a_new_etag(state):
+    client = TestClient(_versioned_app(state))
+    etag = client.get("/data").headers["ETag"]
+    state["version"] = 2
+
+    response = client.get("/data", headers={"If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert response.json() == {"version": 2}
+    assert response.headers["ETag"] != etag
+
+
+def test_plain_requests_skip_the_version_check(state):
+    client = TestClient(_versioned_app(state))
+
+    client.get("/data")
+    client.get("/data?wait=5")
+
+    assert state["checks"] == 0
+
+
+def test_long_poll_returns_when_data_changes(state, monkeypatch):
+    monkeypatch.setattr(conditional, "LONG_POLL_CHECK_SECONDS", 0.02)
+
+    async def run():
+        transport = httpx.ASGITransport(app=_versioned_app(state))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            etag = (await client.get("/data")).headers["ETag"]
+            poll = asyncio.create_task(client.get("/data?wait=30", headers={"If-None-Match": etag}))
+            await asyncio.sleep(0.1)
+            state["version"] = 2
+            return await asyncio.wait_for(poll, 5)
+
+    response = asyncio.run(run())
+    assert response.status_code == 200
+    assert response.json() == {"version": 2}
+
+
+def test_long_poll_times_out_with_304(state, monkeypatch):
+    monkeypatch.setattr(conditional, "LONG_POLL_CHECK_SECONDS", 0.02)
+    monkeypatch.setattr(conditional, "LONG_POLL_MAX_SECONDS", 0.1)
+    client = TestClient(_versioned_app(state))
+    etag = client.get("/data").headers["ETag"]
+
+    response = client.get("/data?wait=1", headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert state["checks"] > 1
+
+
+def test_calendar_events_only_checks_the_version_when_asked(monkeypatch):
+    calls = {"version": 0, "events": 0}
+
+    async def calendar_version(service):
+        calls["version"] += 1
+        return "v1"
+
+    async def upcoming_events(service):
+        calls["events"] += 1
+        return {"events": [{"id": "e1"}]}, "v1", None
+
+    monkeypatch.setattr(calendar, "build_service", lambda *args, **kwargs: None)
+    monkeypatch.setattr(calendar, "calendar_version", calendar_version)
+    monkeypatch.setattr(calendar, "upcoming_events", upcoming_events)
+    app = FastAPI()
+    app.include_router(calendar.router, prefix="/calendar")
+    app.dependency_overrides[get_current_user] = lambda: {"user_info": {"id": "calendar-test"}, "access_token": "token"}
+    client = TestClient(app)
+
+    first = client.get("/calendar/events")
+    assert first.status_code == 200
+    assert calls == {"version": 0, "events": 1}
+
+    again = client.get("/calendar/events", headers={"If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304
+    assert calls == {"version": 1, "events": 1}
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from services import jobs
+from services.jobs import JobQueue
+from services.shared_state import connect
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(path=str(tmp_path / "state.db"))
+
+    async def handler(payload):
+        return "done"
+
+    queue.register("test", handler)
+    return queue
+
+
+def _expire_lease(queue, job_id):
+    with connect(queue.path) as conn:
+        conn.execute("UPDATE jobs SET lease_until = 0 WHERE id = ?", (job_id,))
+
+
+def test_running_job_is_not_claimed_twice(queue):
+    job_id = asyncio.run(queue.submit("test", {}))
+
+    assert queue._claim()[0] == job_id
+    assert queue._claim() is None
+
+
+def test_expired_lease_is_reclaimed(queue):
+    job_id = asyncio.run(queue.submit("test", {"n": 1}))
+    queue._claim()
+    _expire_lease(queue, job_id)
+
+    claimed = queue._claim()
+
+    assert claimed[0] == job_id
+    assert claimed[2] == {"n": 1}
+    job = asyncio.run(queue.get(job_id))
+    assert job["status"] == "running"
+    assert job["attempts"] == 2
+
+
+def test_job_interrupted_too_often_fails(queue):
+    job_id = asyncio.run(queue.submit("test", {}))
+    for _ in range(jobs.JOB_MAX_ATTEMPTS):
+        queue._claim()
+        _expire_lease(queue, job_id)
+
+    assert queue._claim() is None
+    job = asyncio.run(queue.get(job_id))
+    assert job["status"] == "failed"
+    assert "interrupted" in job["error"]
+
+
+def test_every_waiter_sees_an_update_after_one_times_out(queue):
+    async def run():
+        short = asyncio.create_task(queue.wait_for_update("job", 0.01))
+        long = asyncio.create_task(queue.wait_for_update("job", 5))
+        await short
+        queue._notify("job")
+        await asyncio.wait_for(long, 1)
+        return queue._updates
+
+    assert asyncio.run(run()) == {}
@@ -0,0 +1,54 @@
+import threading
+
+import pytest
+
+from services import metrics
+from services.metrics import Counter, Histogram
+
+
+@pytest.fixture
+def unregistered():
+    created = []
+    yield created
+    for metric in created:
+        metrics._registry.remove(metric)
+
+
+def _in_threads(record, count=20):
+    threads = [threading.Thread(target=record) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_counts_from_exited_threads_are_kept_and_their_shards_dropped(unregistered):
+    counter = Counter("test_events_total", "Events", ("kind",))
+    unregistered.append(counter)
+
+    _in_threads(lambda: counter.inc("a", amount=2))
+    assert 'test_events_total{kind="a"} 40' in counter.render()
+    assert counter._shards == []
+
+    # Retired totals keep adding up with later threads and the current one
+    _in_threads(lambda: counter.inc("a"))
+    counter.inc("b")
+    rendered = counter.render()
+    assert 'test_events_total{kind="a"} 60' in rendered
+    assert 'test_events_total{kind="b"} 1' in rendered
+    assert len(counter._shards) == 1
+
+
+def test_histograms_merge_exited_threads(unregistered):
+    histogram = Histogram("test_latency_seconds", "Latency", buckets=(1.0,))
+    unregistered.append(histogram)
+
+    _in_threads(lambda: histogram.observe(0.5))
+    _in_threads(lambda: histogram.observe(2.0), count=5)
+    rendered = histogram.render()
+
+    assert 'test_latency_seconds_bucket{le="1.0"} 20' in rendered
+    assert 'test_latency_seconds_bucket{le="+Inf"} 25' in rendered
+    assert "test_latency_seconds_sum 20.0" in rendered
+    assert "test_latency_seconds_count 25" in rendered
+    assert histogram._shards == []
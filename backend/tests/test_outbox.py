@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from services.outbox import Outbox
+from services.shared_state import connect
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    return Outbox(path=str(tmp_path / "state.db"))
+
+
+def _submit(outbox, user, key, header="<a@example.com>"):
+    return asyncio.run(outbox.submit(user, "cmF3", header, {"access_token": "token"}, idempotency_key=key))
+
+
+def test_same_idempotency_key_returns_the_first_send(outbox):
+    first_id, first_created = _submit(outbox, "alice", "key-1")
+    second_id, second_created = _submit(outbox, "alice", "key-1", header="<b@example.com>")
+
+    assert first_created is True
+    assert second_created is False
+    assert second_id == first_id
+    with connect(outbox.path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0] == 1
+
+
+def test_idempotency_keys_are_per_user(outbox):
+    alice_id, _ = _submit(outbox, "alice", "key-1")
+    bob_id, bob_created = _submit(outbox, "bob", "key-1")
+
+    assert bob_created is True
+    assert bob_id != alice_id
+    # Neither user can see the other's send
+    assert asyncio.run(outbox.get("bob", alice_id)) is None
+
+
+def test_sends_without_a_key_are_never_deduplicated(outbox):
+    first_id, _ = _submit(outbox, "alice", None)
+    second_id, second_created = _submit(outbox, "alice", None)
+
+    assert second_created is True
+    assert second_id != first_id
+    assert asyncio.run(outbox.get("alice", second_id))["status"] == "queued"
+
+
+def test_find_looks_up_a_send_by_idempotency_key(outbox):
+    entry_id, _ = _submit(outbox, "alice", "key-1")
+
+    assert asyncio.run(outbox.find("alice", "key-1")) == entry_id
+    assert asyncio.run(outbox.find("alice", "key-2")) is None
+    assert asyncio.run(outbox.find("bob", "key-1")) is None
+
+
+def test_retried_send_is_answered_without_calling_gmail(outbox, monkeypatch):
+    import httpx
+    from fastapi import FastAPI
+
+    from routers import email
+    from routers.auth import get_current_user
+
+    lookups = []
+
+    async def sender_address(service, user):
+        lookups.append(user)
+        return "alice@example.com"
+
+    monkeypatch.setattr(email, "outbox", outbox)
+    monkeypatch.setattr(email, "sender_address", sender_address)
+    monkeypatch.setattr(email, "build_service", lambda *args: None)
+    app = FastAPI()
+    app.include_router(email.router, prefix="/email")
+    app.dependency_overrides[get_current_user] = lambda: {"user_info": {"id": "1"}, "access_token": "token"}
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            send = {"to": "bob@example.com", "subject": "Hi", "body": "Hello"}
+            headers = {"Idempotency-Key": "compose-1"}
+            return [await client.post("/email/send", json=send, headers=headers) for _ in range(2)]
+
+    first, retry = asyncio.run(run())
+
+    assert first.status_code == retry.status_code == 202
+    assert retry.json()["id"] == first.json()["id"]
+    assert len(lookups) == 1
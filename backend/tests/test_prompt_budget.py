@@ -0,0 +1,70 @@
+import pytest
+
+from services import prompt_budget
+from services.prompt_budget import _truncate_chars, estimate_tokens, fit_section, truncate
+
+
+@pytest.fixture(autouse=True)
+def unscaled(monkeypatch):
+    # Calibration from other tests or warm-up must not move the budgets
+    monkeypatch.setattr(prompt_budget, "_scale", 1.0)
+
+
+def test_text_within_budget_is_returned_unchanged():
+    text = "line one\nline two"
+
+    assert truncate(text, 100) is text
+
+
+def test_long_text_keeps_whole_lines_from_both_ends():
+    lines = [f"line {i} says something" for i in range(500)]
+
+    result = truncate("\n".join(lines), 200).splitlines()
+
+    assert result[0] == lines[0]
+    assert result[-1] == lines[-1]
+    assert any(line.startswith("[... ") and line.endswith(" lines omitted ...]") for line in result)
+    assert set(result) - set(lines) == {next(line for line in result if line.startswith("[... "))}
+    assert estimate_tokens("\n".join(result)) <= 200
+
+
+def test_omitted_count_matches_the_dropped_lines():
+    lines = [f"line {i}" for i in range(300)]
+
+    result = truncate("\n".join(lines), 100).splitlines()
+
+    marker = next(line for line in result if line.startswith("[... "))
+    assert int(marker.split()[1]) == len(lines) - (len(result) - 1)
+
+
+def test_single_long_line_is_cut_at_spaces():
+    text = " ".join(f"word{i}" for i in range(5000))
+
+    result = truncate(text, 200)
+
+    assert " [...] " in result
+    assert result.startswith("word0 ")
+    assert result.endswith("word4999")
+    # No word is cut in half at either end of the gap
+    head, tail = result.split(" [...] ")
+    assert head.split()[-1] in text.split() and tail.split()[0] in text.split()
+
+
+@pytest.mark.parametrize("text", [
+    " " * 50000 + "x" * 10,
+    "\n" * 20000 + "word " * 5000,
+    "a" * 40000 + " " * 40000,
+    "x" * 50000,
+])
+def test_character_truncation_handles_whitespace_and_unbroken_ends(text):
+    result = _truncate_chars(text, 200)
+
+    assert "[...]" in result
+    assert len(result) < len(text)
+
+
+def test_fit_section_only_truncates_budgeted_sections():
+    text = "word " * 20000
+
+    assert fit_section("email.summary", "unknown-section", text) is text
+    assert estimate_tokens(fit_section("email.summary", "body", text)) <= prompt_budget.BUDGETS["email.summary"]["body"]
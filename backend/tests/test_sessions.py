@@ -0,0 +1,115 @@
+import asyncio
+import datetime
+import sqlite3
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from google.auth.exceptions import RefreshError
+from google.oauth2.credentials import Credentials
+
+from services import sessions
+from services.sessions import SessionStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SessionStore(path=str(tmp_path / "sessions.db"))
+
+
+def _credentials(token="access-1", expires_in=3600):
+    expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=expires_in)
+    return SimpleNamespace(token=token, refresh_token="refresh-1", scopes=["openid"], expiry=expiry)
+
+
+def test_session_resolves_to_its_credentials(store):
+    session_id = store.create(_credentials(), {"id": "42", "email": "a@example.com"})
+
+    session = asyncio.run(store.resolve(session_id))
+
+    assert session["access_token"] == "access-1"
+    assert session["user_info"]["id"] == "42"
+    assert asyncio.run(store.resolve("unknown")) is None
+
+
+def test_database_holds_neither_session_ids_nor_tokens(store):
+    session_id = store.create(_credentials(), {"id": "42"})
+
+    with sqlite3.connect(store.path) as conn:
+        key, payload = conn.execute("SELECT session_key, payload FROM sessions").fetchone()
+    assert key != session_id
+    assert b"refresh-1" not in payload and b"access-1" not in payload
+
+
+def test_logout_deletes_the_session(store):
+    session_id = store.create(_credentials())
+    store.delete(session_id)
+
+    assert asyncio.run(store.resolve(session_id)) is None
+
+
+def test_idle_sessions_expire(store, monkeypatch):
+    session_id = store.create(_credentials())
+    monkeypatch.setattr(sessions, "SESSION_TTL_SECONDS", 60)
+    with sqlite3.connect(store.path) as conn:
+        conn.execute("UPDATE sessions SET last_used = ?", (time.time() - 120,))
+
+    assert asyncio.run(store.resolve(session_id)) is None
+
+
+def test_expiring_token_is_refreshed_and_stored(store, monkeypatch):
+    def refresh(self, request):
+        self.token = "access-2"
+        self.expiry = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+
+    monkeypatch.setattr(Credentials, "refresh", refresh)
+    session_id = store.create(_credentials(expires_in=60))
+
+    assert asyncio.run(store.resolve(session_id))["access_token"] == "access-2"
+    # Stored for every worker, and fresh enough not to refresh again
+    assert asyncio.run(store.resolve(session_id))["access_token"] == "access-2"
+
+
+def test_revoked_grant_drops_the_session(store, monkeypatch):
+    def refresh(self, request):
+        raise RefreshError("invalid_grant")
+
+    monkeypatch.setattr(Credentials, "refresh", refresh)
+    session_id = store.create(_credentials(expires_in=60))
+
+    assert asyncio.run(store.resolve(session_id)) is None
+    assert asyncio.run(store.resolve(session_id)) is None
+
+
+def test_concurrent_resolves_share_one_refresh(store, monkeypatch):
+    calls = []
+    release = threading.Event()
+
+    def refresh(self, request):
+        calls.append(1)
+        release.wait(5)
+        self.token = "access-2"
+        self.expiry = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+
+    monkeypatch.setattr(Credentials, "refresh", refresh)
+    session_id = store.create(_credentials(expires_in=60))
+
+    async def run():
+        first = asyncio.create_task(store.resolve(session_id))
+        second = asyncio.create_task(store.resolve(session_id))
+        await asyncio.sleep(0.1)
+        release.set()
+        return await first, await second
+
+    first, second = asyncio.run(run())
+    assert len(calls) == 1
+    assert first["access_token"] == second["access_token"] == "access-2"
+
+
+def test_refresh_lease_is_held_by_one_worker(store):
+    store.create(_credentials())
+    key = store._expiring_keys(3600 * 2)[0]
+
+    assert store._acquire_lease(key) is True
+    assert store._acquire_lease(key) is False
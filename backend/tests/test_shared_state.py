@@ -0,0 +1,74 @@
+import multiprocessing
+import time
+
+import pytest
+
+from services import shared_state
+from services.shared_state import SharedCache, connect, register_migration, sweep_expired
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "state.db")
+
+
+def test_migrations_run_once_in_order(path):
+    applied = []
+    register_migration(path, "test.0001", lambda conn: applied.append("0001"))
+    register_migration(path, "test.0002", lambda conn: applied.append("0002"))
+    connect(path)
+    # Another process starting up finds them recorded in the database
+    shared_state._applied.pop(path)
+    connect(path)
+
+    assert applied == ["0001", "0002"]
+    with connect(path) as conn:
+        names = [row[0] for row in conn.execute("SELECT name FROM schema_migrations ORDER BY applied_at")]
+    assert names == ["test.0001", "test.0002"]
+
+
+def test_entry_quota_keeps_the_newest(path):
+    cache = SharedCache("entries", ttl_seconds=60, path=path, max_entries=2)
+    for key in "abc":
+        cache.set(key, key)
+        time.sleep(0.001)
+
+    assert [cache.get(key) for key in "abc"] == [None, "b", "c"]
+
+
+def test_byte_quota_evicts_until_it_fits(path):
+    cache = SharedCache("bytes", ttl_seconds=60, path=path, max_bytes=25)
+    for key in "abcd":
+        # Each value is 10 bytes of JSON
+        cache.set(key, "x" * 8)
+        time.sleep(0.001)
+
+    assert [cache.get(key) for key in "abcd"] == [None, None, "x" * 8, "x" * 8]
+
+
+def test_sweep_removes_only_expired_entries(path):
+    SharedCache("expired", ttl_seconds=-1, path=path).set("old", 1)
+    fresh = SharedCache("fresh", ttl_seconds=60, path=path)
+    fresh.set("new", 2)
+
+    assert sweep_expired(path) == 1
+    assert fresh.get("new") == 2
+
+
+def _claim_keys(path, claims):
+    cache = SharedCache("claims", ttl_seconds=60, path=path)
+    claimed = sum(1 for key in range(200) if cache.add(str(key)))
+    with claims.get_lock():
+        claims.value += claimed
+
+
+def test_add_claims_each_key_once_across_processes(path):
+    claims = multiprocessing.Value("i", 0)
+    workers = [multiprocessing.Process(target=_claim_keys, args=(path, claims)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert all(worker.exitcode == 0 for worker in workers)
+    assert claims.value == 200
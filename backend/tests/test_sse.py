@@ -0,0 +1,45 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from services import sse
+from services.sse import stream_generation
+
+
+def _events(response):
+    async def collect():
+        return [chunk async for chunk in response.body_iterator]
+
+    events = []
+    for chunk in asyncio.run(collect()):
+        name, data = chunk.strip().split("\n")
+        events.append((name.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return events
+
+
+def test_done_event_carries_model_info(monkeypatch):
+    async def generate_stream(model, prompt):
+        for text in ("Hello", " world"):
+            yield SimpleNamespace(text=text)
+
+    monkeypatch.setattr(sse, "generate_stream", generate_stream)
+    monkeypatch.setattr(sse, "usage_summary", lambda chunk: None)
+
+    # The routers pass model info as `model=`; it must not clash with the Gemini model argument
+    events = _events(stream_generation(object(), "prompt", model={"tier": "lite"}))
+
+    assert events[:2] == [("delta", {"text": "Hello"}), ("delta", {"text": " world"})]
+    assert events[-1] == ("done", {"content": "Hello world", "usage": None, "model": {"tier": "lite"}})
+
+
+def test_failure_part_way_sends_partial_content(monkeypatch):
+    async def generate_stream(model, prompt):
+        yield SimpleNamespace(text="Partial")
+        raise RuntimeError("quota")
+
+    monkeypatch.setattr(sse, "generate_stream", generate_stream)
+    monkeypatch.setattr(sse, "usage_summary", lambda chunk: None)
+
+    events = _events(stream_generation(object(), "prompt"))
+
+    assert events[-1] == ("error", {"error": "quota", "content": "Partial"})
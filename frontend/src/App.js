@@ -74,8 +74,8 @@ function App() {
       const data = await response.json();
       console.log('Authentication successful:', data);
       
-      // Store the access token and user info
-      localStorage.setItem('accessToken', data.access_token);
+      // Store the session id (or raw access token from older backends) and user info
+      localStorage.setItem('accessToken', data.session_id || data.access_token);
       if (data.user_info) {
         localStorage.setItem('userInfo', JSON.stringify(data.user_info));
         setUserInfo(data.user_info);
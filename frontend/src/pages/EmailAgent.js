@@ -1,5 +1,5 @@
-import React, { useState, useEffect } from 'react';
-import { emailService } from '../services/api';
+import React, { useState, useEffect, useRef } from 'react';
+import { emailService, newIdempotencyKey } from '../services/api';
 import { useNavigate } from 'react-router-dom';
 import { MarkdownRenderer } from '../utils/markdown';
 
@@ -11,6 +11,8 @@ const EmailAgent = () => {
   const [draftReply, setDraftReply] = useState('');
   const [replyData, setReplyData] = useState(null); // Store full reply data including threading info
   const [replying, setReplying] = useState(false);
+  // Idempotency key of the reply being sent; kept across retries until it is queued
+  const sendKey = useRef(null);
   const navigate = useNavigate();
 
   useEffect(() => {
@@ -52,6 +54,7 @@ const EmailAgent = () => {
     setDraftReply('');
     setReplyData(null);
     setReplying(false);
+    sendKey.current = null;
   };
 
   const handleGenerateReply = async () => {
@@ -69,6 +72,7 @@ const EmailAgent = () => {
       console.log('Reply generation response:', data);
       
       setReplyData(data); // Store the full reply data
+      sendKey.current = null;
       setDraftReply(data.reply || data.draft_reply || '');
       setReplying(false);
       
@@ -100,6 +104,10 @@ const EmailAgent = () => {
       return;
     }
     
+    if (!sendKey.current) {
+      sendKey.current = newIdempotencyKey();
+    }
+    
     try {
       setError('');
       console.log('Sending email reply...', {
@@ -117,18 +125,20 @@ const EmailAgent = () => {
         replyData.subject, 
         draftReply,
         replyData.in_reply_to,
-        replyData.references
+        replyData.references,
+        sendKey.current
       );
       
-      console.log('Email sent successfully:', response);
+      console.log('Email queued for sending:', response);
       
       // Show success message
-      alert('Email sent successfully!');
+      alert('Email queued for sending!');
       
       // Reset state and fetch emails again
       setSelectedEmail(null);
       setDraftReply('');
       setReplyData(null);
+      sendKey.current = null;
       fetchUnreadEmails();
     } catch (err) {
       console.error('Error sending email:', err);
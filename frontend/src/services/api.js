@@ -68,24 +68,39 @@ export const authService = {
 
 // Email API
 export const emailService = {
-  getUnreadEmails: async () => {
-    const response = await api.get('/email/unread');
+  // mode 'fast' summarises locally instead of with Gemini
+  getUnreadEmails: async (mode = 'auto') => {
+    const response = await api.get('/email/unread', { params: { mode } });
     return response.data;
   },
   draftReply: async (messageId, tone = 'professional') => {
     const response = await api.post('/email/draft-reply', { message_id: messageId, tone });
     return response.data;
   },
-  sendEmail: async (to, subject, body, inReplyTo = null, references = null) => {
+  // Pass the same idempotencyKey when retrying a send so it can't be queued twice
+  sendEmail: async (to, subject, body, inReplyTo = null, references = null, idempotencyKey = null) => {
     const requestBody = { to, subject, body };
     if (inReplyTo) requestBody.in_reply_to = inReplyTo;
     if (references) requestBody.references = references;
     
-    const response = await api.post('/email/send', requestBody);
+    const headers = idempotencyKey ? { 'Idempotency-Key': idempotencyKey } : {};
+    const response = await api.post('/email/send', requestBody, { headers });
+    return response.data;
+  },
+  searchEmails: async (query, limit = 10) => {
+    const response = await api.get('/email/search', { params: { q: query, limit } });
+    return response.data;
+  },
+  getSendStatus: async (outboxId) => {
+    const response = await api.get(`/email/outbox/${outboxId}`);
     return response.data;
   },
 };
 
+// Key identifying one send action, reused on every retry of that send
+export const newIdempotencyKey = () =>
+  window.crypto?.randomUUID?.() || `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+
 // Calendar API
 export const calendarService = {
   getEvents: async () => {
@@ -2,7 +2,8 @@ import {
   emailService, 
   calendarService, 
   documentationService, 
-  codeReviewService 
+  codeReviewService,
+  newIdempotencyKey
 } from '../services/api';
 
 // Email Tools
@@ -77,7 +78,7 @@ export const emailTools = [
     },
     execute: async ({ to, subject, body }) => {
       try {
-        const data = await emailService.sendEmail(to, subject, body);
+        const data = await emailService.sendEmail(to, subject, body, null, null, newIdempotencyKey());
         return data;
       } catch (error) {
         console.error('Error sending email:', error);
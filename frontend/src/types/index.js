@@ -61,32 +61,38 @@
 
 /**
  * @typedef {Object} ProjectPlan
- * @property {string} project_plan - Generated project plan text
+ * @property {string} content - Generated project plan text
+ * @property {string} [project_plan] - Same text, only returned with ?compat=true
  */
 
 /**
  * @typedef {Object} ReportTemplate
- * @property {string} report_template - Generated report template
+ * @property {string} content - Generated report template
+ * @property {string} [report_template] - Same text, only returned with ?compat=true
  */
 
 /**
  * @typedef {Object} PresentationOutline
- * @property {string} presentation_outline - Generated presentation outline
+ * @property {string} content - Generated presentation outline
+ * @property {string} [presentation_outline] - Same text, only returned with ?compat=true
  */
 
 /**
  * @typedef {Object} CodeReview
- * @property {string} code_review - Generated code review
+ * @property {string} content - Generated code review
+ * @property {string} [code_review] - Same text, only returned with ?compat=true
  */
 
 /**
  * @typedef {Object} RefactoringSuggestion
- * @property {string} refactoring_suggestions - Generated refactoring suggestions
+ * @property {string} content - Generated refactoring suggestions
+ * @property {string} [refactoring_suggestions] - Same text, only returned with ?compat=true
  */
 
 /**
  * @typedef {Object} CodeExplanation
- * @property {string} code_explanation - Generated code explanation
+ * @property {string} content - Generated code explanation
+ * @property {string} [code_explanation] - Same text, only returned with ?compat=true
  */
 
 /**